@@ -1,10 +1,16 @@
 import os
+import asyncio
 import pickle
 import re
 import json
 
 from langchain.prompts import FewShotPromptTemplate, PromptTemplate
 from .llm import llm
+from .ResponseParser import extract_json_from_text, stream_json
+from .RuleClassifier import ruleClassify
+from .ExampleSelector import TfidfExampleSelector
+from processor.PromptFormatter import estimate_tokens, prompt_input
+from core.RunContext import RunContext
 import config
 import logging
 
@@ -48,10 +54,7 @@ example_prompt = PromptTemplate(
     template="Input: {text}\nFormat: {format}\nIntent: {intent}\n"
 )
 
-prompt = FewShotPromptTemplate(
-    examples=examples,
-    example_prompt=example_prompt,
-    prefix="""
+prompt_prefix = """
      You are given the shot examples to learn how to format and extract the intent from the given input.
      Act as a classifier agent that classifies the input text into:
        Format (email, json, pdf)
@@ -59,55 +62,105 @@ prompt = FewShotPromptTemplate(
      Give the output in the following JSON format:
      {{ "format": "<format>", "intent": "<intent>" }}
      dont give any other information or explanation.
-    """,
-    suffix="Input: {input}\nFormat:",
+    """
+prompt_suffix = "Input: {input}\nFormat:"
+
+# Only the top-k most similar examples (within the token cap) go into each prompt,
+# instead of the whole example set.
+example_selector = TfidfExampleSelector(
+    examples=examples,
+    example_prompt=example_prompt,
+    k=config.CLASSIFIER_FEWSHOT_K,
+    max_prompt_tokens=config.CLASSIFIER_PROMPT_MAX_TOKENS,
+    reserved_tokens=estimate_tokens(prompt_prefix + prompt_suffix),
+)
+
+prompt = FewShotPromptTemplate(
+    example_selector=example_selector,
+    example_prompt=example_prompt,
+    prefix=prompt_prefix,
+    suffix=prompt_suffix,
     input_variables=["input"]
 )
 
 classifier_chain = prompt | llm
 
-def extract_json_from_text(raw_text: str) -> dict:
+def _classifier_input(input_text, run_ctx: RunContext) -> str:
     """
-    Extracts the substring between the first '{' and the last '}' in the text.
-    Attempts to parse it as JSON and return the object.
-    If parsing fails, returns an empty dictionary.
+    Prompt form of the input, truncated so that the rendered prompt stays within
+    config.CLASSIFIER_PROMPT_MAX_TOKENS even before any example is added (the start
+    of a document is enough to tell its format and intent).
     """
-    logger.debug("Extracting JSON from Classifier LLM output.")
-    start = raw_text.find('{')
-    end = raw_text.rfind('}')
-    
-    if start != -1 and end != -1 and end > start:
-        json_str = raw_text[start:end + 1]
-        try:
-            parsed = json.loads(json_str)
-            logger.debug(f"Successfully parsed JSON: {parsed}")
-            return parsed
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-    else:
-        logger.warning("No JSON brackets found in the output.")
-    
-    return {}
-
-
+    text = prompt_input(input_text, run_ctx, "classifier")
+    budget = config.CLASSIFIER_PROMPT_MAX_TOKENS - example_selector.reserved_tokens
+    tokens = estimate_tokens(text)
+    if tokens > budget:
+        text = text[:max(0, budget - 1) * 4]
+        logger.warning(f"[{run_ctx.run_id}] Classifier input truncated from {tokens} to {estimate_tokens(text)} tokens.")
+        run_ctx.mark_stage("classifier_input_truncated", tokens=tokens, kept_tokens=estimate_tokens(text))
+    return text
+
+async def _record_classification(classification: dict, run_ctx: RunContext, decision: dict) -> dict:
+    """
+    Writes the classification to memory. `decision` is stored in the llm_classification
+    column and records which path decided ("rules" or "llm").
+    """
+    run_id = run_ctx.run_id
+    detected_format = classification.get("format", "")
+    intent = classification.get("intent", "")
+    routed_to = classification.get("format", "unknown")
+    await asyncio.to_thread(update_after_classification, run_id, detected_format, intent, json.dumps(decision), routed_to)
+    run_ctx.mark_stage("classified", detected_format=detected_format, intent=intent, decided_by=decision["decided_by"])
+    logger.info("### Memory Update")
+    logger.info(f"Run ID: {run_id}, Detected Format: {detected_format}, Intent: {intent}, Routed To: {routed_to}, Decided by: {decision['decided_by']}")
+    return classification
+
+def _rule_decision(input_text, run_ctx: RunContext) -> dict:
+    rule_result = ruleClassify(input_text, run_ctx.original_ext)
+    rule_result["accepted"] = rule_result["confidence"] >= config.RULE_CLASSIFIER_THRESHOLD
+    return rule_result
+
+async def _accept_rule_result(rule_result: dict, run_ctx: RunContext) -> dict:
+    classification = {"format": rule_result["format"], "intent": rule_result["intent"]}
+    logger.info(f"Rule-based classification accepted (confidence {rule_result['confidence']}): {classification}")
+    decision = {"decided_by": "rules", "confidence": rule_result["confidence"], "scores": rule_result["scores"]}
+    try:
+        return await _record_classification(classification, run_ctx, decision)
+    except Exception as e:
+        logger.error("Error recording rule-based classification.", exc_info=True)
+        raise ValueError(f"Error recording classification: {e}")
 
-def classifyInput(input_text: str) -> dict:
+async def classifyInput(input_text: str, run_ctx: RunContext) -> dict:
     """
-    Classifies the input text into a format and intent using the LLMChain.
+    Classifies the input text into a format and intent.
+    The deterministic rule classifier decides first; the LLMChain is only invoked when
+    its confidence is below config.RULE_CLASSIFIER_THRESHOLD.
+    Memory updates are written against run_ctx.run_id.
     Returns a dictionary with 'format' and 'intent'.
     """
     logger.info("Classifying input text.")
     logger.info(">>>"*30)
     logger.debug(f"Input text: {input_text}")
     logger.info("<<<"*30)
+    rule_result = _rule_decision(input_text, run_ctx)
+    if rule_result["accepted"]:
+        return await _accept_rule_result(rule_result, run_ctx)
+
     try:
-        llm_output = classifier_chain.invoke({"input": input_text})
+        llm_output = await stream_json(classifier_chain, {"input": _classifier_input(input_text, run_ctx)}, run_ctx, "classifier")
         logger.debug("LLM chain invoked successfully.")
         logger.debug(f"LLM output: {llm_output}")
     except Exception as e:
         logger.error("Error invoking classifier chain.", exc_info=True)
         raise e
 
+    return await _handle_llm_output(llm_output, run_ctx, rule_result)
+
+async def _handle_llm_output(llm_output, run_ctx: RunContext, rule_result: dict) -> dict:
+    """
+    Parses one classifier LLM response and records the result against run_ctx.
+    Shared by classifyInput and classifyBatch.
+    """
     try:
         llm_output = llm_output.content.strip()
         logger.debug(f"LLM output after stripping: {llm_output}")
@@ -122,18 +175,42 @@ def classifyInput(input_text: str) -> dict:
             raise ValueError("No valid JSON found in LLM output.")
         logger.info(f"Classification successful: {classification}")
 
-        run_id = ...           # obtain the proper run_id for this file
-        detected_format = classification.get("format", "")
-        intent = classification.get("intent", "")
-        routed_to = classification.get("format", "unknown")
-        update_after_classification(config.CURRENT_RUN_ID, detected_format, intent, llm_output, routed_to)
-        logger.info("### Memory Update")
-        logger.info(f"Run ID: {config.CURRENT_RUN_ID}, Detected Format: {detected_format}, Intent: {intent}, Routed To: {routed_to}")
-        return classification
+        decision = {"decided_by": "llm", "llm_output": llm_output, "rule_confidence": rule_result["confidence"]}
+        return await _record_classification(classification, run_ctx, decision)
     except Exception as e:
         logger.error("Error extracting classification.", exc_info=True)
         raise ValueError(f"Error extracting classification: {e}")
-    
+
+
+async def classifyBatch(input_texts: list, run_ctxs: list) -> list:
+    """
+    Classifies many input texts. Inputs the rule classifier is confident about are
+    decided without the LLM; the rest go through the classifier chain once using the
+    LLM client's batch API.
+    Returns one entry per input, in order: the parsed dict, or the Exception raised
+    for that input (one bad input does not fail the others).
+    """
+    rule_results = [_rule_decision(text, run_ctx) for text, run_ctx in zip(input_texts, run_ctxs)]
+    llm_indexes = [i for i, rule_result in enumerate(rule_results) if not rule_result["accepted"]]
+    logger.info(f"Classifying {len(input_texts)} inputs in batch, {len(llm_indexes)} through the classifier chain.")
+    llm_outputs = dict(zip(llm_indexes, await classifier_chain.abatch(
+        [{"input": _classifier_input(input_texts[i], run_ctxs[i])} for i in llm_indexes],
+        config={"max_concurrency": config.LLM_BATCH_CONCURRENCY},
+        return_exceptions=True,
+    )))
+
+    async def settle(idx):
+        run_ctx, rule_result = run_ctxs[idx], rule_results[idx]
+        if rule_result["accepted"]:
+            return await _accept_rule_result(rule_result, run_ctx)
+        llm_output = llm_outputs[idx]
+        if isinstance(llm_output, Exception):
+            logger.error(f"[{run_ctx.run_id}] Error invoking classifier chain: {llm_output}")
+            raise llm_output
+        return await _handle_llm_output(llm_output, run_ctx, rule_result)
+
+    # Parse/persist concurrently; a failed input keeps its Exception in its slot
+    return await asyncio.gather(*(settle(i) for i in range(len(input_texts))), return_exceptions=True)
 
 # For testing purposes, you can use this code:
 if __name__ == "__main__":
@@ -159,7 +236,7 @@ if __name__ == "__main__":
     
       Ocr_text:
     """
-    classification = classifyInput(input_text)
+    classification = asyncio.run(classifyInput(input_text, RunContext()))
     print("Classification Result:")
     print(classification)
     # Example output:
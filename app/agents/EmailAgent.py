@@ -1,11 +1,14 @@
 import os
+import asyncio
 import re
-import json
 import logging
 
 from langchain.prompts import PromptTemplate
 from .llm import llm  # Reuse the shared LLM instance
+from .ResponseParser import extract_json_from_text, stream_json
 from memory.MemoryStore import update_email_agent
+from core.RunContext import RunContext
+from processor.PromptFormatter import prompt_input
 import config
 
 # Configure logger for this module
@@ -49,43 +52,27 @@ Respond in the following JSON format:
 # Build the chain by chaining the prompt and LLM
 email_agent_chain = email_extraction_prompt | llm
 
-def extract_json_from_text(raw_text: str) -> dict:
-    """
-    Extracts the substring between the first '{' and the last '}' in the text.
-    Attempts to parse it as JSON and return the object.
-    If parsing fails, returns an empty dictionary.
-    """
-    logger.debug("Extracting JSON from email LLM output.")
-    start = raw_text.find('{')
-    end = raw_text.rfind('}')
-    
-    if start != -1 and end != -1 and end > start:
-        json_str = raw_text[start:end + 1]
-        try:
-            parsed = json.loads(json_str)
-            logger.debug(f"Successfully parsed JSON: {parsed}")
-            return parsed
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-    else:
-        logger.warning("No JSON brackets found in the output.")
-    
-    return {}
-
-def processEmail(email_text: str) -> dict:
+async def processEmail(email_text: str, run_ctx: RunContext) -> dict:
     """
     Processes the email text using the email agent chain.
     Returns a dictionary with the extracted fields.
     """
     logger.info("Processing email text through EmailAgent chain.")
     try:
-        llm_output = email_agent_chain.invoke({"email": email_text})
+        llm_output = await stream_json(email_agent_chain, {"email": prompt_input(email_text, run_ctx, "email_agent")}, run_ctx, "email_agent")
         logger.debug("Email agent chain invoked successfully.")
         logger.debug(f"LLM output: {llm_output}") 
     except Exception as e:
         logger.error("Error invoking email agent chain.", exc_info=True)
         raise e
 
+    return await _handle_llm_output(llm_output, run_ctx)
+
+async def _handle_llm_output(llm_output, run_ctx: RunContext) -> dict:
+    """
+    Parses one email agent LLM response and records the result against run_ctx.
+    Shared by processEmail and processEmailBatch.
+    """
     try:
         output_str = llm_output.content.strip()
         logger.debug(f"LLM output after stripping: {output_str[:200]}...")  # Log first 200 chars
@@ -101,11 +88,12 @@ def processEmail(email_text: str) -> dict:
         logger.info(f"Email processing successful: {extracted}")
 
         
-        run_id = config.CURRENT_RUN_ID
+        run_id = run_ctx.run_id
         email_output = extracted    # this should be a dict
         action_taken = extracted.get("suggested_action" , "unknown")        # or "escalate", etc.
         action_payload = {"extra": "details"}    # any additional details
-        update_email_agent(run_id, email_output, action_taken, action_payload)
+        await asyncio.to_thread(update_email_agent, run_id, email_output, action_taken, action_payload)
+        run_ctx.mark_stage("email_processed", action_taken=action_taken)
         logger.info("#### Memory Update")
         logger.info(f"Email agent run_id: {run_id}, action taken: {action_taken}, payload: {action_payload}")
 
@@ -114,6 +102,32 @@ def processEmail(email_text: str) -> dict:
         logger.error("Error extracting email fields.", exc_info=True)
         raise ValueError(f"Error extracting email fields: {e}")
 
+
+async def processEmailBatch(email_texts: list, run_ctxs: list) -> list:
+    """
+    Runs the email agent chain once over many email texts using the LLM client's batch API.
+    Returns one entry per input, in order: the parsed dict, or the Exception raised
+    for that input (one bad input does not fail the others).
+    """
+    logger.info(f"Processing {len(email_texts)} inputs through email agent chain in batch.")
+    llm_outputs = await email_agent_chain.abatch(
+        [{"email": prompt_input(text, run_ctx, "email_agent")} for text, run_ctx in zip(email_texts, run_ctxs)],
+        config={"max_concurrency": config.LLM_BATCH_CONCURRENCY},
+        return_exceptions=True,
+    )
+
+    async def settle(llm_output, run_ctx):
+        if isinstance(llm_output, Exception):
+            logger.error(f"[{run_ctx.run_id}] Error invoking email agent chain: {llm_output}")
+            raise llm_output
+        return await _handle_llm_output(llm_output, run_ctx)
+
+    # Parse/persist concurrently; a failed input keeps its Exception in its slot
+    return await asyncio.gather(
+        *(settle(llm_output, run_ctx) for llm_output, run_ctx in zip(llm_outputs, run_ctxs)),
+        return_exceptions=True,
+    )
+
 # For testing purposes
 if __name__ == "__main__":
     sample_email = """
@@ -132,7 +146,7 @@ John Doe
 8121812181
 example@gmail.com
 """
-    result = processEmail(sample_email)
+    result = asyncio.run(processEmail(sample_email, RunContext()))
     logger.info("Extracted Email Fields:")
     logger.info(result)
     print(result)
@@ -0,0 +1,93 @@
+import re
+import math
+import logging
+from collections import Counter
+
+from langchain_core.example_selectors import BaseExampleSelector
+from processor.PromptFormatter import estimate_tokens
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _terms(text: str) -> Counter:
+    return Counter(TOKEN_RE.findall(str(text).lower()))
+
+
+class TfidfExampleSelector(BaseExampleSelector):
+    """
+    Local few-shot example selector: picks the top-k examples most similar to the input
+    by TF-IDF cosine similarity. The index is built once when the selector is created.
+
+    Selected examples are also limited by a token budget: examples are added in order
+    of similarity while the rendered prompt stays under `max_prompt_tokens`
+    (input + `reserved_tokens` for the fixed prefix/suffix + examples).
+    """
+
+    def __init__(self, examples: list, example_prompt, text_key: str = "text", input_key: str = "input",
+                 k: int = 3, max_prompt_tokens: int = 3000, reserved_tokens: int = 0):
+        self.example_prompt = example_prompt
+        self.text_key = text_key
+        self.input_key = input_key
+        self.k = k
+        self.max_prompt_tokens = max_prompt_tokens
+        self.reserved_tokens = reserved_tokens
+        self.examples = []
+        self._term_counts = []
+        self._doc_freq = Counter()
+        self._vectors = []
+        for example in examples:
+            self._index(example)
+        self._rebuild_vectors()
+        logger.info(f"Indexed {len(self.examples)} few-shot examples (k={k}, max_prompt_tokens={max_prompt_tokens}).")
+
+    def _index(self, example: dict):
+        terms = _terms(example[self.text_key])
+        self.examples.append(example)
+        self._term_counts.append(terms)
+        self._doc_freq.update(terms.keys())
+
+    def _idf(self, term: str) -> float:
+        # Smoothed idf; unseen terms get the maximum weight but match nothing
+        return math.log((1 + len(self.examples)) / (1 + self._doc_freq.get(term, 0))) + 1.0
+
+    def _vectorize(self, terms: Counter) -> dict:
+        vector = {term: (1 + math.log(count)) * self._idf(term) for term, count in terms.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {term: weight / norm for term, weight in vector.items()}
+
+    def _rebuild_vectors(self):
+        self._vectors = [self._vectorize(terms) for terms in self._term_counts]
+        # Rendered size of each example, used for the token budget
+        self._example_tokens = [estimate_tokens(self.example_prompt.format(**example)) for example in self.examples]
+
+    def add_example(self, example: dict):
+        self._index(example)
+        self._rebuild_vectors()
+
+    def select_examples(self, input_variables: dict) -> list:
+        query_text = str(input_variables.get(self.input_key, ""))
+        query = self._vectorize(_terms(query_text))
+        scores = [
+            sum(weight * vector.get(term, 0.0) for term, weight in query.items())
+            for vector in self._vectors
+        ]
+        ranked = sorted(range(len(self.examples)), key=lambda i: scores[i], reverse=True)
+
+        budget = self.max_prompt_tokens - self.reserved_tokens - estimate_tokens(query_text)
+        selected = []
+        for idx in ranked[:self.k]:
+            if self._example_tokens[idx] > budget:
+                continue
+            budget -= self._example_tokens[idx]
+            selected.append(idx)
+        logger.debug(f"Selected few-shot examples {selected} (scores {[round(scores[i], 3) for i in selected]}).")
+        return [self.examples[i] for i in selected]
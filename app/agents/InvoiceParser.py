@@ -0,0 +1,324 @@
+import re
+import math
+import logging
+
+from .JsonRules import normalize_key, parse_date
+from processor.PromptFormatter import collapse_whitespace
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+# Layout-aware invoice extraction from the pages produced by extract_text_and_tables,
+# run in front of the PDF agent LLM. Header fields come from labelled lines
+# ("Invoice Number: INV-1", or the label on one line and the value on the next),
+# line items from table rows under a recognized header row or from
+# "Description: ..., Quantity: ..., Amount: ..." lines. The sum and threshold checks
+# of the PDF agent prompt are applied in code, and the result carries a confidence
+# score: PdfAgent only skips the LLM above config.INVOICE_PARSER_MIN_CONFIDENCE.
+
+# Labels per header field, most specific first; a value found under an earlier label wins
+LABELS = {
+    "invoice_number": [r"invoice\s*(?:number|no\.?|#|id)"],
+    "issue_date": [r"(?:invoice|issue)\s*date", r"date\s*of\s*issue", r"date"],
+    "due_date": [r"due\s*date", r"payment\s*due(?:\s*date)?"],
+    "customer_name": [r"customer\s*name", r"bill(?:ed)?\s*to", r"customer", r"client"],
+    "currency": [r"currency"],
+    "subtotal": [r"sub\s*-?\s*total"],
+    "tax_amount": [r"(?:total\s*)?(?:tax|vat|gst)(?:\s*amount)?(?:\s*\d+(?:[.,]\d+)?\s*%)?"],
+    "total_amount": [r"total\s*amount", r"grand\s*total", r"amount\s*due", r"balance\s*due", r"total(?!\s*(?:tax|vat|gst))"],
+}
+FIELD_TYPES = {"issue_date": "date", "due_date": "date", "subtotal": "number", "tax_amount": "number", "total_amount": "number"}
+# "Customer No", "VAT No." and the like label identifiers, not the field itself
+NOT_AN_ID = r"(?![\s.]*(?:(?:no|number|id)\b|#))"
+LABEL_RES = {
+    field: [
+        re.compile(rf"^\s*{label}{NOT_AN_ID if field != 'invoice_number' else ''}\s*[:#.]?\s*(.*)$", re.IGNORECASE)
+        for label in labels
+    ]
+    for field, labels in LABELS.items()
+}
+
+# Line item columns, matched against the start of the normalized header cell
+COLUMNS = {
+    "tax": ["tax", "vat", "gst"],
+    "quantity": ["qty", "quantity", "units", "hours"],
+    "unit_price": ["unitprice", "unitcost", "price", "rate"],
+    "amount": ["amount", "linetotal", "total", "net"],
+    "description": ["description", "item", "product", "service", "details", "particulars"],
+}
+SUMMARY_ROW_RE = re.compile(r"^\s*(?:sub\s*-?\s*total|total|tax|vat|gst|balance|amount\s*due|discount|shipping)\b", re.IGNORECASE)
+ITEM_PAIR_RE = re.compile(r"([A-Za-z][A-Za-z ]*?)\s*:\s*([^,]+)")
+
+CURRENCY_CODES = ("USD", "EUR", "GBP", "INR", "JPY", "CHF", "CAD", "AUD", "CNY", "SEK", "NOK", "DKK", "PLN", "AED", "SGD")
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "₹": "INR", "¥": "JPY"}
+CURRENCY_RE = re.compile(rf"\b({'|'.join(CURRENCY_CODES)})\b|([{''.join(CURRENCY_SYMBOLS)}])")
+AMOUNT_RE = re.compile(r"\(?-?\d[\d.,' ]*\)?")
+
+ALERT_THRESHOLD = 10000       # same threshold as the PDF agent prompt
+AMOUNT_TOLERANCE = 0.01
+
+# Confidence = sum of the weights of what was found; "reconciled" means the line
+# items add up to the total. A mismatch may be a parsing miss, so it caps the
+# confidence at MISMATCH_CONFIDENCE (below any sensible gate) and the LLM takes a
+# second look.
+CONFIDENCE_WEIGHTS = {
+    "invoice_number": 0.2, "total_amount": 0.25, "line_items": 0.2, "reconciled": 0.1,
+    "issue_date": 0.1, "customer_name": 0.1, "currency": 0.05,
+}
+MISMATCH_CONFIDENCE = 0.5
+
+
+def parse_amount(value):
+    """
+    Parses a money amount as printed on invoices: "1,234.50", "1.234,50", "USD 6300",
+    "(25.00)". The last of "." and "," is the decimal separator when both appear; a
+    lone "," is decimal only when followed by exactly two digits. None if no number.
+    """
+    match = AMOUNT_RE.search(str(value or ""))
+    if match is None:
+        return None
+    text = match.group(0).strip()
+    negative = text.startswith("(") and text.endswith(")") or text.lstrip("(").startswith("-")
+    digits = re.sub(r"[^\d.,]", "", text)
+    if "." in digits and "," in digits:
+        decimal = "." if digits.rfind(".") > digits.rfind(",") else ","
+    elif "," in digits:
+        decimal = "," if re.search(r",\d{2}$", digits) and digits.count(",") == 1 else None
+    elif digits.count(".") == 1:
+        decimal = "."
+    else:
+        decimal = None
+    if decimal is None:
+        digits = digits.replace(".", "").replace(",", "")
+    else:
+        thousands = "," if decimal == "." else "."
+        digits = digits.replace(thousands, "").replace(decimal, ".")
+    try:
+        number = float(digits)
+    except ValueError:
+        return None
+    return -number if negative else number
+
+
+def find_currency(text):
+    match = CURRENCY_RE.search(str(text or ""))
+    if match is None:
+        return None
+    return match.group(1) or CURRENCY_SYMBOLS[match.group(2)]
+
+
+def _page_lines(pdf_text) -> list:
+    """
+    Text lines of the document; each table row is added as one line too (cells joined
+    by spaces) so that summary rows like "Total | 6300" are found as labelled values.
+    """
+    if isinstance(pdf_text, str):
+        return collapse_whitespace(pdf_text).splitlines()
+    lines = []
+    for page in pdf_text or []:
+        for key in ("text", "ocr_text"):
+            lines.extend(collapse_whitespace(page.get(key)).splitlines())
+        for table in page.get("tables") or []:
+            for row in table or []:
+                lines.append(" ".join(str(cell).strip() for cell in row if cell not in (None, "")))
+    return [line for line in lines if line.strip()]
+
+
+def _convert(field: str, value: str):
+    """Typed value of a header field, or None when the text is not a valid value."""
+    value = value.strip()
+    if not value:
+        return None
+    kind = FIELD_TYPES.get(field)
+    if kind == "date":
+        parsed = parse_date(value)
+        return parsed.isoformat() if parsed else None
+    if kind == "number":
+        return parse_amount(value)
+    if field == "currency":
+        return find_currency(value) or value.split()[0].upper()
+    return value
+
+
+def extract_fields(lines: list) -> dict:
+    """Header fields from labelled lines; a label alone on a line takes the next line as value."""
+    found = {}   # field -> (label priority, value)
+    for i, line in enumerate(lines):
+        for field, patterns in LABEL_RES.items():
+            for priority, pattern in enumerate(patterns):
+                if field in found and found[field][0] <= priority:
+                    break
+                match = pattern.match(line)
+                if match is None:
+                    continue
+                raw = match.group(1) or (lines[i + 1] if i + 1 < len(lines) else "")
+                value = _convert(field, raw)
+                if value is not None:
+                    found[field] = (priority, value)
+                    if field == "total_amount" and "currency" not in found and find_currency(raw):
+                        found["currency"] = (len(LABEL_RES["currency"]), find_currency(raw))
+                    break
+    return {field: value for field, (_, value) in found.items()}
+
+
+def _column(header: str):
+    normalized = normalize_key(header)
+    if not normalized:
+        return None
+    for column, prefixes in COLUMNS.items():
+        if any(normalized.startswith(prefix) for prefix in prefixes):
+            return column
+    return None
+
+
+def _make_item(values: dict):
+    """Line item dict from column values, or None when it has no description or amount."""
+    description = str(values.get("description") or "").strip()
+    if not description or SUMMARY_ROW_RE.match(description):
+        return None
+    item = {"description": description}
+    for column in ("quantity", "unit_price", "tax", "amount"):
+        number = parse_amount(values.get(column))
+        if number is not None:
+            item[column] = number
+    if "amount" not in item and "quantity" in item and "unit_price" in item:
+        item["amount"] = item["quantity"] * item["unit_price"] + item.get("tax", 0.0)
+    return item if "amount" in item else None
+
+
+def _table_items(table: list) -> list:
+    """Line items of a pdfplumber table whose header row names a description and an amount column."""
+    items, layout = [], None
+    for row in table or []:
+        cells = [str(cell).strip() if cell is not None else "" for cell in row]
+        if layout is None:
+            columns = {}
+            for position, cell in enumerate(cells):
+                column = _column(cell)
+                if column is not None:
+                    columns.setdefault(column, position)
+            if "description" in columns and ("amount" in columns or {"quantity", "unit_price"} <= columns.keys()):
+                layout = columns
+            continue
+        item = _make_item({column: cells[position] for column, position in layout.items() if position < len(cells)})
+        if item is not None:
+            items.append(item)
+    return items
+
+
+def _text_items(lines: list) -> list:
+    """Line items written as "Description: ..., Quantity: ..., Amount: ..." lines."""
+    items = []
+    for line in lines:
+        if "description" not in line.lower():
+            continue
+        values = {}
+        for key, value in ITEM_PAIR_RE.findall(line):
+            column = _column(key)
+            if column is not None:
+                values.setdefault(column, value)
+        item = _make_item(values)
+        if item is not None:
+            items.append(item)
+    return items
+
+
+def extract_line_items(pdf_text, lines: list) -> list:
+    items = []
+    if not isinstance(pdf_text, str):
+        for page in pdf_text or []:
+            for table in page.get("tables") or []:
+                items.extend(_table_items(table))
+    return items or _text_items(lines)
+
+
+def _anomaly(field: str, description: str, severity: str) -> dict:
+    return {"field": field, "description": description, "severity": severity}
+
+
+def parse_invoice(pdf_text):
+    """
+    Extracts an invoice from the extracted PDF pages (or plain text) without the LLM.
+    Returns the PDF agent result shape ({"document_type": "invoice", "extracted_data",
+    "anomalies", "suggested_action"}) plus "confidence" and "validated_by": "rules",
+    or None when the document does not look like an invoice.
+    """
+    lines = _page_lines(pdf_text)
+    data = extract_fields(lines)
+    if "invoice_number" not in data and not any("invoice" in line.lower() for line in lines):
+        return None
+    line_items = extract_line_items(pdf_text, lines)
+    if line_items:
+        data["line_items"] = line_items
+
+    anomalies = []
+    total = data.get("total_amount")
+    reconciled = mismatched = False
+    if line_items and total is not None:
+        items_total = math.fsum(item["amount"] for item in line_items)
+        adjusted = items_total + (data.get("tax_amount") or 0.0)
+        reconciled = abs(items_total - total) <= AMOUNT_TOLERANCE or abs(adjusted - total) <= AMOUNT_TOLERANCE
+        if not reconciled:
+            mismatched = True
+            anomalies.append(_anomaly(
+                "total_amount",
+                f"Total amount {total} does not match the sum of line items {round(items_total, 2)}.",
+                "critical",
+            ))
+    if total is not None and total > ALERT_THRESHOLD:
+        anomalies.append(_anomaly("total_amount", "Invoice total exceeds threshold of 10,000.", "critical"))
+    if data.get("issue_date") and data.get("due_date") and data["due_date"] < data["issue_date"]:
+        anomalies.append(_anomaly("due_date", "Due date is before issue date.", "critical"))
+
+    present = set(data) | ({"reconciled"} if reconciled else set())
+    confidence = round(sum(weight for key, weight in CONFIDENCE_WEIGHTS.items() if key in present), 2)
+    if mismatched:
+        confidence = min(confidence, MISMATCH_CONFIDENCE)
+    critical = any(a["severity"] == "critical" for a in anomalies)
+    result = {
+        "document_type": "invoice",
+        "extracted_data": data,
+        "anomalies": anomalies,
+        "suggested_action": "trigger_alert" if critical else "log_and_close",
+        "confidence": confidence,
+        "validated_by": "rules",
+    }
+    logger.debug(f"Layout invoice parse (confidence {confidence}): {result}")
+    return result
+
+
+# For testing purposes
+if __name__ == "__main__":
+    sample_text = """
+Invoice Document
+
+Invoice Number: INV-98765
+Issue Date: 2025-06-01
+Due Date: 2025-06-15
+Customer Name: XYZ Corporation
+Line Items:
+  - Description: Consulting Service, Quantity: 2, Unit Price: 3000, Tax: 300, Amount: 6300
+Currency: USD
+Total Amount: 6300
+"""
+    sample_pages = [{
+        "page_number": 1,
+        "text": "ACME GmbH\nInvoice No\n123100401\nDate\n01.03.2024\nBill To: Musterkunde AG",
+        "ocr_text": "",
+        "tables": [[
+            ["Description", "Qty", "Unit Price", "Amount"],
+            ["Basic Fee", "1", "130,00 €", "130,00 €"],
+            ["Transaction Fee", "14", "0,58 €", "8,12 €"],
+            ["", "", "Total", "138,12 €"],
+        ]],
+    }]
+    mismatched_text = sample_text.replace("Total Amount: 6300", "Total Amount: 9100")
+    print(parse_invoice(sample_text))
+    print(parse_invoice(sample_pages))
+    print(parse_invoice(mismatched_text))
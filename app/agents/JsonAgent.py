@@ -1,11 +1,16 @@
 import os
+import asyncio
 import re
-import json
 import logging
 
 from langchain.prompts import PromptTemplate
 from .llm import llm  # Reuse the shared LLM instance
+from .ResponseParser import extract_json_from_text, stream_json
+from .JsonRules import validate_payload, document_ids
+from memory.DuplicateIndex import duplicate_index, apply_duplicates
 from memory.MemoryStore import update_json_agent
+from core.RunContext import RunContext
+from processor.PromptFormatter import prompt_input
 import config
 
 # Configure logger for this module
@@ -77,44 +82,58 @@ Here is the JSON payload to validate:
 # Build the chain by chaining the prompt and the shared LLM
 json_agent_chain = json_validation_prompt | llm
 
-def extract_json_from_text(raw_text: str) -> dict:
+async def _check_duplicates(payload, run_ctx: RunContext) -> list:
     """
-    Extracts the substring between the first '{' and the last '}' in the text.
-    Attempts to parse it as JSON and return the object.
-    If parsing fails, returns an empty dictionary.
+    Records the payload's document IDs in the duplicate-ID index and returns the ones
+    seen before. Runs before any LLM call.
     """
-    logger.debug("Extracting JSON from JSON agent output.")
-    start = raw_text.find('{')
-    end = raw_text.rfind('}')
-    
-    if start != -1 and end != -1 and end > start:
-        json_str = raw_text[start:end + 1]
-        try:
-            parsed = json.loads(json_str)
-            logger.debug(f"Successfully parsed JSON: {parsed}")
-            return parsed
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-    else:
-        logger.warning("No JSON brackets found in the output.")
-    
-    return {}
-
-def processJson(payload_text: str) -> dict:
+    if not config.DUPLICATE_INDEX_ENABLED:
+        return []
+    ids = document_ids(payload)
+    if not ids:
+        return []
+    duplicates = await asyncio.to_thread(duplicate_index.check_and_record, ids, run_ctx.run_id)
+    run_ctx.mark_stage("duplicate_check", ids=len(ids), duplicates=len(duplicates))
+    return duplicates
+
+def _duplicate_result(duplicates: list) -> dict:
+    # A duplicate ID decides the outcome (invalid, trigger_alert) without the LLM
+    return apply_duplicates({"status": "invalid", "anomalies": [], "validated_by": "duplicate_index"}, duplicates)
+
+async def processJson(payload_text: str, run_ctx: RunContext) -> dict:
     """
-    Processes the JSON payload using the JSON agent chain.
+    Validates the JSON payload. Document IDs are checked against the duplicate-ID index
+    first; invoices, quotations and payslips are then checked by the deterministic rule
+    engine (agents/JsonRules.py). Only payloads that match no schema and carry no
+    duplicate ID go through the JSON agent chain.
     Returns a dictionary with the validation result.
     """
+    duplicates = await _check_duplicates(payload_text, run_ctx)
+    # CPU-bound for large line-item arrays; keep it off the event loop
+    rule_result = await asyncio.to_thread(validate_payload, payload_text)
+    if rule_result is not None:
+        logger.info(f"JSON payload validated by rules as {rule_result['document_type']}.")
+        return await _record_json_output(apply_duplicates(rule_result, duplicates), run_ctx)
+    if duplicates:
+        return await _record_json_output(_duplicate_result(duplicates), run_ctx)
+
     logger.info("Processing JSON payload through JsonAgent chain.")
 
     try:
-        llm_output = json_agent_chain.invoke({"payload": payload_text})
+        llm_output = await stream_json(json_agent_chain, {"payload": prompt_input(payload_text, run_ctx, "json_agent")}, run_ctx, "json_agent")
         logger.debug("JsonAgent chain invoked successfully.")
         logger.debug(f"LLM output: {llm_output}")
     except Exception as e:
         logger.error("Error invoking JSON agent chain.", exc_info=True)
         raise e
 
+    return await _handle_llm_output(llm_output, run_ctx)
+
+async def _handle_llm_output(llm_output, run_ctx: RunContext) -> dict:
+    """
+    Parses one JSON agent LLM response and records the result against run_ctx.
+    Shared by processJson and processJsonBatch.
+    """
     try:
         output_str = llm_output.content.strip()
         logger.debug(f"LLM output after stripping: {output_str[:200]}...")  # Log first 200 chars
@@ -127,21 +146,66 @@ def processJson(payload_text: str) -> dict:
         if not extracted:
             logger.error("No valid JSON extracted from JSON agent output.")
             raise ValueError("No valid JSON found in LLM output.")
-        logger.info(f"JSON validation successful: {extracted}")
+        extracted.setdefault("validated_by", "llm")
+    except Exception as e:
+        logger.error("Error extracting JSON validation result.", exc_info=True)
+        raise ValueError(f"Error extracting JSON validation result: {e}")
+
+    return await _record_json_output(extracted, run_ctx)
 
-        run_id = config.CURRENT_RUN_ID
+async def _record_json_output(extracted: dict, run_ctx: RunContext) -> dict:
+    logger.info(f"JSON validation successful: {extracted}")
+    try:
+        run_id = run_ctx.run_id
         json_output = extracted
         action_taken = extracted.get("suggested_action" , "unknown")  # if anomalies exist, for example
         action_payload = {  }         # additional info
-        update_json_agent(run_id, json_output, action_taken, action_payload)
+        await asyncio.to_thread(update_json_agent, run_id, json_output, action_taken, action_payload)
+        run_ctx.mark_stage("json_processed", action_taken=action_taken, validated_by=extracted.get("validated_by"))
         logger.info("#### Memory Update")
         logger.info(f"JSON agent run_id: {run_id}, action taken: {action_taken}, payload: {action_payload}")
 
 
         return extracted
     except Exception as e:
-        logger.error("Error extracting JSON validation result.", exc_info=True)
-        raise ValueError(f"Error extracting JSON validation result: {e}")
+        logger.error("Error recording JSON validation result.", exc_info=True)
+        raise ValueError(f"Error recording JSON validation result: {e}")
+
+
+async def processJsonBatch(payload_texts: list, run_ctxs: list) -> list:
+    """
+    Validates many JSON payloads. Payloads the rule engine can validate, or that carry a
+    duplicate ID, skip the LLM; the rest go through the JSON agent chain once using the LLM client's batch API.
+    Returns one entry per input, in order: the parsed dict, or the Exception raised
+    for that input (one bad input does not fail the others).
+    """
+    duplicates = await asyncio.gather(*(_check_duplicates(text, run_ctx) for text, run_ctx in zip(payload_texts, run_ctxs)))
+    rule_results = await asyncio.gather(*(asyncio.to_thread(validate_payload, text) for text in payload_texts))
+    for i, rule_result in enumerate(rule_results):
+        if rule_result is not None:
+            apply_duplicates(rule_result, duplicates[i])
+        elif duplicates[i]:
+            rule_results[i] = _duplicate_result(duplicates[i])
+    llm_indexes = [i for i, rule_result in enumerate(rule_results) if rule_result is None]
+    logger.info(f"Processing {len(payload_texts)} inputs in batch, {len(llm_indexes)} through the JSON agent chain.")
+    llm_outputs = dict(zip(llm_indexes, await json_agent_chain.abatch(
+        [{"payload": prompt_input(payload_texts[i], run_ctxs[i], "json_agent")} for i in llm_indexes],
+        config={"max_concurrency": config.LLM_BATCH_CONCURRENCY},
+        return_exceptions=True,
+    )))
+
+    async def settle(idx):
+        run_ctx = run_ctxs[idx]
+        if rule_results[idx] is not None:
+            return await _record_json_output(rule_results[idx], run_ctx)
+        llm_output = llm_outputs[idx]
+        if isinstance(llm_output, Exception):
+            logger.error(f"[{run_ctx.run_id}] Error invoking JSON agent chain: {llm_output}")
+            raise llm_output
+        return await _handle_llm_output(llm_output, run_ctx)
+
+    # Parse/persist concurrently; a failed input keeps its Exception in its slot
+    return await asyncio.gather(*(settle(i) for i in range(len(payload_texts))), return_exceptions=True)
 
 # For testing purposes, you can run this script directly.
 if __name__ == "__main__":
@@ -175,7 +239,7 @@ if __name__ == "__main__":
   "paymentStatus": "PAYMENT_SUCCESS"
 }
 """
-    result = processJson(test_payload)
+    result = asyncio.run(processJson(test_payload, RunContext()))
     logger.info("JSON Validation Result:")
     logger.info(result)
     print(result)
\ No newline at end of file
@@ -0,0 +1,404 @@
+import os
+import re
+import json
+import math
+import logging
+import functools
+from datetime import datetime, date
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+# Deterministic schema and business-rule validation run in front of the JSON agent LLM.
+# Each document type lists its fields with the aliases they appear under; field names
+# are matched after normalization (lowercase, letters and digits only), so
+# "invoiceNumber", "invoice_number" and "Invoice Number" are the same key.
+# A payload is validated here when it matches a schema; otherwise the LLM decides.
+
+SCHEMAS = {
+    "invoice": {
+        # Keys whose presence identifies the document type
+        "identify": ["invoice_id", "invoice_number", "invoice_no", "invoice_reference_no", "invoice_date"],
+        "fields": {
+            "invoice_id": {"aliases": ["invoice_id", "invoice_number", "invoice_no", "invoice_reference_no", "document_number", "number"], "type": "string", "required": True},
+            "issue_date": {"aliases": ["issue_date", "invoice_date", "date", "issued_at", "created_at"], "type": "date", "required": True},
+            "due_date": {"aliases": ["due_date", "payment_due", "due"], "type": "date"},
+            "total_amount": {"aliases": ["total_amount", "total", "grand_total", "amount_due", "amount", "total_price"], "type": "number", "required": True},
+            "subtotal": {"aliases": ["subtotal", "sub_total", "net_amount"], "type": "number"},
+            "tax_amount": {"aliases": ["tax_amount", "tax", "vat", "tax_total"], "type": "number"},
+            "shipping": {"aliases": ["shipping", "shipping_amount", "freight"], "type": "number"},
+            "discount": {"aliases": ["discount", "discount_amount"], "type": "number"},
+            "currency": {"aliases": ["currency", "currency_code"], "type": "string"},
+            "vendor": {"aliases": ["vendor", "seller", "supplier", "from"], "type": "any"},
+            "customer": {"aliases": ["customer", "customer_name", "buyer", "bill_to", "client"], "type": "any"},
+        },
+        "line_items": ["items", "line_items", "lines", "products"],
+    },
+    "quotation": {
+        "identify": ["quote_id", "quote_number", "quotation_id", "quotation_number", "valid_until"],
+        "fields": {
+            "quote_id": {"aliases": ["quote_id", "quote_number", "quotation_id", "quotation_number", "quote_no"], "type": "string", "required": True},
+            "issue_date": {"aliases": ["issue_date", "quote_date", "quotation_date", "date", "created_at"], "type": "date", "required": True},
+            "valid_until": {"aliases": ["valid_until", "expiry_date", "expires_at", "validity"], "type": "date"},
+            "total_amount": {"aliases": ["total_amount", "total", "grand_total", "amount", "total_price"], "type": "number", "required": True},
+            "subtotal": {"aliases": ["subtotal", "sub_total"], "type": "number"},
+            "tax_amount": {"aliases": ["tax_amount", "tax", "vat"], "type": "number"},
+            "discount": {"aliases": ["discount", "discount_amount"], "type": "number"},
+            "currency": {"aliases": ["currency", "currency_code"], "type": "string"},
+            "vendor": {"aliases": ["vendor", "seller", "supplier"], "type": "any"},
+            "customer": {"aliases": ["customer", "customer_name", "buyer", "client"], "type": "any"},
+        },
+        "line_items": ["items", "line_items", "lines", "products"],
+    },
+    "payslip": {
+        "identify": ["net_pay", "gross_salary", "gross_pay", "pay_period", "payslip_id"],
+        "fields": {
+            "employee_id": {"aliases": ["employee_id", "emp_id", "employee_number"], "type": "string", "required": True},
+            "employee_name": {"aliases": ["employee_name", "employee", "name"], "type": "any"},
+            "pay_period": {"aliases": ["pay_period", "period", "pay_date", "payment_date"], "type": "period", "required": True},
+            "gross_pay": {"aliases": ["gross_salary", "gross_pay", "gross", "gross_earnings"], "type": "number", "required": True},
+            "net_pay": {"aliases": ["net_pay", "net_salary", "take_home"], "type": "number", "required": True},
+            "deductions": {"aliases": ["deductions", "total_deductions"], "type": "any"},
+            "currency": {"aliases": ["currency", "currency_code"], "type": "string"},
+            "payslip_id": {"aliases": ["payslip_id", "slip_id"], "type": "string"},
+        },
+        "line_items": [],
+    },
+}
+
+# Document identifiers recorded in the duplicate-ID index (memory/DuplicateIndex.py)
+ID_FIELDS = {
+    "invoice_id": ["invoice_id", "invoice_number", "invoice_no", "invoice_reference_no"],
+    "quote_id": ["quote_id", "quote_number", "quotation_id", "quotation_number", "quote_no"],
+    "receipt_number": ["receipt_number", "receipt_no", "receipt_id"],
+    "request_reference_number": ["request_reference_number", "request_reference_no"],
+}
+
+# Line item fields
+ITEM_AMOUNT = ["amount", "line_total", "total", "total_amount", "totalamount"]
+ITEM_QUANTITY = ["quantity", "qty", "units"]
+ITEM_PRICE = ["price", "unit_price", "unit_cost", "rate"]
+ITEM_TAX_RATE = ["tax_rate", "vat_rate", "gst_rate"]
+ITEM_TAX = ["tax", "tax_amount", "vat"]
+ITEM_CURRENCY = ["currency", "currency_code"]
+
+# Keys describing the document itself; never reported as extra fields
+META_KEYS = {"intent", "type", "document_type", "document", "header", "transaction", "status", "id", "version", "notes", "note"}
+
+MAX_ITEM_ANOMALIES = 10       # per-item anomalies reported before they are summarized
+AMOUNT_TOLERANCE = 0.01
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d", "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%Y-%m")
+PERIOD_DATE_RE = re.compile(r"\d{4}-\d{2}(?:-\d{2})?")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_key(key) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(key).lower())
+
+
+def _compile(names: list) -> list:
+    return [normalize_key(name) for name in names]
+
+
+COMPILED_SCHEMAS = {
+    doc_type: {
+        "identify": set(_compile(schema["identify"])),
+        "fields": {name: dict(spec, aliases=_compile(spec["aliases"])) for name, spec in schema["fields"].items()},
+        "line_items": _compile(schema["line_items"]),
+    }
+    for doc_type, schema in SCHEMAS.items()
+}
+COMPILED_ID_FIELDS = {id_type: _compile(aliases) for id_type, aliases in ID_FIELDS.items()}
+ITEM_KEYS = {name: _compile(aliases) for name, aliases in {
+    "amount": ITEM_AMOUNT, "quantity": ITEM_QUANTITY, "price": ITEM_PRICE,
+    "tax_rate": ITEM_TAX_RATE, "tax": ITEM_TAX, "currency": ITEM_CURRENCY,
+}.items()}
+
+
+def _index_fields(payload: dict) -> dict:
+    """
+    Maps every normalized key of the payload (nested objects included, arrays not) to
+    (path, value). Breadth first, so a top-level key wins over a nested one.
+    """
+    index, queue = {}, [("", payload)]
+    while queue:
+        prefix, obj = queue.pop(0)
+        for key, value in obj.items():
+            path = f"{prefix}{key}"
+            index.setdefault(normalize_key(key), (path, value))
+            if isinstance(value, dict):
+                queue.append((f"{path}.", value))
+    return index
+
+
+def _lookup(index: dict, aliases: list):
+    for alias in aliases:
+        if alias in index:
+            return index[alias]
+    return None
+
+
+def to_number(value):
+    """Parses numbers, numeric strings ("1,200.50", "$19") and {"value": n} objects; None otherwise."""
+    if type(value) is float:
+        return value
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict) and "value" in value:
+        return to_number(value["value"])
+    if isinstance(value, str):
+        cleaned = re.sub(r"[^\d.\-]", "", value)
+        try:
+            return float(cleaned) if cleaned else None
+        except ValueError:
+            return None
+    return None
+
+
+def parse_date(value):
+    if not isinstance(value, str) or not value.strip():
+        return None
+    text = value.strip()
+    try:
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).date()
+    except ValueError:
+        pass
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _period_end(value):
+    """Latest date mentioned by a pay period ("2025-05", "2025-05-01 to 2025-05-31", {"start", "end"})."""
+    if isinstance(value, dict):
+        dates = [parse_date(v) for v in value.values() if isinstance(v, str)]
+    else:
+        dates = [parse_date(match) for match in PERIOD_DATE_RE.findall(str(value))]
+    dates = [d for d in dates if d is not None]
+    return max(dates) if dates else None
+
+
+def _anomaly(field: str, description: str, severity: str) -> dict:
+    return {"field": field, "description": description, "severity": severity}
+
+
+def detect_type(index: dict):
+    """Returns the document type whose identifying keys (or declared type) the payload has, or None."""
+    declared = {normalize_key(index[k][1]) for k in ("intent", "type", "documenttype") if k in index and isinstance(index[k][1], str)}
+    for doc_type, schema in COMPILED_SCHEMAS.items():
+        if doc_type in declared or schema["identify"] & index.keys():
+            return doc_type
+    return None
+
+
+@functools.lru_cache(maxsize=256)
+def _item_layout(keys: tuple) -> dict:
+    """Maps each line item field to the key it uses, for one set of item keys."""
+    normalized = {normalize_key(key): key for key in keys}
+    return {
+        name: next((normalized[a] for a in aliases if a in normalized), None)
+        for name, aliases in ITEM_KEYS.items()
+    }
+
+
+def _check_line_items(items: list, path: str, currencies: dict, anomalies: list):
+    """
+    Single pass over the line items. Items of an array nearly always share their keys,
+    so the alias resolution is done once per distinct key set (_item_layout).
+    Returns the sum of the line totals, or None when a line total cannot be computed.
+    """
+    totals, item_anomalies, incomplete = [], 0, False
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            incomplete = True
+            continue
+        layout = _item_layout(tuple(item))
+        get = lambda name: item[layout[name]] if layout[name] is not None else None
+        amount = to_number(get("amount"))
+        quantity, price = to_number(get("quantity")), to_number(get("price"))
+        if amount is None and quantity is not None and price is not None:
+            amount = quantity * price
+            tax_rate, tax = to_number(get("tax_rate")), to_number(get("tax"))
+            if tax is not None:
+                amount += tax
+            elif tax_rate is not None:
+                amount *= 1 + tax_rate / 100
+        if amount is None:
+            incomplete = True
+            item_anomalies += 1
+            if item_anomalies <= MAX_ITEM_ANOMALIES:
+                anomalies.append(_anomaly(f"{path}[{i}]", "Line item has no amount and no quantity/price.", "minor"))
+        else:
+            totals.append(amount)
+        currency = get("currency")
+        if isinstance(currency, str) and currency.strip():
+            currencies.setdefault(currency.strip().upper(), f"{path}[{i}].currency")
+    if item_anomalies > MAX_ITEM_ANOMALIES:
+        anomalies.append(_anomaly(path, f"{item_anomalies - MAX_ITEM_ANOMALIES} more line items without an amount.", "minor"))
+    return None if incomplete or not totals else math.fsum(totals)
+
+
+def validate_document(payload: dict, doc_type: str, index: dict = None, today: date = None) -> list:
+    """Returns the anomalies of one payload against the schema and business rules of doc_type."""
+    today = today or date.today()
+    index = index if index is not None else _index_fields(payload)
+    schema = COMPILED_SCHEMAS[doc_type]
+    anomalies, values, used_keys = [], {}, set()
+
+    # Schema: required fields and types
+    for name, spec in schema["fields"].items():
+        found = _lookup(index, spec["aliases"])
+        if found is None:
+            if spec.get("required"):
+                anomalies.append(_anomaly(name, f"Required field '{name}' is missing.", "critical"))
+            continue
+        path, value = found
+        used_keys.add(normalize_key(path.split(".")[0]))
+        if spec["type"] == "number":
+            number = to_number(value)
+            if number is None:
+                anomalies.append(_anomaly(path, f"Field '{path}' is not a number.", "critical"))
+            elif isinstance(value, str):
+                anomalies.append(_anomaly(path, f"Field '{path}' is a number stored as a string.", "minor"))
+            values[name] = number
+        elif spec["type"] == "date":
+            parsed = parse_date(value)
+            if parsed is None:
+                anomalies.append(_anomaly(path, f"Field '{path}' is not a recognizable date.", "minor"))
+            values[name] = parsed
+        elif spec["type"] == "period":
+            values[name] = _period_end(value)
+        elif spec["type"] == "string" and not isinstance(value, (str, int)):
+            anomalies.append(_anomaly(path, f"Field '{path}' should be a string.", "minor"))
+        values.setdefault(name, value)
+
+    # Business rules
+    issue_date, due_date = values.get("issue_date"), values.get("due_date")
+    if isinstance(issue_date, date) and issue_date > today:
+        anomalies.append(_anomaly("issue_date", f"Issue date {issue_date} is in the future.", "critical"))
+    if isinstance(issue_date, date) and isinstance(due_date, date) and due_date < issue_date:
+        anomalies.append(_anomaly("due_date", "Due date is before issue date.", "critical"))
+    pay_period = values.get("pay_period")
+    if isinstance(pay_period, date) and pay_period > today:
+        anomalies.append(_anomaly("pay_period", f"Pay period ending {pay_period} is in the future.", "critical"))
+    gross, net = values.get("gross_pay"), values.get("net_pay")
+    if isinstance(gross, float) and isinstance(net, float) and net > gross + AMOUNT_TOLERANCE:
+        anomalies.append(_anomaly("net_pay", f"Net pay {net} exceeds gross pay {gross}.", "critical"))
+
+    currencies = {}
+    currency = values.get("currency")
+    if isinstance(currency, str) and currency.strip():
+        currencies[currency.strip().upper()] = "currency"
+    line_items = next((index[a] for a in schema["line_items"] if a in index and isinstance(index[a][1], list)), None)
+    if line_items is not None:
+        items_path, items = line_items
+        used_keys.add(normalize_key(items_path.split(".")[0]))
+        items_total = _check_line_items(items, items_path, currencies, anomalies)
+        total = values.get("total_amount")
+        if items_total is not None and isinstance(total, float):
+            adjustments = math.fsum(values.get(k) or 0.0 for k in ("tax_amount", "shipping")) - (values.get("discount") or 0.0)
+            if abs(items_total - total) > AMOUNT_TOLERANCE and abs(items_total + adjustments - total) > AMOUNT_TOLERANCE:
+                anomalies.append(_anomaly(
+                    "total_amount",
+                    f"Total amount {total} does not match the sum of line items {round(items_total, 2)}.",
+                    "critical",
+                ))
+    if len(currencies) > 1:
+        anomalies.append(_anomaly("currency", f"Inconsistent currencies: {', '.join(sorted(currencies))}.", "critical"))
+
+    # Extra top-level fields are accepted but reported once
+    extra = [key for key in payload if normalize_key(key) not in used_keys and normalize_key(key) not in META_KEYS]
+    if extra:
+        anomalies.append(_anomaly(", ".join(extra), "Fields not in the schema.", "minor"))
+    return anomalies
+
+
+def _documents(payload):
+    """The payload as a list of objects (a single object or an array of them), or None."""
+    if isinstance(payload, str):
+        try:
+            payload = json.loads(payload)
+        except json.JSONDecodeError:
+            return None
+    documents = payload if isinstance(payload, list) else [payload]
+    if not documents or not all(isinstance(doc, dict) for doc in documents):
+        return None
+    return documents
+
+
+def document_ids(payload) -> list:
+    """
+    Identifiers of every document in the payload as (id_type, value, field) tuples,
+    for the duplicate-ID index. Works for any payload, whether or not a schema matches.
+    """
+    documents = _documents(payload) or []
+    ids = []
+    for i, document in enumerate(documents):
+        index = _index_fields(document)
+        for id_type, aliases in COMPILED_ID_FIELDS.items():
+            found = _lookup(index, aliases)
+            if found is not None and isinstance(found[1], (str, int)) and not isinstance(found[1], bool):
+                path = found[0] if len(documents) == 1 else f"[{i}].{found[0]}"
+                ids.append((id_type, found[1], path))
+    return ids
+
+
+def validate_payload(payload, today: date = None):
+    """
+    Validates a JSON payload (object, or array of objects) without the LLM.
+    Returns the JSON agent result shape ({"status", "anomalies", "suggested_action"}
+    plus "document_type" and "validated_by": "rules"), or None when any document
+    matches no schema and the LLM has to decide.
+    """
+    documents = _documents(payload)
+    if documents is None:
+        return None
+
+    anomalies, doc_types = [], []
+    for i, document in enumerate(documents):
+        index = _index_fields(document)
+        doc_type = detect_type(index)
+        if doc_type is None:
+            return None
+        doc_types.append(doc_type)
+        for anomaly in validate_document(document, doc_type, index, today):
+            if len(documents) > 1:
+                anomaly["field"] = f"[{i}].{anomaly['field']}"
+            anomalies.append(anomaly)
+
+    critical = any(a["severity"] == "critical" for a in anomalies)
+    result = {
+        "status": "invalid" if critical else "valid",
+        "anomalies": anomalies,
+        "suggested_action": "trigger_alert" if critical else "log_and_close",
+        "document_type": doc_types[0] if len(set(doc_types)) == 1 else doc_types,
+        "validated_by": "rules",
+    }
+    logger.debug(f"Rule-based JSON validation: {result}")
+    return result
+
+
+# For testing purposes: run the rules over the sample JSON files
+if __name__ == "__main__":
+    sample_root = os.path.join(os.path.dirname(__file__), "..", "..", "sampleFiles", "json")
+    for name in sorted(os.listdir(sample_root)):
+        with open(os.path.join(sample_root, name), "r", encoding="utf-8") as f:
+            try:
+                content = json.load(f)
+            except json.JSONDecodeError:
+                print(f"{name}: not valid JSON")
+                continue
+        result = validate_payload(content)
+        print(f"{name}: {'-> LLM' if result is None else (result['status'], result['anomalies'])}")
@@ -0,0 +1,307 @@
+import re
+import json
+import logging
+from collections import deque
+
+from processor.PromptFormatter import format_table
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+# Regulatory keyword scanning for policy documents in front of the PDF agent LLM.
+# All terms are compiled into one Aho-Corasick automaton, so a document is scanned
+# in a single pass whose cost grows with the document, not with the vocabulary.
+# Text and terms are compared case-insensitively with runs of whitespace, "-" and
+# "_" treated as one space ("Sarbanes-Oxley" == "sarbanes  oxley"); a match must
+# start and end on a word boundary ("SOX" does not match inside "SOXHLET").
+
+# Regulation -> the variants it is mentioned under (the name itself only matches when
+# listed, so "DORA" is not matched as a first name). Extended or overridden by the
+# JSON file at config.REGULATORY_KEYWORDS_FILE (same shape).
+REGULATIONS = {
+    "GDPR": ["GDPR", "General Data Protection Regulation", "EU 2016/679"],
+    "HIPAA": ["HIPAA", "Health Insurance Portability and Accountability Act"],
+    "FDA": ["FDA", "Food and Drug Administration", "21 CFR Part 11"],
+    "SOX": ["SOX", "Sarbanes-Oxley", "Sarbanes Oxley Act", "SOX 404"],
+    "CCPA": ["CCPA", "California Consumer Privacy Act", "CPRA"],
+    "PCI DSS": ["PCI DSS", "PCI-DSS", "Payment Card Industry Data Security Standard"],
+    "GLBA": ["GLBA", "Gramm-Leach-Bliley Act"],
+    "FERPA": ["FERPA", "Family Educational Rights and Privacy Act"],
+    "COPPA": ["COPPA", "Children's Online Privacy Protection Act"],
+    "FCPA": ["FCPA", "Foreign Corrupt Practices Act"],
+    "FISMA": ["FISMA", "Federal Information Security Management Act"],
+    "AML": ["Anti-Money Laundering", "AML policy", "Bank Secrecy Act"],
+    "KYC": ["KYC", "Know Your Customer"],
+    "ISO 27001": ["ISO 27001", "ISO/IEC 27001"],
+    "SOC 2": ["SOC 2", "SOC2"],
+    "NIST": ["NIST 800-53", "NIST SP 800-53", "NIST Cybersecurity Framework"],
+    "MiFID II": ["MiFID II", "MiFID 2"],
+    "Basel III": ["Basel III"],
+    "Dodd-Frank": ["Dodd-Frank", "Dodd Frank Act"],
+    "DORA": ["Digital Operational Resilience Act"],
+    "NIS2": ["NIS2", "NIS 2 Directive"],
+    "EU AI Act": ["EU AI Act", "Artificial Intelligence Act"],
+    "PIPEDA": ["PIPEDA"],
+    "LGPD": ["LGPD", "Lei Geral de Proteção de Dados"],
+}
+
+# Markers used to decide whether a document is clearly a policy document. Each distinct
+# marker counts once; one used as a heading ("Data Protection Policy", "1. Scope",
+# "Effective Date: ...") counts HEADING_WEIGHT times, since letters and contracts
+# mention policies in running text too.
+POLICY_MARKERS = [
+    "policy", "policies", "procedure", "procedures", "code of conduct", "compliance",
+    "privacy notice", "terms and conditions", "data protection", "scope", "purpose",
+    "responsibilities", "effective date",
+]
+INVOICE_MARKERS = ["invoice", "bill to", "amount due", "balance due", "unit price", "receipt"]
+HEADING_WEIGHT = 2
+HEADING_MAX_WORDS = 8
+NUMBERING_RE = re.compile(r"[\s\d.)(§-]*")     # "1.", "2.1)", "§ 3" before a heading
+
+SEPARATORS = set(" \t\r\n\f\v-_ ")
+
+
+def _normalize(text: str):
+    """
+    Lowercases text and collapses runs of separators into one space. Returns the
+    normalized string and, for each of its characters, the offset in the original.
+    """
+    chars, offsets, in_gap = [], [], False
+    for i, ch in enumerate(text):
+        if ch in SEPARATORS:
+            if not in_gap and chars:
+                chars.append(" ")
+                offsets.append(i)
+            in_gap = True
+            continue
+        in_gap = False
+        chars.append(ch.lower())
+        offsets.append(i)
+    return "".join(chars), offsets
+
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over normalized terms. Each term carries a (category, label)
+    payload; find() yields (start, end, payload) for every word-bounded match.
+    """
+
+    def __init__(self, terms: dict):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for term, payload in terms.items():
+            normalized = _normalize(term)[0].strip()
+            if not normalized:
+                continue
+            state = 0
+            for ch in normalized:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = nxt
+            self.output[state].append((len(normalized), payload))
+
+        # Failure links, breadth first; outputs of the fallback state are inherited
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def find(self, normalized: str):
+        goto, fail, output = self.goto, self.fail, self.output
+        state, size = 0, len(normalized)
+        for i, ch in enumerate(normalized):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, payload in output[state]:
+                start = i - length + 1
+                if (start == 0 or not normalized[start - 1].isalnum()) and (i + 1 == size or not normalized[i + 1].isalnum()):
+                    yield start, i + 1, payload
+
+
+def load_vocabulary(path: str = "") -> dict:
+    """REGULATIONS merged with the JSON file at `path` ({"Regulation": ["variant", ...]})."""
+    vocabulary = {name: list(variants) for name, variants in REGULATIONS.items()}
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            for name, variants in json.load(f).items():
+                vocabulary[name] = list(variants)
+    return vocabulary
+
+
+def _is_heading(text: str, start: int, end: int) -> bool:
+    """
+    Whether the match text[start:end] is a heading: it opens its line (after any
+    numbering) or closes it (a "... Policy" title), on a short line that is not a
+    sentence. Text after a ":" ("Effective Date: 1 May 2024") does not count.
+    """
+    line_start = text.rfind("\n", 0, start) + 1
+    line_end = text.find("\n", end)
+    line_end = len(text) if line_end == -1 else line_end
+    line = text[line_start:line_end].strip()
+    if line.endswith(".") or len(line.split(":")[0].split()) > HEADING_MAX_WORDS:
+        return False
+    opens = NUMBERING_RE.fullmatch(text[line_start:start]) is not None
+    closes = text[end:line_end].strip() in ("", ":")
+    return opens or closes
+
+
+def _page_sections(pdf_text):
+    """(page_number, text) for every page of the extracted PDF (or plain text as page 1)."""
+    if isinstance(pdf_text, str):
+        yield 1, pdf_text
+        return
+    for index, page in enumerate(pdf_text or [], 1):
+        parts = [page.get("text") or "", page.get("ocr_text") or ""]
+        parts.extend(format_table(table) for table in page.get("tables") or [])
+        yield page.get("page_number", index), "\n".join(part for part in parts if part)
+
+
+class KeywordScanner:
+    """
+    Scans extracted PDF pages for regulatory terms plus policy and invoice markers in
+    one automaton pass per page. Hits carry the page number and the character offset
+    of the match in that page's text (text, OCR text and tables, newline-joined).
+    """
+
+    def __init__(self, vocabulary: dict):
+        terms = {}
+        for name, variants in vocabulary.items():
+            for variant in variants:
+                terms[variant] = ("regulation", name)
+        for marker in POLICY_MARKERS:
+            terms.setdefault(marker, ("policy", marker))
+        for marker in INVOICE_MARKERS:
+            terms.setdefault(marker, ("invoice", marker))
+        self.automaton = KeywordAutomaton(terms)
+        self.terms = len(terms)
+
+    def scan(self, pdf_text) -> dict:
+        """
+        Returns {"hits": [{"regulation", "matched", "page", "offset"}], "policy_markers"
+        (distinct markers found), "policy_headings" (those used as headings),
+        "policy_score" and "invoice_markers" (count)}.
+        """
+        hits, policy, headings, invoice_markers = [], set(), set(), 0
+        for page_number, text in _page_sections(pdf_text):
+            normalized, offsets = _normalize(text)
+            last = {}   # regulation -> (start, end, index in hits) of its last hit on this page
+            for start, end, (category, label) in self.automaton.find(normalized):
+                if category == "invoice":
+                    invoice_markers += 1
+                    continue
+                if category == "policy":
+                    policy.add(label)
+                    if label not in headings and _is_heading(text, offsets[start], offsets[end - 1] + 1):
+                        headings.add(label)
+                    continue
+                hit = {
+                    "regulation": label,
+                    "matched": text[offsets[start]:offsets[end - 1] + 1],
+                    "page": page_number,
+                    "offset": offsets[start],
+                }
+                previous = last.get(label)
+                if previous is not None and start < previous[1]:
+                    # Overlapping variants of one mention ("SOX" in "SOX 404"): keep the longer
+                    if end - start > previous[1] - previous[0]:
+                        hits[previous[2]] = hit
+                        last[label] = (start, end, previous[2])
+                    continue
+                last[label] = (start, end, len(hits))
+                hits.append(hit)
+        return {
+            "hits": hits,
+            "policy_markers": sorted(policy),
+            "policy_headings": sorted(headings),
+            "policy_score": len(policy) + (HEADING_WEIGHT - 1) * len(headings),
+            "invoice_markers": invoice_markers,
+        }
+
+    def is_policy(self, scan: dict) -> bool:
+        """
+        Clearly a policy document whose result the scan alone decides: it mentions at
+        least one regulation, has a policy heading and a policy score of at least
+        config.POLICY_MIN_MARKERS, and no invoice markers. Anything else goes to the LLM.
+        """
+        return (
+            bool(scan["hits"])
+            and bool(scan["policy_headings"])
+            and scan["invoice_markers"] == 0
+            and scan["policy_score"] >= config.POLICY_MIN_MARKERS
+        )
+
+
+def keyword_anomalies(hits: list) -> list:
+    """One critical anomaly per regulation mentioned, in the PDF agent anomaly shape."""
+    by_regulation = {}
+    for hit in hits:
+        by_regulation.setdefault(hit["regulation"], []).append(hit)
+    return [
+        {
+            "field": "regulatory_keywords",
+            "description": (
+                f"Document references {regulation} ({len(found)} mention{'s' if len(found) > 1 else ''}, "
+                f"first on page {found[0]['page']} at offset {found[0]['offset']}); compliance relevant."
+            ),
+            "severity": "critical",
+        }
+        for regulation, found in by_regulation.items()
+    ]
+
+
+def policy_result(scan: dict, max_hits: int = 50) -> dict:
+    """PDF agent result for a policy document flagged by the scanner alone."""
+    anomalies = keyword_anomalies(scan["hits"])
+    return {
+        "document_type": "policy",
+        "extracted_data": {
+            "regulatory_keywords": sorted({hit["regulation"] for hit in scan["hits"]}),
+            "keyword_hits": scan["hits"][:max_hits],
+        },
+        "anomalies": anomalies,
+        "suggested_action": "trigger_alert" if anomalies else "log_and_close",
+        "validated_by": "rules",
+    }
+
+
+keyword_scanner = KeywordScanner(load_vocabulary(config.REGULATORY_KEYWORDS_FILE))
+
+
+# For testing purposes
+if __name__ == "__main__":
+    sample = [
+        {"page_number": 1, "text": "Data Protection Policy\nPurpose and scope of this policy.", "ocr_text": "", "tables": []},
+        {"page_number": 2, "text": "We comply with the gdpr and the Sarbanes -\nOxley act.\nHamlet and Dora are not regulations.", "ocr_text": "", "tables": []},
+    ]
+    complaint = (
+        "Dear Sir or Madam,\n\nI am writing to complain about your refund policy. Your staff "
+        "said your procedures shall not change and that you must not share my data under the GDPR, "
+        "yet compliance with your own terms and conditions and with data protection law is lacking.\n"
+        "Yours faithfully,\nJ. Doe"
+    )
+    scan = keyword_scanner.scan(sample)
+    print(f"{keyword_scanner.terms} terms; policy: {keyword_scanner.is_policy(scan)}")
+    print(policy_result(scan))
+    complaint_scan = keyword_scanner.scan(complaint)
+    print(f"complaint letter: policy: {keyword_scanner.is_policy(complaint_scan)}, {complaint_scan['policy_markers']}")
@@ -1,11 +1,20 @@
 import os
+import time
+import asyncio
 import re
-import json
 import logging
+from collections import Counter
 
 from langchain.prompts import PromptTemplate
 from .llm import llm  # Reuse the shared LLM instance
-from memory.MemoryStore import update_pdf_agent
+from .ResponseParser import extract_json_from_text, stream_json
+from .InvoiceParser import parse_invoice
+from .JsonRules import normalize_key
+from .KeywordScanner import keyword_scanner, policy_result
+from processor.PromptFormatter import estimate_tokens, format_pages, prompt_input, to_prompt_text
+from memory.DuplicateIndex import duplicate_index, apply_duplicates
+from memory.MemoryStore import update_pdf_agent, record_event
+from core.RunContext import RunContext
 import config
 
 
@@ -71,44 +80,239 @@ Here is the extracted PDF text:
 # Build the chain by chaining the prompt with the shared LLM
 pdf_agent_chain = pdf_extraction_prompt | llm
 
-def extract_json_from_text(raw_text: str) -> dict:
-    """
-    Extracts the substring between the first '{' and the last '}' in the text.
-    Attempts to parse it as JSON and return the object.
-    If parsing fails, returns an empty dictionary.
-    """
-    logger.debug("Extracting JSON from Pdf agent output.")
-    start = raw_text.find('{')
-    end = raw_text.rfind('}')
-    
-    if start != -1 and end != -1 and end > start:
-        json_str = raw_text[start:end + 1]
-        try:
-            parsed = json.loads(json_str)
-            logger.debug(f"Successfully parsed JSON: {parsed}")
-            return parsed
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {e}")
-    else:
-        logger.warning("No JSON brackets found in the output.")
-    
-    return {}
-
-def processPdf(pdf_text: str) -> dict:
+# "Invoice Number: INV-98765", "Invoice No. 42", "Invoice # A/2025/7". Only the label
+# is case-insensitive; the ID must contain a digit, so words after the label
+# ("Invoice number field", "INVOICE ID WHEN ...") are not taken for IDs.
+INVOICE_NUMBER_RE = re.compile(r"\b(?i:invoice\s*(?:number|no\.?|#|id))\s*[:#.]?\s*((?=[A-Z0-9\-/]*\d)[A-Z0-9][A-Z0-9\-/]*)")
+
+def chunk_pages(pdf_text, max_tokens: int) -> list:
+    """
+    Splits the page list produced by extract_text_and_tables into consecutive chunks of
+    at most max_tokens (estimated). A page larger than max_tokens gets a chunk of its own.
+    Plain-text input is returned as a single chunk.
+    """
+    if not isinstance(pdf_text, list):
+        return [pdf_text]
+    chunks, current, current_tokens = [], [], 0
+    for page in pdf_text:
+        page_tokens = estimate_tokens(format_pages([page]))
+        if current and current_tokens + page_tokens > max_tokens:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(page)
+        current_tokens += page_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _to_number(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[^\d.\-]", "", str(value or ""))
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+def _merge_values(first, second, path: str, conflicts: list):
+    """
+    Merges two partial extractions: lists are concatenated (line items), dicts merged
+    key by key, and for scalars the first non-empty value wins (conflicts are recorded).
+    """
+    if first in (None, "", [], {}):
+        return second
+    if second in (None, "", [], {}):
+        return first
+    if isinstance(first, list) and isinstance(second, list):
+        return first + second
+    if isinstance(first, dict) and isinstance(second, dict):
+        merged = dict(first)
+        for key, value in second.items():
+            merged[key] = _merge_values(merged.get(key), value, f"{path}.{key}" if path else key, conflicts)
+        return merged
+    if first != second:
+        conflicts.append(path)
+    return first
+
+# Key names the LLM uses for the fields the merge recomputes, in order of preference
+# (exact normalized matches, as in JsonRules: "subtotal" or "tax_amount" are no totals)
+TOTAL_ALIASES = ["total_amount", "total", "grand_total", "invoice_total", "amount_due", "total_price"]
+LINE_ITEM_ALIASES = ["line_items", "items", "lines", "products"]
+ITEM_AMOUNT_ALIASES = ["amount", "line_total", "total", "total_amount", "total_price"]
+# The line-item sum check, as worded by the prompt's anomalies and by merge_chunk_results
+SUM_CHECK_RE = re.compile(r"\bsum\b.*\bline[ _]?items?\b", re.IGNORECASE)
+
+def _find_field(data: dict, aliases: list):
+    """Returns the value of the first alias present among the keys (normalized), else None."""
+    keys = {normalize_key(key): value for key, value in data.items()}
+    for alias in aliases:
+        value = keys.get(normalize_key(alias))
+        if value is not None:
+            return value
+    return None
+
+def _is_sum_check(anomaly: dict) -> bool:
+    field = normalize_key(anomaly.get("field", ""))
+    return field in {normalize_key(alias) for alias in TOTAL_ALIASES} and bool(SUM_CHECK_RE.search(str(anomaly.get("description", ""))))
+
+def merge_chunk_results(partials: list) -> dict:
+    """
+    Reduces the per-chunk PDF agent results into one result in the usual shape:
+    line items are concatenated, header fields reconciled, and the anomaly list is
+    recomputed for the whole document (sum check and 10,000 threshold).
+    """
+    document_types = Counter(p.get("document_type") for p in partials if p.get("document_type"))
+    conflicts = []
+    extracted_data = {}
+    for partial in partials:
+        extracted_data = _merge_values(extracted_data, partial.get("extracted_data") or {}, "", conflicts)
+
+    anomalies, seen = [], set()
+    for partial in partials:
+        for anomaly in partial.get("anomalies") or []:
+            key = (str(anomaly.get("field", "")).lower(), str(anomaly.get("description", "")).lower())
+            if key not in seen:
+                seen.add(key)
+                anomalies.append(anomaly)
+
+    line_items = _find_field(extracted_data, LINE_ITEM_ALIASES)
+    total = _to_number(_find_field(extracted_data, TOTAL_ALIASES))
+    if isinstance(line_items, list) and line_items and total is not None:
+        # Each chunk only saw part of the line items, so chunk-level sum checks are unreliable
+        anomalies = [a for a in anomalies if not _is_sum_check(a)]
+        amounts = [_to_number(_find_field(item, ITEM_AMOUNT_ALIASES)) for item in line_items if isinstance(item, dict)]
+        if amounts and None not in amounts and abs(sum(amounts) - total) > 0.01:
+            anomalies.append({
+                "field": "total_amount",
+                "description": f"Total amount {total} does not match the sum of line items {round(sum(amounts), 2)}.",
+                "severity": "critical",
+            })
+    if total is not None and total > 10000 and not any("threshold" in str(a.get("description", "")).lower() for a in anomalies):
+        anomalies.append({
+            "field": "total_amount",
+            "description": "Invoice total exceeds threshold of 10,000.",
+            "severity": "critical",
+        })
+    for field in conflicts:
+        anomalies.append({
+            "field": field,
+            "description": "Conflicting values extracted from different pages; kept the first one.",
+            "severity": "minor",
+        })
+
+    critical = any(str(a.get("severity", "")).lower() == "critical" for a in anomalies)
+    return {
+        "document_type": document_types.most_common(1)[0][0] if document_types else "",
+        "extracted_data": extracted_data,
+        "anomalies": anomalies,
+        "suggested_action": "trigger_alert" if critical else "log_and_close",
+    }
+
+async def _check_duplicates(pdf_text, run_ctx: RunContext) -> list:
+    """
+    Records the invoice numbers found in the extracted text in the duplicate-ID index
+    and returns the ones seen before. Runs before the LLM call.
+    """
+    if not config.DUPLICATE_INDEX_ENABLED:
+        return []
+    numbers = dict.fromkeys(INVOICE_NUMBER_RE.findall(to_prompt_text(pdf_text)))
+    if not numbers:
+        return []
+    ids = [("invoice_id", number, "invoice_number") for number in numbers]
+    duplicates = await asyncio.to_thread(duplicate_index.check_and_record, ids, run_ctx.run_id)
+    run_ctx.mark_stage("duplicate_check", ids=len(ids), duplicates=len(duplicates))
+    return duplicates
+
+async def _parse_invoice(pdf_text, run_ctx: RunContext):
+    """
+    Runs the layout-aware invoice parser; returns its result when the confidence is at
+    least config.INVOICE_PARSER_MIN_CONFIDENCE, otherwise None (the LLM decides).
+    """
+    parsed = await asyncio.to_thread(parse_invoice, pdf_text)
+    if parsed is None:
+        return None
+    run_ctx.mark_stage("invoice_parsed", confidence=parsed["confidence"])
+    if parsed["confidence"] < config.INVOICE_PARSER_MIN_CONFIDENCE:
+        logger.info(f"[{run_ctx.run_id}] Invoice parser confidence {parsed['confidence']} too low, using the LLM.")
+        return None
+    return parsed
+
+async def _scan_policy(pdf_text, run_ctx: RunContext):
+    """
+    Runs the regulatory keyword scanner (agents/KeywordScanner.py); returns the policy
+    result with one anomaly per regulation mentioned when the document is clearly a
+    policy document that mentions a regulation, otherwise None (the LLM decides).
+    """
+    scan = await asyncio.to_thread(keyword_scanner.scan, pdf_text)
+    run_ctx.mark_stage("keyword_scan", hits=len(scan["hits"]), policy_score=scan["policy_score"])
+    if not keyword_scanner.is_policy(scan):
+        return None
+    return policy_result(scan)
+
+async def _extract_without_llm(pdf_text, run_ctx: RunContext):
+    """Result of the invoice parser or the policy scanner, or None when the LLM is needed."""
+    return await _parse_invoice(pdf_text, run_ctx) or await _scan_policy(pdf_text, run_ctx)
+
+async def _process_pdf_chunked(chunks: list, run_ctx: RunContext, duplicates: list = ()) -> dict:
+    """
+    Map-reduce mode for large PDFs: the extraction prompt runs on every chunk
+    concurrently and the partial results are merged with merge_chunk_results.
+    Each chunk's input is recorded as a "pdf_chunk_<i>_input" stage; the totals go to
+    the "pdf_agent_input" and "pdf_agent_llm" stages and an "llm_call" event.
+    """
+    logger.info(f"[{run_ctx.run_id}] Processing PDF in {len(chunks)} chunks.")
+    inputs = [prompt_input(chunk, run_ctx, f"pdf_chunk_{i}") for i, chunk in enumerate(chunks)]
+    run_ctx.mark_stage("pdf_agent_input", chunks=len(chunks), tokens=sum(estimate_tokens(text) for text in inputs))
+    started = time.perf_counter()
+    llm_outputs = await pdf_agent_chain.abatch(
+        [{"pdf_text": text} for text in inputs],
+        config={"max_concurrency": config.PDF_CHUNK_CONCURRENCY},
+        return_exceptions=True,
+    )
+    failed = [i for i, llm_output in enumerate(llm_outputs) if isinstance(llm_output, Exception)]
+    details = {"purpose": "pdf_agent", "seconds": round(time.perf_counter() - started, 3), "chunks": len(chunks), "failed_chunks": failed}
+    run_ctx.mark_stage("pdf_agent_llm", **details)
+    await asyncio.to_thread(record_event, run_ctx.run_id, "llm_call", details)
+    for i in failed:
+        logger.error(f"[{run_ctx.run_id}] PDF agent chain failed on chunk {i + 1}/{len(chunks)}: {llm_outputs[i]!r}")
+    if failed:
+        raise llm_outputs[failed[0]]
+    partials = [_parse_llm_output(llm_output) for llm_output in llm_outputs]
+    run_ctx.mark_stage("pdf_chunked", chunks=len(chunks))
+    return await _record_pdf_output(merge_chunk_results(partials), run_ctx, duplicates)
+
+async def processPdf(pdf_text: str, run_ctx: RunContext) -> dict:
     """
     Processes extracted PDF text using the PDF agent chain.
+    PDFs larger than config.PDF_CHUNK_TOKENS are processed in chunks (map-reduce).
+    Invoice numbers are checked against the duplicate-ID index before the LLM call, and
+    invoices the layout parser (agents/InvoiceParser.py) reads with high confidence
+    and clearly policy documents (agents/KeywordScanner.py) skip the LLM.
     Returns a dictionary containing documents type, extracted data, anomalies, and suggested action.
     """
+    duplicates = await _check_duplicates(pdf_text, run_ctx)
+    parsed = await _extract_without_llm(pdf_text, run_ctx)
+    if parsed is not None:
+        logger.info(f"[{run_ctx.run_id}] {parsed['document_type'].capitalize()} document handled without the LLM.")
+        return await _record_pdf_output(parsed, run_ctx, duplicates)
+
+    chunks = chunk_pages(pdf_text, config.PDF_CHUNK_TOKENS)
+    if len(chunks) > 1:
+        return await _process_pdf_chunked(chunks, run_ctx, duplicates)
+
     logger.info("Processing PDF text through PDF agent chain.")
 
     try:
-        llm_output = pdf_agent_chain.invoke({"pdf_text": pdf_text})
+        llm_output = await stream_json(pdf_agent_chain, {"pdf_text": prompt_input(pdf_text, run_ctx, "pdf_agent")}, run_ctx, "pdf_agent")
         logger.debug("PDF agent chain invoked successfully.")
         logger.debug(f"LLM output: {llm_output}")  # Log the raw LLM output
     except Exception as e:
         logger.error("Error invoking PDF agent chain.", exc_info=True)
         raise e
 
+    return await _handle_llm_output(llm_output, run_ctx, duplicates)
+
+def _parse_llm_output(llm_output) -> dict:
     try:
         # Ensure we have a string output and strip whitespace
         output_str = str(llm_output.content).strip()
@@ -122,23 +326,71 @@ def processPdf(pdf_text: str) -> dict:
         if not extracted:
             logger.error("No valid JSON extracted from LLM output.")
             raise ValueError("No valid JSON found in LLM output.")
-        logger.info(f"PDF processing successful, extracted data: {extracted}")
+        return extracted
+    except Exception as e:
+        logger.error("Error extracting PDF data.", exc_info=True)
+        raise ValueError(f"Error extracting PDF validation result: {e}")
 
-        
-        run_id = config.CURRENT_RUN_ID  # Obtain the proper run_id for this file
+async def _record_pdf_output(extracted: dict, run_ctx: RunContext, duplicates: list = ()) -> dict:
+    apply_duplicates(extracted, duplicates)
+    logger.info(f"PDF processing successful, extracted data: {extracted}")
+    try:
+        run_id = run_ctx.run_id
         pdf_output = extracted     # dict from PdfAgent processing
         action_taken = extracted.get("suggested_action" , "unknown")      # or another action based on thresholds
         action_payload = { }              # include any details regarding anomalies
-        update_pdf_agent(run_id, pdf_output, action_taken, action_payload)
+        await asyncio.to_thread(update_pdf_agent, run_id, pdf_output, action_taken, action_payload)
+        run_ctx.mark_stage("pdf_processed", action_taken=action_taken)
         logger.info("#### Memory Update")
         logger.info(f"PDF agent run_id: {run_id}, action taken: {action_taken}, payload: {action_payload}")
 
-
         return extracted
     except Exception as e:
-        logger.error("Error extracting PDF data.", exc_info=True)
+        logger.error("Error recording PDF data.", exc_info=True)
         raise ValueError(f"Error extracting PDF validation result: {e}")
 
+async def _handle_llm_output(llm_output, run_ctx: RunContext, duplicates: list = ()) -> dict:
+    """
+    Parses one PDF agent LLM response and records the result against run_ctx.
+    Shared by processPdf and processPdfBatch.
+    """
+    return await _record_pdf_output(_parse_llm_output(llm_output), run_ctx, duplicates)
+
+
+async def processPdfBatch(pdf_texts: list, run_ctxs: list) -> list:
+    """
+    Runs the PDF agent chain once over many extracted PDF texts using the LLM client's batch API.
+    Invoices read by the layout parser and clearly policy documents skip the LLM; large PDFs are processed in
+    chunked mode alongside the batch.
+    Returns one entry per input, in order: the parsed dict, or the Exception raised
+    for that input (one bad input does not fail the others).
+    """
+    duplicates = await asyncio.gather(*(_check_duplicates(text, run_ctx) for text, run_ctx in zip(pdf_texts, run_ctxs)))
+    parsed = await asyncio.gather(*(_extract_without_llm(text, run_ctx) for text, run_ctx in zip(pdf_texts, run_ctxs)))
+    chunked = {i: chunk_pages(text, config.PDF_CHUNK_TOKENS) for i, text in enumerate(pdf_texts) if parsed[i] is None}
+    batch_indexes = [i for i, chunks in chunked.items() if len(chunks) == 1]
+    logger.info(f"Processing {len(pdf_texts)} inputs through PDF agent chain in batch ({len(pdf_texts) - len(chunked)} parsed, {len(chunked) - len(batch_indexes)} chunked).")
+    llm_outputs = dict(zip(batch_indexes, await pdf_agent_chain.abatch(
+        [{"pdf_text": prompt_input(pdf_texts[i], run_ctxs[i], "pdf_agent")} for i in batch_indexes],
+        config={"max_concurrency": config.LLM_BATCH_CONCURRENCY},
+        return_exceptions=True,
+    )))
+
+    async def settle(idx):
+        run_ctx = run_ctxs[idx]
+        if parsed[idx] is not None:
+            return await _record_pdf_output(parsed[idx], run_ctx, duplicates[idx])
+        if idx not in llm_outputs:
+            return await _process_pdf_chunked(chunked[idx], run_ctx, duplicates[idx])
+        llm_output = llm_outputs[idx]
+        if isinstance(llm_output, Exception):
+            logger.error(f"[{run_ctx.run_id}] Error invoking PDF agent chain: {llm_output}")
+            raise llm_output
+        return await _handle_llm_output(llm_output, run_ctx, duplicates[idx])
+
+    # Parse/persist concurrently; a failed input keeps its Exception in its slot
+    return await asyncio.gather(*(settle(i) for i in range(len(pdf_texts))), return_exceptions=True)
+
 # For testing purposes
 if __name__ == "__main__":
     test_pdf_text = """
@@ -155,6 +407,6 @@ Total Amount: 6300
 
 This is a sample invoice extracted from a PDF.
 """
-    result = processPdf(test_pdf_text)
+    result = asyncio.run(processPdf(test_pdf_text, RunContext()))
     logger.info("PDF Agent Result:")
     logger.info(result)
\ No newline at end of file
@@ -0,0 +1,194 @@
+import json
+import time
+import asyncio
+import logging
+
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration
+
+from memory.MemoryStore import record_event
+from memory.LlmCache import llm_cache, chain_cache_args
+from processor.PromptFormatter import estimate_tokens
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+# Shared parsing of agent LLM responses. The agents ask for one JSON object, but
+# models often wrap it in prose or keep explaining after it. JsonStreamParser tracks
+# brace depth and string/escape state chunk by chunk, so a streamed call can be
+# cancelled as soon as the top-level object is complete (stream_json).
+
+
+class JsonStreamParser:
+    """
+    Incremental scanner for the first complete, parseable top-level JSON object in a
+    stream of text chunks. feed() returns True once it has been found; `result` then
+    holds the parsed object and `end` its end offset in the text.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.length = 0
+        self.start = None       # offset of the '{' of the current candidate
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.end = None
+        self.result = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+    def feed(self, chunk: str) -> bool:
+        if self.end is not None:
+            return True
+        offset = self.length
+        self.parts.append(chunk)
+        self.length += len(chunk)
+        for i, ch in enumerate(chunk):
+            if self.start is None:
+                if ch == "{":
+                    self.start, self.depth = offset + i, 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+                continue
+            if ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0 and self._close(offset + i + 1):
+                    return True
+        return False
+
+    def _close(self, end: int) -> bool:
+        """Parses the balanced candidate; on failure ("{the} result: {...}") scanning resumes after it."""
+        candidate = self.text[self.start:end]
+        try:
+            parsed = json.loads(candidate)
+        except json.JSONDecodeError:
+            self.start, self.depth = None, 0
+            return False
+        if not isinstance(parsed, dict):
+            self.start, self.depth = None, 0
+            return False
+        self.result, self.end = parsed, end
+        return True
+
+
+def extract_json_from_text(raw_text: str) -> dict:
+    """
+    Returns the first complete JSON object in the text. Falls back to the substring
+    between the first '{' and the last '}'; returns an empty dictionary if nothing parses.
+    """
+    parser = JsonStreamParser()
+    if parser.feed(raw_text):
+        logger.debug(f"Successfully parsed JSON: {parser.result}")
+        return parser.result
+    start = raw_text.find('{')
+    end = raw_text.rfind('}')
+    if start != -1 and end != -1 and end > start:
+        try:
+            parsed = json.loads(raw_text[start:end + 1])
+            logger.debug(f"Successfully parsed JSON: {parsed}")
+            return parsed
+        except json.JSONDecodeError as e:
+            logger.error(f"JSON decode error: {e}")
+    else:
+        logger.warning("No JSON brackets found in the output.")
+    return {}
+
+
+async def stream_json(chain, inputs: dict, run_ctx=None, purpose: str = "llm"):
+    """
+    Streams one chain call and stops reading (closing the stream, which cancels the
+    request) as soon as the response's top-level JSON object is complete.
+    Returns the accumulated message chunk (`.content` like an ainvoke result).
+    The timing is recorded as the "<purpose>_llm" stage and as an "llm_call" event in
+    the run's log: seconds until the JSON was complete, whether the stream was
+    cancelled, and the estimated seconds saved (see config.LLM_TRAILING_TOKENS_ESTIMATE).
+    LangChain does not cache streamed calls, so the shared LLM response cache
+    (memory/LlmCache.py) is consulted here; responses whose JSON parsed are stored.
+    """
+    started = time.perf_counter()
+    cache_args = chain_cache_args(chain, inputs) if config.LLM_CACHE_ENABLED else None
+    if cache_args is not None:
+        cached = await llm_cache.alookup(*cache_args)
+        if cached:
+            details = {"purpose": purpose, "seconds": round(time.perf_counter() - started, 3), "cached": True}
+            logger.debug(f"LLM call ({purpose}) answered from the response cache.")
+            if run_ctx is not None:
+                run_ctx.mark_stage(f"{purpose}_llm", **details)
+                await asyncio.to_thread(record_event, run_ctx.run_id, "llm_call", details)
+            return cached[0].message
+
+    parser = JsonStreamParser()
+    message, first_chunk_at, json_done_at, cancelled = None, None, None, False
+    stream = chain.astream(inputs)
+    try:
+        async for chunk in stream:
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            message = chunk if message is None else message + chunk
+            if json_done_at is None and parser.feed(str(chunk.content)):
+                json_done_at = time.perf_counter()
+                if config.LLM_STREAM_EARLY_STOP:
+                    cancelled = True
+                    break
+    finally:
+        await stream.aclose()
+    finished = time.perf_counter()
+    if message is None:
+        raise ValueError("Empty LLM response stream.")
+    if cache_args is not None and json_done_at is not None:
+        # Stored as received; a cancelled response ends shortly after its JSON object
+        await llm_cache.aupdate(*cache_args, [ChatGeneration(message=AIMessage(content=str(message.content)))])
+
+    details = {
+        "purpose": purpose,
+        "seconds": round(finished - started, 3),
+        "json_seconds": round((json_done_at or finished) - started, 3),
+        "chars": parser.length,
+        "cancelled": cancelled,
+    }
+    if cancelled:
+        # Throughput since the first chunk times the usual length of the trailing text
+        streaming = json_done_at - first_chunk_at
+        tokens_per_second = estimate_tokens(parser.text) / streaming if streaming > 0 else 0.0
+        details["saved_seconds_estimate"] = (
+            round(config.LLM_TRAILING_TOKENS_ESTIMATE / tokens_per_second, 3) if tokens_per_second else 0.0
+        )
+    elif json_done_at is not None:
+        details["after_json_seconds"] = round(finished - json_done_at, 3)
+    logger.debug(f"LLM call ({purpose}): {details}")
+
+    if run_ctx is not None:
+        run_ctx.mark_stage(f"{purpose}_llm", **details)
+        await asyncio.to_thread(record_event, run_ctx.run_id, "llm_call", details)
+    return message
+
+
+# For testing purposes
+if __name__ == "__main__":
+    parser = JsonStreamParser()
+    chunks = ['Sure! Here is {the} result:\n```json\n{"a": "x}', '\\"y", "b": [1, {"c": 2}]', '}\n```\nThe field a is...', " more text"]
+    for number, chunk in enumerate(chunks, 1):
+        if parser.feed(chunk):
+            print(f"complete after chunk {number}: {parser.result}")
+            break
+    print(extract_json_from_text('noise {"intent": "Invoice"} trailing {"x": 1}'))
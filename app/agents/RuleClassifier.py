@@ -0,0 +1,166 @@
+import os
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+# Weighted keyword/regex rules for the five intents the classifier prompt knows.
+# Weights are additive; a rule counts once per document no matter how often it matches.
+INTENT_RULES = {
+    "invoice": [
+        (r"\binvoice\b", 2.0),
+        (r"\binvoice\s*(number|no\.?|#|id)\b|\binvoice_(id|number|no)\b", 3.0),
+        (r"\bamount due\b|\bbalance due\b", 2.0),
+        (r"\bdue date\b|\bdue_date\b", 1.5),
+        (r"\bbill to\b", 1.5),
+        (r"\bsubtotal\b", 1.0),
+        (r"\btotal[ _]amount\b", 1.0),
+        (r"\breceipt\s*(number|no\.?|#)|\breceiptnumber\b", 2.5),
+        (r"\bline items?\b|\bunit (cost|price)\b", 1.0),
+    ],
+    "complaint": [
+        (r"\bcomplain(t|ts|ing|ed)?\b", 3.0),
+        (r"\bdissatisf|\bfrustrat|\bunacceptable\b|\bdisappointed\b", 2.0),
+        (r"\bdefective\b|\bfaulty\b|\bbroken\b|\bdamaged\b", 2.0),
+        (r"\brefund\b|\breplacement\b", 1.5),
+        (r"\bovercharg", 2.5),
+        (r"\bdiscrepanc(y|ies)\b", 2.0),
+        (r"\bescalat", 1.5),
+        (r"\bimmediate attention\b|\burgent(ly)?\b", 1.0),
+    ],
+    "rfq": [
+        (r"\brfq\b", 4.0),
+        (r"\brequest for (a )?quot(e|ation)\b", 4.0),
+        (r"\bquotation\b|\bquote\b", 2.0),
+        (r"\bquote_(id|number)\b", 3.0),
+        (r"\b(kindly|please) (provide|send|share) (a |your )?(quote|quotation|pricing)\b", 2.0),
+        (r"\bprice list\b|\bpricing for\b|\bbulk order\b", 1.5),
+    ],
+    "fraud risk": [
+        (r"\bfraud(ulent)?\b", 4.0),
+        (r"\bsuspicious\b", 2.5),
+        (r"\bunauthori[sz]ed\b", 3.0),
+        (r"\bphishing\b|\bidentity theft\b", 3.0),
+        (r"\bchargeback\b", 2.0),
+        (r"\bmoney laundering\b|\baml\b", 3.0),
+        (r"\bscam\b", 2.0),
+    ],
+    "regulation": [
+        (r"\bgdpr\b", 4.0),
+        (r"\bhipaa\b", 4.0),
+        (r"\bsox\b|\bsarbanes", 4.0),
+        (r"\bfda\b", 3.0),
+        (r"\bcomplian(ce|t)\b", 2.0),
+        (r"\bregulat(ion|ions|ory)\b", 2.5),
+        (r"\bdata protection\b|\bprivacy\b", 1.5),
+        (r"\bpolicy\b", 1.0),
+    ],
+}
+
+COMPILED_INTENT_RULES = {
+    intent: [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in rules]
+    for intent, rules in INTENT_RULES.items()
+}
+
+# Score at which the best intent is considered fully supported by the keywords
+INTENT_SATURATION_SCORE = 4.0
+
+EMAIL_HEADER_RE = re.compile(r"^\s*(subject|from|to|cc|sent|reply-to)\s*:", re.IGNORECASE | re.MULTILINE)
+EMAIL_GREETING_RE = re.compile(r"^\s*(dear|hi|hello)\b[^\n]*,\s*$", re.IGNORECASE | re.MULTILINE)
+EMAIL_SIGNOFF_RE = re.compile(r"^\s*(sincerely|regards|best regards|kind regards|thanks|thank you)\b", re.IGNORECASE | re.MULTILINE)
+
+
+def detectFormat(input_data, original_ext: str = None):
+    """
+    Detects the document format from the file extension and the structure of the
+    extracted data. Returns (format, confidence).
+    """
+    ext = (original_ext or "").lower().lstrip(".")
+    if ext == "pdf":
+        return "pdf", 1.0
+    if ext == "json":
+        return "json", 1.0
+
+    if isinstance(input_data, list) and input_data and all(isinstance(p, dict) and "page_number" in p for p in input_data):
+        return "pdf", 0.95
+    if isinstance(input_data, (dict, list)):
+        return "json", 1.0
+
+    text = str(input_data).strip()
+    if text[:1] in ("{", "["):
+        try:
+            json.loads(text)
+            return "json", 0.95
+        except json.JSONDecodeError:
+            pass
+
+    if EMAIL_HEADER_RE.search(text):
+        return "email", 0.95
+    greeting = bool(EMAIL_GREETING_RE.search(text))
+    signoff = bool(EMAIL_SIGNOFF_RE.search(text))
+    if greeting and signoff:
+        return "email", 0.8
+    if greeting or signoff:
+        return "email", 0.5
+    # Plain text without email structure (e.g. a pasted invoice): let the LLM decide
+    return "email", 0.3
+
+
+def scoreIntents(text: str) -> dict:
+    """
+    Returns the weighted keyword score of every intent for the given text.
+    """
+    return {
+        intent: round(sum(weight for pattern, weight in rules if pattern.search(text)), 2)
+        for intent, rules in COMPILED_INTENT_RULES.items()
+    }
+
+
+def ruleClassify(input_data, original_ext: str = None) -> dict:
+    """
+    Deterministic pre-classifier run in front of the classifier LLM.
+    Returns a dict with 'format', 'intent', 'confidence' (0..1) and the underlying scores.
+    The overall confidence is the lower of the format and intent confidences.
+    """
+    file_format, format_confidence = detectFormat(input_data, original_ext)
+
+    text = input_data if isinstance(input_data, str) else json.dumps(input_data, default=str)
+    scores = scoreIntents(text)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (intent, top), (_, second) = ranked[0], ranked[1]
+    if top > 0:
+        # Strong absolute evidence and a clear margin over the runner-up are both required
+        intent_confidence = min(1.0, top / INTENT_SATURATION_SCORE) * (top - second) / top
+    else:
+        intent_confidence = 0.0
+
+    result = {
+        "format": file_format,
+        "intent": intent,
+        "confidence": round(min(format_confidence, intent_confidence), 3),
+        "format_confidence": round(format_confidence, 3),
+        "intent_confidence": round(intent_confidence, 3),
+        "scores": scores,
+    }
+    logger.debug(f"Rule classification: {result}")
+    return result
+
+
+# For testing purposes: run the rules over the sample files and print the decisions
+if __name__ == "__main__":
+    sample_root = os.path.join(os.path.dirname(__file__), "..", "..", "sampleFiles")
+    for folder in ("txt", "json"):
+        folder_path = os.path.join(sample_root, folder)
+        for name in sorted(os.listdir(folder_path)):
+            with open(os.path.join(folder_path, name), "r", encoding="utf-8") as f:
+                content = f.read()
+            result = ruleClassify(content, name.split(".")[-1])
+            print(f"{folder}/{name}: {result['format']} / {result['intent']} (confidence {result['confidence']})")
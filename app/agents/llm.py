@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
 from langchain_groq import ChatGroq
+from memory.LlmCache import llm_cache
+import config
 
 # Load environment variables from .env file
 load_dotenv()
@@ -8,8 +10,13 @@ load_dotenv()
 # Read GROQ_API_KEY from the environment
 groq_api_key = os.getenv("GROQ_API_KEY")
 
-# Initialize the ChatGroq LLM
-llm = ChatGroq(model="Gemma2-9b-It", groq_api_key=groq_api_key)
+# Initialize the ChatGroq LLM. Every chain built on it shares the response cache
+# (streamed calls use it through agents/ResponseParser.stream_json).
+llm = ChatGroq(
+    model=config.LLM_MODEL,
+    groq_api_key=groq_api_key,
+    cache=llm_cache if config.LLM_CACHE_ENABLED else None,
+)
 
 # Main entry point
 if __name__ == "__main__":
@@ -1,2 +1,138 @@
-# Global variable to hold the current run_id
-CURRENT_RUN_ID = None
\ No newline at end of file
+import os
+
+# Application-wide settings.
+# Per-request state (run_id, stage metadata) lives in core.RunContext and is
+# passed explicitly through the pipeline; do not store it here.
+
+# Size of the thread pool used for blocking work (PDF/OCR extraction, sqlite3)
+# that is pushed off the FastAPI event loop with asyncio.to_thread.
+BLOCKING_IO_THREADS = int(os.getenv("BLOCKING_IO_THREADS", "32"))
+
+# SQLite workflow database (memory/MemoryStore.py), shared by every module.
+# Each thread keeps one WAL-mode connection; DB_SYNCHRONOUS=NORMAL skips the fsync
+# on every commit (WAL stays consistent, only the last commits can be lost on power
+# failure). Writes that still hit "database is locked" after DB_BUSY_TIMEOUT_SECONDS
+# are retried DB_LOCK_RETRIES times with exponential backoff.
+DB_PATH = os.getenv("DB_PATH", "memory1.db")
+DB_SYNCHRONOUS = os.getenv("DB_SYNCHRONOUS", "NORMAL")
+DB_BUSY_TIMEOUT_SECONDS = float(os.getenv("DB_BUSY_TIMEOUT_SECONDS", "5"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "128"))
+DB_LOCK_RETRIES = int(os.getenv("DB_LOCK_RETRIES", "5"))
+DB_LOCK_BACKOFF_SECONDS = float(os.getenv("DB_LOCK_BACKOFF_SECONDS", "0.05"))
+
+# Optional write-behind mode for MemoryStore updates: stage updates are queued and a
+# background writer commits them in group transactions of up to
+# DB_WRITE_BEHIND_BATCH_SIZE updates, at most DB_WRITE_BEHIND_INTERVAL_SECONDS after
+# the first one. Queued updates are flushed before a run is read and at shutdown.
+DB_WRITE_BEHIND = os.getenv("DB_WRITE_BEHIND", "0") == "1"
+DB_WRITE_BEHIND_INTERVAL_SECONDS = float(os.getenv("DB_WRITE_BEHIND_INTERVAL_SECONDS", "0.05"))
+DB_WRITE_BEHIND_BATCH_SIZE = int(os.getenv("DB_WRITE_BEHIND_BATCH_SIZE", "200"))
+
+# Background job queue used by POST /process/async.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))          # runs processed concurrently
+JOB_QUEUE_MAX_DEPTH = int(os.getenv("JOB_QUEUE_MAX_DEPTH", "100"))  # queued runs before submissions get 503
+
+# Maximum number of concurrent LLM requests issued by a single chain.abatch call
+# (POST /process/batch).
+LLM_BATCH_CONCURRENCY = int(os.getenv("LLM_BATCH_CONCURRENCY", "8"))
+
+# LLM model used by every chain; part of the result-cache key together with
+# PROMPT_VERSION. Bump PROMPT_VERSION whenever a prompt changes.
+LLM_MODEL = os.getenv("LLM_MODEL", "Gemma2-9b-It")
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "1")
+
+# Streaming LLM calls (agents/ResponseParser.py): the stream is cancelled as soon as
+# the top-level JSON object of the response is complete. The time saved is estimated
+# from the observed throughput and LLM_TRAILING_TOKENS_ESTIMATE, the typical length of
+# the explanation models add after the JSON. With LLM_STREAM_EARLY_STOP=0 streams run
+# to the end and the measured time after the JSON is recorded instead (calibration).
+LLM_STREAM_EARLY_STOP = os.getenv("LLM_STREAM_EARLY_STOP", "1") == "1"
+LLM_TRAILING_TOKENS_ESTIMATE = int(os.getenv("LLM_TRAILING_TOKENS_ESTIMATE", "60"))
+
+# Content-addressed result cache (memory/ResultCache.py)
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_MEMORY_ENTRIES = int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", "256"))   # in-memory LRU size
+RESULT_CACHE_DB_ENTRIES = int(os.getenv("RESULT_CACHE_DB_ENTRIES", "10000"))        # SQLite tier size
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# LLM response cache on the shared chat model (memory/LlmCache.py), keyed by model,
+# generation parameters and rendered prompt. Both tiers are capped in bytes.
+# LLM_CACHE_BYPASS=1 skips lookups but keeps storing fresh responses.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_BYPASS = os.getenv("LLM_CACHE_BYPASS", "0") == "1"
+LLM_CACHE_MEMORY_BYTES = int(os.getenv("LLM_CACHE_MEMORY_BYTES", str(16 * 1024 * 1024)))
+LLM_CACHE_DB_BYTES = int(os.getenv("LLM_CACHE_DB_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Rule-based fast path in front of the classifier LLM (agents/RuleClassifier.py).
+# The LLM is only called when the rule confidence is below this threshold;
+# set RULE_CLASSIFIER_THRESHOLD=1.1 to always use the LLM.
+RULE_CLASSIFIER_THRESHOLD = float(os.getenv("RULE_CLASSIFIER_THRESHOLD", "0.75"))
+
+# Dynamic few-shot selection for the classifier prompt (agents/ExampleSelector.py).
+# Examples fill what the input leaves of CLASSIFIER_PROMPT_MAX_TOKENS; an input that
+# alone exceeds the cap is truncated.
+CLASSIFIER_FEWSHOT_K = int(os.getenv("CLASSIFIER_FEWSHOT_K", "3"))
+CLASSIFIER_PROMPT_MAX_TOKENS = int(os.getenv("CLASSIFIER_PROMPT_MAX_TOKENS", "3000"))
+
+# Duplicate document-ID index (memory/DuplicateIndex.py): invoice/quote/receipt
+# numbers are recorded with the first run that saw them. The in-memory Bloom filter
+# is sized for DUPLICATE_INDEX_CAPACITY IDs at DUPLICATE_INDEX_ERROR_RATE false
+# positives (~12 MB for 10M IDs at 1%); beyond that only more lookups hit the DB.
+DUPLICATE_INDEX_ENABLED = os.getenv("DUPLICATE_INDEX_ENABLED", "1") == "1"
+DUPLICATE_INDEX_CAPACITY = int(os.getenv("DUPLICATE_INDEX_CAPACITY", "10000000"))
+DUPLICATE_INDEX_ERROR_RATE = float(os.getenv("DUPLICATE_INDEX_ERROR_RATE", "0.01"))
+
+# Layout-aware invoice parser in front of the PDF agent LLM (agents/InvoiceParser.py).
+# Invoices parsed with at least this confidence skip the LLM; set
+# INVOICE_PARSER_MIN_CONFIDENCE=1.1 to always use the LLM. A total that does not match
+# the line items caps the confidence at 0.5 (InvoiceParser.MISMATCH_CONFIDENCE).
+INVOICE_PARSER_MIN_CONFIDENCE = float(os.getenv("INVOICE_PARSER_MIN_CONFIDENCE", "0.85"))
+
+# Regulatory keyword scanner for policy documents (agents/KeywordScanner.py).
+# REGULATORY_KEYWORDS_FILE optionally points to a JSON file {"Regulation": ["variant", ...]}
+# extending the built-in vocabulary. Documents that mention a regulation, have a policy
+# heading, score at least POLICY_MIN_MARKERS (distinct policy markers, headings count
+# twice) and have no invoice markers are flagged without the LLM.
+REGULATORY_KEYWORDS_FILE = os.getenv("REGULATORY_KEYWORDS_FILE", "")
+POLICY_MIN_MARKERS = int(os.getenv("POLICY_MIN_MARKERS", "3"))
+
+# Map-reduce mode for large PDFs in PdfAgent: PDFs whose extracted pages exceed
+# PDF_CHUNK_TOKENS (estimated) are split into chunks processed concurrently.
+PDF_CHUNK_TOKENS = int(os.getenv("PDF_CHUNK_TOKENS", "6000"))
+PDF_CHUNK_CONCURRENCY = int(os.getenv("PDF_CHUNK_CONCURRENCY", "8"))
+
+# Progressive pipeline for PDFs (core/Pipeline.py): classification starts as soon as
+# the first pages hold PROGRESSIVE_CLASSIFY_CHARS characters of text, while the rest
+# of the document is still extracting (0 = classify after full extraction).
+PROGRESSIVE_CLASSIFY_CHARS = int(os.getenv("PROGRESSIVE_CLASSIFY_CHARS", "2000"))
+
+# Parallel page-level PDF extraction (processor/fileProcessor.py).
+# PDF_POOL_WORKERS processes are shared by all requests (0 disables the pool);
+# each PDF with at least PDF_PARALLEL_MIN_PAGES pages is split into at most
+# PDF_PAGES_PARALLELISM page ranges.
+PDF_POOL_WORKERS = int(os.getenv("PDF_POOL_WORKERS", str(os.cpu_count() or 1)))
+PDF_PAGES_PARALLELISM = int(os.getenv("PDF_PAGES_PARALLELISM", "4"))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "4"))
+
+# Adaptive OCR (processor/fileProcessor.ocr_page): image regions are OCR'd at their
+# native resolution clamped to [OCR_MIN_DPI, OCR_MAX_DPI]; images smaller than
+# OCR_MIN_IMAGE_FRACTION of the page are ignored. OCR stops for the rest of a
+# document after OCR_TIME_BUDGET_SECONDS (0 = no budget).
+OCR_MIN_DPI = int(os.getenv("OCR_MIN_DPI", "150"))
+OCR_MAX_DPI = int(os.getenv("OCR_MAX_DPI", "300"))
+OCR_MIN_IMAGE_FRACTION = float(os.getenv("OCR_MIN_IMAGE_FRACTION", "0.01"))
+OCR_TIME_BUDGET_SECONDS = float(os.getenv("OCR_TIME_BUDGET_SECONDS", "60"))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+# On-disk OCR result cache keyed by the rendered image hash (processor/OcrCache.py)
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "1") == "1"
+OCR_CACHE_PATH = os.getenv("OCR_CACHE_PATH", "ocr_cache.db")
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Upload spooling (processor/UploadSpool.py): uploads up to UPLOAD_MEMORY_THRESHOLD
+# bytes stay in memory, larger ones go to a unique file in UPLOAD_SPOOL_DIR;
+# uploads over UPLOAD_MAX_BYTES are rejected with 413.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_MEMORY_THRESHOLD = int(os.getenv("UPLOAD_MEMORY_THRESHOLD", str(1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(os.getcwd(), "uploads"))
@@ -1,7 +1,8 @@
+import asyncio
 import requests 
 import logging
 from memory.MemoryStore import update_action_status
-import config
+from core.RunContext import RunContext
 
 
 logger = logging.getLogger(__name__)
@@ -13,7 +14,7 @@ if not logger.handlers:
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
-def RouteAction(agent_output: dict):
+async def RouteAction(agent_output: dict, run_ctx: RunContext):
     action = agent_output.get("suggested_action", "")
     result = {"action": action, "status": "unknown", "route": None}
     
@@ -40,9 +41,10 @@ def RouteAction(agent_output: dict):
         logger.warning(f"[Action Router] Unknown action: {action}")
         result["status"] = "failed"
     
-    run_id = config.CURRENT_RUN_ID  # Ensure you have the run_id set in your config
+    run_id = run_ctx.run_id
     # RouteAction returns a result including a status (e.g., "success" or "failed")
-    update_action_status(run_id, result["status"])
+    await asyncio.to_thread(update_action_status, run_id, result["status"])
+    run_ctx.mark_stage("action_routed", action=action, status=result["status"], route=result["route"])
     logger.info("### Memory Update")
     logger.info(f"Action status updated in memory for run_id: {run_id}")
 
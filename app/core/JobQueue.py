@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+from core.Pipeline import run_pipeline
+from core.RunContext import RunContext
+from processor.UploadSpool import SpooledUpload
+from memory.MemoryStore import update_run_status
+from memory.DuplicateIndex import duplicate_index
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+
+class QueueFullError(Exception):
+    """Raised by JobQueue.submit when the queue is at max depth."""
+
+
+class JobQueue:
+    """
+    In-process background queue for document runs.
+
+    submit() only enqueues an already registered run; `workers` asyncio tasks pull
+    runs off a bounded queue and execute run_pipeline, then close the run's
+    SpooledUpload. When the queue is full,
+    submit raises QueueFullError so the API can push back on the caller instead of
+    accepting work it cannot start. On stop(), runs still queued or in flight are
+    marked as failed with a "shutdown" event and their uploads are closed.
+    """
+
+    def __init__(self, workers: int, max_depth: int):
+        self.workers = workers
+        self.max_depth = max_depth
+        self._queue = None
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        # The asyncio.Queue must be created inside the running event loop
+        self._queue = asyncio.Queue(maxsize=self.max_depth)
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Job queue started with {self.workers} worker(s), max depth {self.max_depth}.")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        abandoned = 0
+        while self._queue is not None and not self._queue.empty():
+            upload, run_ctx = self._queue.get_nowait()
+            upload.close()
+            await self._abandon(run_ctx, "queued")
+            self._queue.task_done()
+            abandoned += 1
+        logger.info(f"Job queue stopped ({abandoned} queued run(s) abandoned).")
+
+    async def _abandon(self, run_ctx: RunContext, state: str):
+        """Marks a run that will never finish as failed and drops its document IDs."""
+        try:
+            await asyncio.to_thread(update_run_status, run_ctx.run_id, "error", "shutdown", {"state": state})
+            if config.DUPLICATE_INDEX_ENABLED:
+                await asyncio.to_thread(duplicate_index.release, run_ctx.run_id)
+        except Exception:
+            logger.error(f"Failed to mark run {run_ctx.run_id} as abandoned.", exc_info=True)
+
+    def submit(self, upload: SpooledUpload, run_ctx: RunContext):
+        if self._queue is None:
+            raise RuntimeError("Job queue is not started.")
+        try:
+            self._queue.put_nowait((upload, run_ctx))
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Job queue is full ({self.max_depth} runs waiting).")
+        logger.info(f"Queued run {run_ctx.run_id} (depth {self.depth}).")
+
+    async def _worker(self, worker_id: int):
+        while True:
+            upload, run_ctx = await self._queue.get()
+            try:
+                logger.info(f"Worker {worker_id} picked up run {run_ctx.run_id}.")
+                await asyncio.to_thread(update_run_status, run_ctx.run_id, "processing", "worker_started", {"worker": worker_id})
+                await run_pipeline(upload, run_ctx, register=False)
+            except asyncio.CancelledError:
+                logger.warning(f"Worker {worker_id} cancelled during run {run_ctx.run_id}.")
+                await self._abandon(run_ctx, "processing")
+                raise
+            except Exception:
+                # run_pipeline already recorded the failure on the run row
+                logger.error(f"Worker {worker_id} failed run {run_ctx.run_id}.")
+            finally:
+                upload.close()
+                self._queue.task_done()
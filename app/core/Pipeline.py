@@ -0,0 +1,267 @@
+import asyncio
+import logging
+
+from processor.fileProcessor import process_file_async, register_run, iter_pages_async, page_text_length
+from agents.ClassifierAgent import classifyInput, classifyBatch
+from router.AgentRouter import route_to_agent, route_batch_to_agents
+from core.ActionRouter import RouteAction
+from core.RunContext import RunContext
+from memory.MemoryStore import update_run_status, copy_cached_run
+from memory.ResultCache import result_cache, make_cache_key
+from memory.DuplicateIndex import duplicate_index
+from processor.UploadSpool import SpooledUpload
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+
+def _cache_key_for(upload: SpooledUpload):
+    # The content hash was computed while the upload was spooled
+    if not config.RESULT_CACHE_ENABLED:
+        return None
+    return make_cache_key(upload.sha256)
+
+
+async def _resolve_from_cache(cache_key: str, run_ctx: RunContext):
+    """
+    On a cache hit, fills this run's row from the original run and returns the cached
+    result (with this run's run_id). Returns None on a miss.
+    """
+    if cache_key is None:
+        return None
+    entry = await asyncio.to_thread(result_cache.get, cache_key)
+    if entry is None:
+        return None
+    original_run_id = entry["original_run_id"]
+    if not await asyncio.to_thread(copy_cached_run, run_ctx.run_id, original_run_id):
+        # The original run row is gone; treat as a miss
+        await asyncio.to_thread(result_cache.invalidate, cache_key)
+        return None
+    run_ctx.mark_stage("cache_hit", cached_from_run_id=original_run_id)
+    logger.info(f"[{run_ctx.run_id}] Result cache hit, reusing run {original_run_id}.")
+    result = dict(entry["result"])
+    result.update({"run_id": run_ctx.run_id, "stages": run_ctx.stages, "cached_from_run_id": original_run_id})
+    return result
+
+
+async def _store_in_cache(cache_key: str, run_ctx: RunContext, result: dict):
+    if cache_key is None:
+        return
+    if "duplicate_check" in run_ctx.stages:
+        # The document carries IDs recorded in the duplicate index: resubmitting it is a
+        # duplicate, so it must go through the agent again instead of reusing this verdict
+        logger.debug(f"[{run_ctx.run_id}] Not caching a result with document IDs.")
+        return
+    cached = {k: result[k] for k in ("classification", "agent_result", "action_response", "extracted_text") if k in result}
+    try:
+        await asyncio.to_thread(result_cache.put, cache_key, run_ctx.run_id, cached)
+    except Exception:
+        # Caching is best-effort; never fail a finished run because of it
+        logger.error(f"[{run_ctx.run_id}] Failed to store result in cache.", exc_info=True)
+
+
+async def _release_document_ids(run_ctx: RunContext):
+    # A failed run must not make the retry of the same document look like a duplicate
+    if not config.DUPLICATE_INDEX_ENABLED:
+        return
+    try:
+        await asyncio.to_thread(duplicate_index.release, run_ctx.run_id)
+    except Exception:
+        logger.error(f"[{run_ctx.run_id}] Failed to release document IDs.", exc_info=True)
+
+
+async def _extract_and_classify_progressively(upload: SpooledUpload, run_ctx: RunContext):
+    """
+    PDF-only: consumes pages as they are extracted and starts classification as soon as
+    the first pages hold PROGRESSIVE_CLASSIFY_CHARS characters, so the classifier LLM call
+    overlaps with the extraction/OCR of the remaining pages.
+    Returns (pages, classification); the pages are the complete document.
+    """
+    pages = []
+    text_chars = 0
+    classify_task = None
+    try:
+        async for page_data in iter_pages_async(upload.path or upload.open()):
+            pages.append(page_data)
+            text_chars += page_text_length(page_data)
+            if classify_task is None and text_chars >= config.PROGRESSIVE_CLASSIFY_CHARS:
+                logger.info(f"[{run_ctx.run_id}] Classifying from the first {len(pages)} page(s) ({text_chars} chars).")
+                run_ctx.mark_stage("classification_started", pages=len(pages), chars=text_chars)
+                classify_task = asyncio.create_task(classifyInput(list(pages), run_ctx))
+    except BaseException:
+        if classify_task is not None:
+            classify_task.cancel()
+        raise
+
+    run_ctx.mark_stage("extracted")
+    if classify_task is None:
+        # Short document: the threshold was never reached, classify all of it
+        return pages, await classifyInput(pages, run_ctx)
+    return pages, await classify_task
+
+
+async def run_pipeline(upload: SpooledUpload, run_ctx: RunContext, register: bool = True) -> dict:
+    """
+    Runs one document through extraction -> classification -> agent -> action routing.
+    Used by the synchronous /process endpoint and by the background job workers.
+
+    Args:
+        upload (SpooledUpload): The spooled upload; the caller closes it afterwards.
+        run_ctx (RunContext): Context of this run.
+        register (bool): Insert the workflow_run row first. Queued runs are registered
+            at submission time and pass False.
+    Returns:
+        dict: run_id, classification, agent_result, action_response and extracted_text.
+    """
+    if register:
+        await asyncio.to_thread(register_run, upload, run_ctx)
+
+    cache_key = _cache_key_for(upload)
+    try:
+        cached = await _resolve_from_cache(cache_key, run_ctx)
+        if cached is not None:
+            return cached
+
+        if upload.extension == "pdf" and config.PROGRESSIVE_CLASSIFY_CHARS > 0:
+            extractedText, classification = await _extract_and_classify_progressively(upload, run_ctx)
+            logger.info(f"[{run_ctx.run_id}] Extracted text from file.")
+        else:
+            extractedText = await process_file_async(upload, run_ctx)
+            run_ctx.mark_stage("extracted")
+            logger.info(f"[{run_ctx.run_id}] Extracted text from file.")
+            logger.debug(extractedText)
+
+            classification = await classifyInput(extractedText, run_ctx)
+        logger.info(f"[{run_ctx.run_id}] Classification: {classification}")
+
+        agent_result = await route_to_agent(upload.filename, classification, extractedText, run_ctx)
+        logger.info(f"[{run_ctx.run_id}] Agent output: {agent_result}")
+
+        action_response = await RouteAction(agent_result, run_ctx)
+        logger.info(f"[{run_ctx.run_id}] Action Router response: {action_response}")
+    except Exception as e:
+        logger.error(f"[{run_ctx.run_id}] Pipeline failed.", exc_info=True)
+        run_ctx.mark_stage("error", error=str(e))
+        await asyncio.to_thread(update_run_status, run_ctx.run_id, "error", "pipeline_failed", {"error": str(e)})
+        await _release_document_ids(run_ctx)
+        raise
+
+    result = {
+        "run_id": run_ctx.run_id,
+        "stages": run_ctx.stages,
+        "classification": classification,
+        "agent_result": agent_result,
+        "action_response": action_response,
+        "extracted_text": extractedText,
+    }
+    await _store_in_cache(cache_key, run_ctx, result)
+    return result
+
+
+async def _fail_run(run_ctx: RunContext, stage: str, error: Exception) -> dict:
+    logger.error(f"[{run_ctx.run_id}] Batch item failed during {stage}: {error}")
+    run_ctx.mark_stage("error", stage=stage, error=str(error))
+    await asyncio.to_thread(update_run_status, run_ctx.run_id, "error", "pipeline_failed", {"stage": stage, "error": str(error)})
+    await _release_document_ids(run_ctx)
+    return {"run_id": run_ctx.run_id, "status": "error", "stage": stage, "error": str(error)}
+
+
+async def run_pipeline_batch(uploads: list, run_ctxs: list) -> list:
+    """
+    Runs many documents through the pipeline together:
+    extraction in parallel, one batched classifier call, one batched agent call per
+    detected format, then action routing. A failing document is marked as error and
+    reported in its slot; it never fails the rest of the batch.
+
+    Returns:
+        list: One result dict per input, in input order, each with "run_id" and "status".
+    """
+    results = [None] * len(uploads)
+
+    registered = await asyncio.gather(
+        *(asyncio.to_thread(register_run, upload, ctx) for upload, ctx in zip(uploads, run_ctxs)),
+        return_exceptions=True,
+    )
+    for idx, outcome in enumerate(registered):
+        if isinstance(outcome, Exception):
+            results[idx] = {"run_id": run_ctxs[idx].run_id, "status": "error", "stage": "register", "error": str(outcome)}
+
+    # 0. Result cache: identical documents are answered without extraction or LLM calls
+    live = [i for i in range(len(uploads)) if results[i] is None]
+    cache_keys = {i: _cache_key_for(uploads[i]) for i in live}
+    cached = await asyncio.gather(
+        *(_resolve_from_cache(cache_keys[i], run_ctxs[i]) for i in live),
+        return_exceptions=True,
+    )
+    for idx, hit in zip(live, cached):
+        if isinstance(hit, Exception):
+            results[idx] = await _fail_run(run_ctxs[idx], "cache", hit)
+        elif hit is not None:
+            hit["status"] = "complete"
+            results[idx] = hit
+
+    # 1. Extraction, in parallel
+    live = [i for i in range(len(uploads)) if results[i] is None]
+    extracted = await asyncio.gather(
+        *(process_file_async(uploads[i], run_ctxs[i]) for i in live),
+        return_exceptions=True,
+    )
+    texts = {}
+    for idx, outcome in zip(live, extracted):
+        if isinstance(outcome, Exception):
+            results[idx] = await _fail_run(run_ctxs[idx], "extraction", outcome)
+        else:
+            run_ctxs[idx].mark_stage("extracted")
+            texts[idx] = outcome
+
+    # 2. Classification, one batched LLM call
+    live = list(texts)
+    classified = await classifyBatch([texts[i] for i in live], [run_ctxs[i] for i in live])
+    classifications = {}
+    for idx, outcome in zip(live, classified):
+        if isinstance(outcome, Exception):
+            results[idx] = await _fail_run(run_ctxs[idx], "classification", outcome)
+        else:
+            classifications[idx] = outcome
+
+    # 3. Agents, one batched call per detected format
+    live = list(classifications)
+    agent_outputs = await route_batch_to_agents(
+        [classifications[i] for i in live],
+        [texts[i] for i in live],
+        [run_ctxs[i] for i in live],
+    )
+    agent_results = {}
+    for idx, outcome in zip(live, agent_outputs):
+        if isinstance(outcome, Exception):
+            results[idx] = await _fail_run(run_ctxs[idx], "agent", outcome)
+        else:
+            agent_results[idx] = outcome
+
+    # 4. Action routing
+    live = list(agent_results)
+    actions = await asyncio.gather(
+        *(RouteAction(agent_results[i], run_ctxs[i]) for i in live),
+        return_exceptions=True,
+    )
+    for idx, outcome in zip(live, actions):
+        if isinstance(outcome, Exception):
+            results[idx] = await _fail_run(run_ctxs[idx], "action", outcome)
+        else:
+            results[idx] = {
+                "run_id": run_ctxs[idx].run_id,
+                "status": "complete",
+                "classification": classifications[idx],
+                "agent_result": agent_results[idx],
+                "action_response": outcome,
+            }
+            await _store_in_cache(cache_keys[idx], run_ctxs[idx], dict(results[idx], extracted_text=texts[idx]))
+
+    return results
@@ -0,0 +1,43 @@
+import uuid
+from datetime import datetime
+
+
+class RunContext:
+    """
+    Per-request state for a single document run.
+
+    A new RunContext is created for every upload and passed explicitly through
+    process_file -> classifyInput -> route_to_agent -> RouteAction, so every
+    MemoryStore update targets the row of the request that produced it, and
+    concurrent requests never share a run_id.
+    """
+
+    def __init__(self, source: str = "upload", run_id: str = None):
+        self.run_id = run_id or str(uuid.uuid4())
+        self.source = source
+        self.created_at = datetime.now().isoformat()
+        self.stages = {}
+        self.file_path = None
+        self.original_ext = None
+
+    def mark_stage(self, stage: str, **metadata) -> dict:
+        """
+        Records metadata for a pipeline stage (e.g. "extracted", "classified").
+        Returns the stored entry.
+        """
+        entry = {"timestamp": datetime.now().isoformat()}
+        entry.update(metadata)
+        self.stages[stage] = entry
+        return entry
+
+    def to_dict(self) -> dict:
+        return {
+            "run_id": self.run_id,
+            "source": self.source,
+            "created_at": self.created_at,
+            "original_ext": self.original_ext,
+            "stages": self.stages,
+        }
+
+    def __repr__(self):
+        return f"RunContext(run_id={self.run_id!r}, source={self.source!r})"
@@ -2,22 +2,31 @@ import os
 import logging
 import logging.config
 
-from processor.fileProcessor import process_file
-from agents.ClassifierAgent import classifyInput
-from router.AgentRouter import route_to_agent
-from core.ActionRouter import RouteAction
-from memory.MemoryStore import init_db
+from processor.fileProcessor import register_run, shutdown_page_pool
+from processor.UploadSpool import spool_upload, UploadTooLargeError
+from core.Pipeline import run_pipeline, run_pipeline_batch
+from core.JobQueue import JobQueue, QueueFullError
+from memory.MemoryStore import (
+    init_db, get_run, list_runs, get_stats, update_run_status, get_history as fetch_history,
+    close_connections, start_write_behind, stop_write_behind,
+)
+from memory.ResultCache import result_cache
+from memory.DuplicateIndex import duplicate_index
+from memory.LlmCache import llm_cache
+from processor import OcrCache
+from core.RunContext import RunContext
 import config
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
+from typing import List, Optional
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uuid
-import shutil
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import sys
 import os
-import sqlite3
 # Instead of adding the parent directory,
 # add the current directory (i.e. the "app" folder) to sys.path.
 sys.path.insert(0, os.path.dirname(__file__))
@@ -74,97 +83,222 @@ app.add_middleware(
 
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     logger.info("\n"*5)
     logger.info("=" * 30 + " NEW SECTION " + "=" * 30)
     logger.info("Application starting up...")
+    # Blocking stages (extraction, OCR, sqlite3) run in this pool so the event loop
+    # keeps serving other requests while LLM calls are awaited.
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=config.BLOCKING_IO_THREADS, thread_name_prefix="flowbit-io")
+    )
     logger.info("Initializing database...")
     init_db()
+    result_cache.init_table()
+    llm_cache.init_table()
+    duplicate_index.init_table()
+    duplicate_index.start_loading()
+    start_write_behind()
     logger.info("Database initialized successfully.")
+    job_queue.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_queue.stop()
+    await asyncio.to_thread(shutdown_page_pool)
+    # Queued MemoryStore updates are committed before the connections are closed
+    await asyncio.to_thread(stop_write_behind)
+    close_connections()
 
-# Define the path to your SQLite DB (or use your config variable)
-DB_PATH = os.getenv("DB_PATH", "memory.db")
+job_queue = JobQueue(workers=config.JOB_WORKERS, max_depth=config.JOB_QUEUE_MAX_DEPTH)
 
 @app.get("/history")
-async def get_history():
+async def get_history(run_id: str):
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            run_id = config.CURRENT_RUN_ID 
-            if not run_id:
-                raise HTTPException(status_code=400, detail="No run_id found in config")
-            cursor = conn.cursor()
-            cursor.execute("SELECT history FROM workflow_run WHERE run_id=?", (run_id,))
-            row = cursor.fetchone()
-            if not row:
-                raise HTTPException(status_code=404, detail="Run id not found")
-            # The history field is a JSON string
-            history = row[0]
-            return {"run_id": run_id, "routing_history": history}
+        # sqlite3 is blocking; keep it off the event loop
+        history = await asyncio.to_thread(fetch_history, run_id)
+        if history is None:
+            raise HTTPException(status_code=404, detail="Run id not found")
+        # Events come from workflow_event, oldest first
+        return {"run_id": run_id, "routing_history": history}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Error fetching history")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _spool(file: UploadFile):
+    try:
+        return await spool_upload(file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
 @app.post("/process")
 async def process_input(file: UploadFile = File(...)):
-
-    # file_path = r"E:\langflow_directory\gitRepos\FlowbitAI\app\sampleFiles\pdfs\wordpress-pdf-invoice-plugin-sample.pdf"
-    # file_path = r"E:\langflow_directory\gitRepos\FlowbitAI\app\sampleFiles\txt\sample4.txt"
-    # file_path = r"E:\langflow_directory\gitRepos\FlowbitAI\app\sampleFiles\json\sample3.json"
-    # Save the file to a local sample directory
-    upload_dir = os.path.join(os.getcwd(), "sampleFiles")
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    if not os.path.exists(file_path):
-        print("file_path = " , file_path)
-        print("File does not exist. Please check the path.")
-        return
+    # Each request gets its own run context so concurrent uploads never share a run_id
+    run_ctx = RunContext(source="upload")
+    upload = await _spool(file)
 
     try:
-        extractedText = process_file(file_path)
-
-        print("\n📄 Extracted Text:")
-        print(extractedText)
-        logger.info("Extracted text from file: ")
-        logger.info(extractedText) 
+        result = await run_pipeline(upload, run_ctx)
         logger.info("_"*30)
+        logger.info("Application finished!")
 
+        # Return a response including the classification and agent output info
+        return JSONResponse(content=result)
 
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        upload.close()
 
-        classification = classifyInput(extractedText)
-
-        print("\n📂 File Classification:")
-        print(classification)
-        logger.info("_"*30)
+@app.post("/process/batch")
+async def process_batch(files: List[UploadFile] = File(...)):
+    """
+    Processes many uploads in one request: parallel extraction, batched classifier and
+    agent LLM calls. Returns per-file results and run ids; a bad file is reported
+    in its own entry and does not fail the batch.
+    """
+    spooled = await asyncio.gather(*(spool_upload(file) for file in files), return_exceptions=True)
+    accepted = [i for i, upload in enumerate(spooled) if not isinstance(upload, Exception)]
+    try:
+        processed = await run_pipeline_batch(
+            [spooled[i] for i in accepted],
+            [RunContext(source="upload") for _ in accepted],
+        )
+    finally:
+        for i in accepted:
+            spooled[i].close()
 
+    # Files rejected while spooling (e.g. too large) get no run
+    results = [
+        {"run_id": None, "status": "error", "stage": "upload", "error": str(upload)}
+        if isinstance(upload, Exception) else None
+        for upload in spooled
+    ]
+    for i, result in zip(accepted, processed):
+        results[i] = result
+    for file, result in zip(files, results):
+        result["filename"] = file.filename
+    logger.info(f"Batch finished: {sum(r['status'] == 'complete' for r in results)}/{len(results)} complete.")
+    return JSONResponse(content={"results": results})
 
-        agent_result = route_to_agent(file_path, classification, extractedText)
+@app.post("/process/async", status_code=202)
+async def submit_input(file: UploadFile = File(...)):
+    """
+    Spools the upload, registers the run as "queued" and returns its run_id immediately.
+    The run is processed by the background job queue; poll GET /runs/{run_id} for progress.
+    """
+    if job_queue.depth >= job_queue.max_depth:
+        # Reject before storing anything so upstream senders back off cheaply
+        raise HTTPException(status_code=503, detail="Job queue is full, retry later.", headers={"Retry-After": "5"})
 
-        print("\n🧠 Agent Output:")
-        print(agent_result)
-        logger.info("_"*30)
+    run_ctx = RunContext(source="upload")
+    upload = await _spool(file)
+    try:
+        await asyncio.to_thread(register_run, upload, run_ctx, "queued")
+        job_queue.submit(upload, run_ctx)
+    except QueueFullError as e:
+        upload.close()
+        await asyncio.to_thread(update_run_status, run_ctx.run_id, "error", "queue_rejected", {"error": str(e)})
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+    except BaseException:
+        # Not handed to a worker, so nothing else will remove the spooled file
+        upload.close()
+        raise
 
+    return JSONResponse(
+        status_code=202,
+        content={
+            "run_id": run_ctx.run_id,
+            "status": "queued",
+            "status_url": f"/runs/{run_ctx.run_id}",
+        }
+    )
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Hit/miss counters of the content-addressed result cache, the LLM response cache
+    (with the provider latency its hits saved), the OCR cache and the duplicate-ID index.
+    """
+    return {
+        "result_cache": result_cache.stats(),
+        "llm_cache": llm_cache.stats(),
+        "ocr_cache": await asyncio.to_thread(OcrCache.stats),
+        "duplicate_index": duplicate_index.stats(),
+    }
 
-        action_response = RouteAction(agent_result)
+@app.get("/runs")
+async def list_workflow_runs(
+    intent: Optional[str] = None,
+    detected_format: Optional[str] = None,
+    action_status: Optional[str] = None,
+    current_status: Optional[str] = None,
+    received_from: Optional[str] = None,
+    received_to: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 50,
+    fields: Optional[str] = None,
+):
+    """
+    Lists runs newest first. Filters are combined with AND; received_from/received_to
+    are ISO timestamps. Pass next_cursor back as `cursor` for the next page and a
+    comma-separated `fields` list to choose the returned columns.
+    """
+    filters = {
+        "intent": intent,
+        "detected_format": detected_format,
+        "action_status": action_status,
+        "current_status": current_status,
+    }
+    kwargs = {"fields": [f.strip() for f in fields.split(",") if f.strip()]} if fields else {}
+    try:
+        return await asyncio.to_thread(
+            list_runs, filters, received_from, received_to, cursor, limit, **kwargs
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        print("\n✅ Action Router Response:")
-        print(action_response)
-        logger.info("_"*30)
-        logger.info("Application finished!")
+@app.get("/stats")
+async def get_run_stats(since: Optional[str] = None, until: Optional[str] = None, granularity: str = "hour"):
+    """
+    Dashboard aggregates per hour (or day): runs by intent/format/action/status, error
+    rate and trigger_alert share. Served from the run_rollup table; defaults to the
+    last 24 hours (UTC).
+    """
+    try:
+        return {"granularity": granularity, "buckets": await asyncio.to_thread(get_stats, since, until, granularity)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # Return a response including the classification and agent output info
-        return JSONResponse(
-            content={
-                "run_id": config.CURRENT_RUN_ID,
-                "classification": classification,
-                "agent_result": agent_result,
-                "action_response": action_response,
-                "extracted_text": extractedText
-            }
-        )
-            
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+@app.get("/runs/{run_id}")
+async def get_run_status(run_id: str):
+    """
+    Returns the current workflow_run status and the per-stage outputs of a run.
+    """
+    run = await asyncio.to_thread(get_run, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Run id not found")
+    return {
+        "run_id": run_id,
+        "current_status": run["current_status"],
+        "received_at": run["received_at"],
+        "last_updated": run["last_updated"],
+        "stages": {
+            "classification": {
+                "detected_format": run["detected_format"],
+                "intent": run["intent"],
+                "routed_to_agent": run["routed_to_agent"],
+            },
+            "email_agent_output": run["email_agent_output"],
+            "pdf_agent_output": run["pdf_agent_output"],
+            "json_agent_output": run["json_agent_output"],
+            "action": {
+                "action_taken": run["action_taken"],
+                "action_payload": run["action_payload"],
+                "action_status": run["action_status"],
+            },
+        },
+        "history": run["history"],
+    }
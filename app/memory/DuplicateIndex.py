@@ -0,0 +1,202 @@
+import re
+import math
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+
+from memory.MemoryStore import get_conn, retry_on_locked
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+
+def normalize_id(value) -> str:
+    """Case- and punctuation-insensitive form of a document identifier ("inv-001 " -> "INV001")."""
+    return re.sub(r"[^A-Z0-9]", "", str(value).upper())
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter (double hashing over one blake2b digest). Sized for
+    `capacity` items at `error_rate` false positives: about 1.2 bytes per item at 1%.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item: str):
+        positions = self._positions(item)
+        with self._lock:
+            for p in positions:
+                self.bits[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+
+class DuplicateIndex:
+    """
+    Persistent index of document identifiers (invoice, quote, receipt and request
+    reference numbers) with the run that first saw each one, in the `document_id`
+    table. An in-memory Bloom filter in front of it answers "definitely new" without a
+    database read; only possible duplicates are looked up (primary key, constant time).
+    The filter is loaded from the table in the background at startup; until then
+    every ID is looked up.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.ready = False
+        self.counters = {"checked": 0, "bloom_negative": 0, "lookups": 0, "duplicates": 0}
+        self._lock = threading.Lock()
+
+    @retry_on_locked
+    def init_table(self):
+        with get_conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_id (
+                    id_type TEXT NOT NULL,
+                    normalized_id TEXT NOT NULL,
+                    original_id TEXT NOT NULL,
+                    first_run_id TEXT NOT NULL,
+                    first_seen TEXT NOT NULL,
+                    PRIMARY KEY (id_type, normalized_id)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_document_id_run ON document_id(first_run_id)")
+            conn.commit()
+
+    def load(self):
+        """Fills the Bloom filter from the table (startup, in a background thread)."""
+        started = time.perf_counter()
+        loaded = 0
+        with get_conn() as conn:
+            for row in conn.execute("SELECT id_type, normalized_id FROM document_id"):
+                self.bloom.add(f"{row[0]}:{row[1]}")
+                loaded += 1
+        self.ready = True
+        logger.info(f"Duplicate index loaded {loaded} IDs in {time.perf_counter() - started:.1f}s.")
+
+    def start_loading(self):
+        threading.Thread(target=self.load, name="duplicate-index-load", daemon=True).start()
+
+    def _count(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    @retry_on_locked
+    def check_and_record(self, ids: list, run_id: str) -> list:
+        """
+        ids: (id_type, value, field) tuples. Records every new ID against run_id and
+        returns the duplicates as dicts (id_type, id, field, first_run_id, first_seen).
+        IDs already recorded by the same run (a retried job) are not duplicates; the IDs
+        of a run that fails are dropped again with release().
+        """
+        duplicates = []
+        now = datetime.now().isoformat()
+        with get_conn() as conn:
+            for id_type, value, field in ids:
+                normalized = normalize_id(value)
+                if not normalized:
+                    continue
+                key = f"{id_type}:{normalized}"
+                self._count("checked")
+                if self.ready and key not in self.bloom:
+                    self._count("bloom_negative")
+                else:
+                    self._count("lookups")
+                    row = conn.execute(
+                        "SELECT first_run_id, first_seen FROM document_id WHERE id_type = ? AND normalized_id = ?",
+                        (id_type, normalized),
+                    ).fetchone()
+                    if row is not None and row["first_run_id"] == run_id:
+                        continue   # retry of the run that recorded it
+                    if row is not None:
+                        self._count("duplicates")
+                        duplicates.append({"id_type": id_type, "id": value, "field": field,
+                                           "first_run_id": row["first_run_id"], "first_seen": row["first_seen"]})
+                        continue
+                inserted = conn.execute("""
+                    INSERT OR IGNORE INTO document_id (id_type, normalized_id, original_id, first_run_id, first_seen)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (id_type, normalized, str(value), run_id, now)).rowcount
+                self.bloom.add(key)
+                if not inserted:
+                    # Another run recorded it between the Bloom check and the insert
+                    row = conn.execute(
+                        "SELECT first_run_id, first_seen FROM document_id WHERE id_type = ? AND normalized_id = ?",
+                        (id_type, normalized),
+                    ).fetchone()
+                    self._count("duplicates")
+                    duplicates.append({"id_type": id_type, "id": value, "field": field,
+                                       "first_run_id": row["first_run_id"], "first_seen": row["first_seen"]})
+            conn.commit()
+        if duplicates:
+            logger.info(f"[{run_id}] Duplicate document IDs: {duplicates}")
+        return duplicates
+
+    @retry_on_locked
+    def release(self, run_id: str) -> int:
+        """
+        Forgets the IDs first recorded by run_id (the run failed, so resubmitting the
+        document is not a duplicate). Their Bloom filter bits stay set; a later check
+        of the same ID just costs one lookup that finds nothing.
+        """
+        with get_conn() as conn:
+            released = conn.execute("DELETE FROM document_id WHERE first_run_id = ?", (run_id,)).rowcount
+            conn.commit()
+        if released:
+            logger.info(f"[{run_id}] Released {released} document ID(s) of the failed run.")
+        return released
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+        counters.update(ready=self.ready, bloom_bytes=len(self.bloom.bits), bloom_hashes=self.bloom.hashes)
+        return counters
+
+
+def duplicate_anomalies(duplicates: list) -> list:
+    return [
+        {
+            "field": duplicate["field"],
+            "description": f"Duplicate {duplicate['id_type']} {duplicate['id']}, first seen in run {duplicate['first_run_id']} at {duplicate['first_seen']}.",
+            "severity": "critical",
+        }
+        for duplicate in duplicates
+    ]
+
+
+def apply_duplicates(result: dict, duplicates: list) -> dict:
+    """Adds duplicate-ID anomalies to an agent result; a duplicate always triggers an alert."""
+    if not duplicates:
+        return result
+    result["anomalies"] = list(result.get("anomalies") or []) + duplicate_anomalies(duplicates)
+    result["suggested_action"] = "trigger_alert"
+    if "status" in result:
+        result["status"] = "invalid"
+    return result
+
+
+duplicate_index = DuplicateIndex(
+    capacity=config.DUPLICATE_INDEX_CAPACITY,
+    error_rate=config.DUPLICATE_INDEX_ERROR_RATE,
+)
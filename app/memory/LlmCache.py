@@ -0,0 +1,224 @@
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from memory.MemoryStore import get_conn, retry_on_locked
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+
+def make_llm_cache_key(prompt: str, llm_string: str) -> str:
+    """
+    sha256 of the LLM string (model name and generation parameters, as serialized by
+    LangChain) and the rendered prompt (the serialized messages).
+    """
+    return hashlib.sha256(f"{llm_string}\0{prompt}".encode()).hexdigest()
+
+
+def chain_cache_args(chain, inputs: dict):
+    """
+    (prompt, llm_string) of a `prompt | llm` chain call, computed the way the chat
+    model computes them for its own cache lookups (used by the streaming path, which
+    LangChain does not cache).
+    """
+    model = chain.last
+    messages = chain.first.invoke(inputs).to_messages()
+    return dumps(messages), model._get_llm_string()
+
+
+class LlmResponseCache(BaseCache):
+    """
+    LangChain cache for the shared chat model: identical prompts to the same model with
+    the same parameters are answered without calling the provider.
+
+    Two tiers like ResultCache: an in-memory LRU in front of an `llm_cache` SQLite
+    table, each capped in bytes (least recently used entries are evicted first).
+    Entries expire after `ttl_seconds`. With `bypass` set, lookups miss but fresh
+    responses are still stored (refresh). The provider latency of each stored
+    response is kept, so hits add up the latency they saved.
+    """
+
+    def __init__(self, memory_bytes: int, db_bytes: int, ttl_seconds: int, bypass: bool = False):
+        self.memory_bytes = memory_bytes
+        self.db_bytes = db_bytes
+        self.ttl_seconds = ttl_seconds
+        self.bypass = bypass
+        self._lru = OrderedDict()   # key -> (stored_at, latency, payload, size)
+        self._lru_size = 0
+        self._db_size = 0           # loaded by init_table
+        self._pending = {}          # key -> time of the missed lookup
+        self._lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0, "db_hits": 0, "misses": 0, "bypassed": 0, "stores": 0,
+            "evictions": 0, "expired": 0, "latency_saved_seconds": 0.0,
+        }
+
+    @retry_on_locked
+    def init_table(self):
+        with get_conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    latency REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+            conn.commit()
+            self._db_size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+
+    def _count(self, counter: str, n=1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def _hit(self, counter: str, latency: float):
+        with self._lock:
+            self.counters[counter] += 1
+            self.counters["latency_saved_seconds"] += latency
+
+    def _remember(self, key: str, stored_at: float, latency: float, payload: str, size: int):
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._lru.pop(key, None)
+            if previous is not None:
+                self._lru_size -= previous[3]
+            self._lru[key] = (stored_at, latency, payload, size)
+            self._lru_size += size
+            while self._lru_size > self.memory_bytes:
+                _, evicted = self._lru.popitem(last=False)
+                self._lru_size -= evicted[3]
+
+    def _miss(self, key: str, counter: str = "misses"):
+        with self._lock:
+            self.counters[counter] += 1
+            self._pending[key] = time.perf_counter()
+            if len(self._pending) > 10000:
+                # Lookups whose call never finished (errors); drop the oldest
+                for stale in list(self._pending)[:1000]:
+                    del self._pending[stale]
+        return None
+
+    @retry_on_locked
+    def lookup(self, prompt: str, llm_string: str):
+        key = make_llm_cache_key(prompt, llm_string)
+        if self.bypass:
+            return self._miss(key, "bypassed")
+        now = time.time()
+        with self._lock:
+            cached = self._lru.get(key)
+            if cached is not None:
+                if now - cached[0] <= self.ttl_seconds:
+                    self._lru.move_to_end(key)
+                else:
+                    del self._lru[key]
+                    self._lru_size -= cached[3]
+                    cached = None
+        if cached is not None:
+            self._hit("memory_hits", cached[1])
+            return loads(cached[2])
+
+        with get_conn() as conn:
+            row = conn.execute(
+                "SELECT payload, size, latency, created_at FROM llm_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row["created_at"] > self.ttl_seconds:
+                conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+                conn.commit()
+                self._count("expired")
+                with self._lock:
+                    self._db_size -= row["size"]
+                row = None
+            if row is None:
+                return self._miss(key)
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+            conn.commit()
+
+        self._remember(key, row["created_at"], row["latency"], row["payload"], row["size"])
+        self._hit("db_hits", row["latency"])
+        return loads(row["payload"])
+
+    @retry_on_locked
+    def update(self, prompt: str, llm_string: str, return_val):
+        key = make_llm_cache_key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            started = self._pending.pop(key, None)
+        latency = time.perf_counter() - started if started is not None else 0.0
+        payload = dumps(list(return_val))
+        size = len(payload.encode())
+        with get_conn() as conn:
+            previous = conn.execute("SELECT size FROM llm_cache WHERE cache_key = ?", (key,)).fetchone()
+            conn.execute("""
+                INSERT OR REPLACE INTO llm_cache (cache_key, payload, size, latency, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (key, payload, size, latency, now, now))
+            with self._lock:
+                self._db_size += size - (previous["size"] if previous else 0)
+                over_cap = self._db_size > self.db_bytes
+            if over_cap:
+                self._evict(conn, now)
+            conn.commit()
+        self._remember(key, now, latency, payload, size)
+        self._count("stores")
+
+    def _evict(self, conn, now: float):
+        """Drops expired rows, then the least recently used ones down to 90% of db_bytes."""
+        expired = conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        evicted = conn.execute("""
+            DELETE FROM llm_cache WHERE cache_key IN (
+                SELECT cache_key FROM (
+                    SELECT cache_key, SUM(size) OVER (ORDER BY last_access DESC, cache_key) AS running
+                    FROM llm_cache
+                ) WHERE running > ?
+            )
+        """, (int(self.db_bytes * 0.9),)).rowcount
+        size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        with self._lock:
+            self._db_size = size
+            self.counters["expired"] += expired
+            self.counters["evictions"] += evicted
+
+    @retry_on_locked
+    def clear(self, **kwargs):
+        with self._lock:
+            self._lru.clear()
+            self._lru_size = 0
+            self._db_size = 0
+        with get_conn() as conn:
+            conn.execute("DELETE FROM llm_cache")
+            conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            counters.update(memory_entries=len(self._lru), memory_bytes=self._lru_size, db_bytes=self._db_size)
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        counters["hit_rate"] = round((counters["memory_hits"] + counters["db_hits"]) / lookups, 4) if lookups else 0.0
+        counters["latency_saved_seconds"] = round(counters["latency_saved_seconds"], 3)
+        counters["bypass"] = self.bypass
+        return counters
+
+
+llm_cache = LlmResponseCache(
+    memory_bytes=config.LLM_CACHE_MEMORY_BYTES,
+    db_bytes=config.LLM_CACHE_DB_BYTES,
+    ttl_seconds=config.LLM_CACHE_TTL_SECONDS,
+    bypass=config.LLM_CACHE_BYPASS,
+)
@@ -1,17 +1,103 @@
-import sqlite3
+import os
+import time
 import json
-from datetime import datetime
+import base64
+import queue
+import random
+import logging
+import sqlite3
+import threading
+import functools
+from datetime import datetime, timezone
 
-DB_PATH = "memory1.db"
+import config
+from memory import Rollups
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+DB_PATH = config.DB_PATH
+
+# One long-lived connection per thread (the request threads of the default executor
+# and the job workers), instead of a new connection per call. Connections run in
+# WAL mode so readers never block the writer, with a relaxed synchronous level, and
+# keep their prepared-statement cache between calls.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=config.DB_BUSY_TIMEOUT_SECONDS,
+        cached_statements=config.DB_STATEMENT_CACHE_SIZE,
+        check_same_thread=False,   # only ever used by its own thread; closed from close_connections
+    )
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={config.DB_SYNCHRONOUS}")
+    conn.execute(f"PRAGMA busy_timeout={int(config.DB_BUSY_TIMEOUT_SECONDS * 1000)}")
     return conn
 
+def get_conn():
+    """
+    Returns this thread's connection. Use it as `with get_conn() as conn:` - the block
+    commits on success and rolls back on error; the connection itself stays open.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_connections():
+    """Closes every pooled connection (application shutdown)."""
+    with _connections_lock:
+        connections = list(_connections)
+        _connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            logger.error("Error closing SQLite connection.", exc_info=True)
+    _local.__dict__.clear()
+
+def _is_locked(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "database is locked" in message or "database is busy" in message
+
+def retry_on_locked(fn):
+    """
+    Retries fn with exponential backoff (plus jitter) when SQLite reports the database
+    as locked after busy_timeout. The failed transaction is rolled back before retrying.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        for attempt in range(config.DB_LOCK_RETRIES + 1):
+            try:
+                return fn(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not _is_locked(e) or attempt == config.DB_LOCK_RETRIES:
+                    raise
+                get_conn().rollback()
+                delay = config.DB_LOCK_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+                logger.warning(f"{fn.__name__}: database is locked, retrying in {delay:.3f}s (attempt {attempt + 1}).")
+                time.sleep(delay)
+    return wrapper
+
+@retry_on_locked
 def init_db():
     """
-    Creates the `workflow_run` table if it doesn’t exist.
+    Creates the `workflow_run` and `workflow_event` tables if they don’t exist and
+    migrates older databases.
     """
     create_sql = """
     CREATE TABLE IF NOT EXISTS workflow_run (
@@ -32,71 +118,272 @@ def init_db():
         action_status TEXT,
         current_status TEXT,
         last_updated DATETIME,
-        history TEXT
+        history TEXT,
+        cached_from_run_id TEXT
+    );
+    """
+    # One row per workflow event; (run_id, seq) keeps the events of a run in order
+    create_events_sql = """
+    CREATE TABLE IF NOT EXISTS workflow_event (
+        run_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        event TEXT NOT NULL,
+        details TEXT,
+        PRIMARY KEY (run_id, seq)
     );
     """
     with get_conn() as conn:
         conn.execute(create_sql)
+        conn.execute(create_events_sql)
+        # Migrate databases created before cached_from_run_id existed
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(workflow_run)")}
+        if "cached_from_run_id" not in columns:
+            conn.execute("ALTER TABLE workflow_run ADD COLUMN cached_from_run_id TEXT")
+        _migrate_history(conn)
+        for index_sql in RUN_INDEXES:
+            conn.execute(index_sql)
+        has_rollup = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'run_rollup'").fetchone()
+        Rollups.init_table(conn)
+        if not has_rollup:
+            # First start with rollups: backfill from the existing runs
+            logger.info(f"Backfilled run_rollup: {Rollups.rebuild(conn)} rows.")
         conn.commit()
 
-def append_history(history_json: str, event: str, details: dict) -> str:
+# Indexes behind list_runs: one per equality filter, each ending in the listing order
+# (received_at, run_id) so a filtered page is a single index range scan.
+RUN_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_run_received ON workflow_run(received_at, run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_run_intent ON workflow_run(intent, received_at, run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_run_format ON workflow_run(detected_format, received_at, run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_run_action_status ON workflow_run(action_status, received_at, run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_run_status ON workflow_run(current_status, received_at, run_id)",
+)
+
+def _migrate_history(conn):
     """
-    Given the existing history_json (or None), append a new event.
-    Returns updated JSON string.
+    Moves the events of the legacy `history` JSON column into workflow_event.
+    The column is cleared afterwards, so every run is migrated exactly once.
     """
-    now = datetime.now().isoformat()
-    entry = {"timestamp": now, "event": event, "details": details}
+    rows = conn.execute("SELECT run_id, history FROM workflow_run WHERE history IS NOT NULL").fetchall()
+    for row in rows:
+        try:
+            log = json.loads(row["history"]).get("log", [])
+        except (json.JSONDecodeError, AttributeError):
+            log = []
+        conn.executemany("""
+            INSERT OR IGNORE INTO workflow_event (run_id, seq, timestamp, event, details)
+            VALUES (?, ?, ?, ?, ?)
+        """, [(row["run_id"], seq, entry.get("timestamp", ""), entry.get("event", ""), json.dumps(entry.get("details")))
+              for seq, entry in enumerate(log, 1)])
+        conn.execute("UPDATE workflow_run SET history = NULL WHERE run_id = ?", (row["run_id"],))
+    if rows:
+        logger.info(f"Migrated the history of {len(rows)} run(s) to workflow_event.")
 
-    if not history_json:
-        new_history = {"log": [entry]}
-    else:
-        hist = json.loads(history_json)
-        hist["log"].append(entry)
-        new_history = hist
-
-    return json.dumps(new_history)
-
-def insert_run(run_id: str, source: str, file_path: str, original_ext: str):
+def append_event(conn, run_id: str, event: str, details: dict, timestamp: str = None):
     """
-    Called by File Processor when a new file arrives.
+    Appends one event to the run's log with a single INSERT on the caller's
+    transaction. seq is the next number for the run, looked up through the primary
+    key index, so the cost does not depend on how many events the run already has.
     """
-    event_details = {
-        "source": source,
-        "original_ext": original_ext,
-        "file_path": file_path
-    }
-    history = append_history(None, "file_received", event_details)
+    conn.execute("""
+        INSERT INTO workflow_event (run_id, seq, timestamp, event, details)
+        SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM workflow_event WHERE run_id = ?
+    """, (run_id, timestamp or datetime.now().isoformat(), event, json.dumps(details), run_id))
+
+# --- Write path ---
+# Every stage update is an _apply_*(conn, ...) function that runs on a caller-owned
+# transaction. _write either applies it right away in its own transaction or, in
+# write-behind mode (config.DB_WRITE_BEHIND), hands it to the background writer,
+# which groups queued updates into one transaction per batch. Timestamps are taken
+# when the update is submitted, not when it is written.
 
+@retry_on_locked
+def _apply_now(apply_fn, args):
     with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO workflow_run (
-                run_id, source, file_path, original_ext, current_status, last_updated, history
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (run_id, source, file_path, original_ext, "received",
-              datetime.now().isoformat(), history))
+        apply_fn(conn, *args)
         conn.commit()
 
+@retry_on_locked
+def _apply_batch(batch):
+    with get_conn() as conn:
+        for apply_fn, args in batch:
+            apply_fn(conn, *args)
+        conn.commit()
+
+class WriteBehindWriter:
+    """
+    Background thread that applies queued updates in group transactions: a batch is
+    written once `batch_size` updates are queued or `interval` seconds after its first
+    update, whichever comes first. Updates are applied in submission order.
+    """
+
+    def __init__(self, interval: float, batch_size: int):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.running = False
+        self.counters = {"queued": 0, "written": 0, "batches": 0, "failed": 0}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, name="memory-write-behind", daemon=True)
+        self._thread.start()
+        logger.info(f"Write-behind writer started (interval {self.interval}s, batch size {self.batch_size}).")
+
+    def submit(self, apply_fn, args) -> bool:
+        """Queues one update; returns False once the writer is stopped."""
+        with self._lock:
+            if not self.running:
+                return False
+            self._queue.put((apply_fn, args))
+            self.counters["queued"] += 1
+        return True
+
+    def flush(self, timeout: float = None):
+        """Blocks until every update submitted before this call is committed."""
+        with self._lock:
+            if not self.running:
+                return
+            done = threading.Event()
+            self._queue.put(done)
+        done.wait(timeout)
+
+    def stop(self):
+        """Writes everything still queued and stops the thread."""
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            self._queue.put(None)
+        self._thread.join()
+        logger.info(f"Write-behind writer stopped: {self.counters}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, flushed = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+            for done in flushed:
+                done.set()
+
+    def _write_batch(self, batch: list):
+        if not batch:
+            return
+        try:
+            _apply_batch(batch)
+            self.counters["batches"] += 1
+            self.counters["written"] += len(batch)
+            return
+        except Exception:
+            logger.error(f"Write-behind batch of {len(batch)} updates failed, applying them one by one.", exc_info=True)
+        # One bad update must not drop the rest of its batch
+        for apply_fn, args in batch:
+            try:
+                _apply_now(apply_fn, args)
+                self.counters["written"] += 1
+            except Exception:
+                self.counters["failed"] += 1
+                logger.error(f"Write-behind update {apply_fn.__name__}{args[:1]} failed.", exc_info=True)
+
+_writer = None
+
+def start_write_behind():
+    """Starts the background writer when config.DB_WRITE_BEHIND is set (application startup)."""
+    global _writer
+    if config.DB_WRITE_BEHIND and _writer is None:
+        _writer = WriteBehindWriter(config.DB_WRITE_BEHIND_INTERVAL_SECONDS, config.DB_WRITE_BEHIND_BATCH_SIZE)
+        _writer.start()
+
+def stop_write_behind():
+    """Flushes and stops the background writer (application shutdown)."""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+def flush_writes():
+    """Commits all queued updates; called before a run is read."""
+    if _writer is not None:
+        _writer.flush()
+
+def write_behind_stats():
+    return dict(_writer.counters) if _writer is not None else None
+
+def _write(apply_fn, *args):
+    writer = _writer
+    if writer is None or not writer.submit(apply_fn, args):
+        _apply_now(apply_fn, args)
+
+@Rollups.tracked
+def _apply_insert_run(conn, run_id, source, file_path, original_ext, status, now):
+    conn.execute("""
+        INSERT INTO workflow_run (
+            run_id, source, file_path, original_ext, current_status, last_updated
+        ) VALUES (?, ?, ?, ?, ?, ?)
+    """, (run_id, source, file_path, original_ext, status, now))
+    append_event(conn, run_id, "file_received",
+                 {"source": source, "original_ext": original_ext, "file_path": file_path}, now)
+
+def insert_run(run_id: str, source: str, file_path: str, original_ext: str, status: str = "received"):
+    """
+    Called by the pipeline when a new file arrives.
+    status is "received" for synchronous runs and "queued" for runs submitted to the job queue.
+    """
+    _write(_apply_insert_run, run_id, source, file_path, original_ext, status, datetime.now().isoformat())
+
+@Rollups.tracked
+def _apply_classification(conn, run_id, detected_format, intent, llm_output, routed_to, now):
+    conn.execute("""
+        UPDATE workflow_run
+        SET detected_format = ?, intent = ?, llm_classification = ?,
+            routed_to_agent = ?, current_status = ?, last_updated = ?
+        WHERE run_id = ?
+    """, (detected_format, intent, llm_output, routed_to, "classified", now, run_id))
+    append_event(conn, run_id, "classified",
+                 {"detected_format": detected_format,
+                  "intent": intent,
+                  "llm_output": llm_output,
+                  "routed_to_agent": routed_to}, now)
+
 def update_after_classification(run_id: str, detected_format: str, intent: str, llm_output: str, routed_to: str):
     """
     Called by Classifier Agent.
     """
-    with get_conn() as conn:
-        row = conn.execute("SELECT history FROM workflow_run WHERE run_id = ?", (run_id,)).fetchone()
-        history = append_history(row["history"],
-                                 "classified",
-                                 {"detected_format": detected_format,
-                                  "intent": intent,
-                                  "llm_output": llm_output,
-                                  "routed_to_agent": routed_to})
-
-        conn.execute("""
-            UPDATE workflow_run
-            SET detected_format = ?, intent = ?, llm_classification = ?,
-                routed_to_agent = ?, current_status = ?, last_updated = ?, history = ?
-            WHERE run_id = ?
-        """, (detected_format, intent, llm_output, routed_to,
-              "classified", datetime.now().isoformat(), history, run_id))
-        conn.commit()
+    _write(_apply_classification, run_id, detected_format, intent, llm_output, routed_to, datetime.now().isoformat())
+
+@Rollups.tracked
+def _apply_agent_output(conn, run_id, column, event, output, action_taken, action_payload, now):
+    conn.execute(f"""
+        UPDATE workflow_run
+        SET {column} = ?, action_taken = ?, action_payload = ?,
+            current_status = ?, last_updated = ?
+        WHERE run_id = ?
+    """, (json.dumps(output), action_taken, json.dumps(action_payload), "processed", now, run_id))
+    append_event(conn, run_id, event,
+                 {
+                     column: output,
+                     "action_taken": action_taken,
+                     "action_payload": action_payload
+                 }, now)
 
 def update_pdf_agent(run_id: str, pdf_output: dict, action_taken: str, action_payload: dict):
     """
@@ -104,88 +391,298 @@ def update_pdf_agent(run_id: str, pdf_output: dict, action_taken: str, action_pa
     pdf_output: Python dict (will be converted to JSON string)
     action_payload: Python dict
     """
-    pdf_json = json.dumps(pdf_output)
-    payload_json = json.dumps(action_payload)
+    _write(_apply_agent_output, run_id, "pdf_agent_output", "pdf_processed", pdf_output, action_taken, action_payload, datetime.now().isoformat())
+
+def update_json_agent(run_id: str, json_output: dict, action_taken: str, action_payload: dict):
+    _write(_apply_agent_output, run_id, "json_agent_output", "json_processed", json_output, action_taken, action_payload, datetime.now().isoformat())
 
+def update_email_agent(run_id: str, email_output: dict, action_taken: str, action_payload: dict):
+    _write(_apply_agent_output, run_id, "email_agent_output", "email_processed", email_output, action_taken, action_payload, datetime.now().isoformat())
+
+@Rollups.tracked
+def _apply_action_status(conn, run_id, action_status, now):
+    row = conn.execute("SELECT action_taken, action_payload FROM workflow_run WHERE run_id = ?", (run_id,)).fetchone()
+    event_details = {
+        "action_taken": row["action_taken"],
+        "action_payload": json.loads(row["action_payload"]) if row["action_payload"] else None,
+        "action_status": action_status
+    }
+
+    new_status = "complete" if action_status == "success" else "error"
+    conn.execute("""
+        UPDATE workflow_run
+        SET action_status = ?, current_status = ?, last_updated = ?
+        WHERE run_id = ?
+    """, (action_status, new_status, now, run_id))
+    append_event(conn, run_id, "action_routed", event_details, now)
+
+def update_action_status(run_id: str, action_status: str):
+    _write(_apply_action_status, run_id, action_status, datetime.now().isoformat())
+
+@Rollups.tracked
+def _apply_run_status(conn, run_id, status, event, details, now):
+    updated = conn.execute("""
+        UPDATE workflow_run
+        SET current_status = ?, last_updated = ?
+        WHERE run_id = ?
+    """, (status, now, run_id)).rowcount
+    if updated:
+        append_event(conn, run_id, event, details or {}, now)
+
+def update_run_status(run_id: str, status: str, event: str, details: dict = None):
+    """
+    Sets current_status without touching agent outputs, e.g. when a queued run is
+    picked up by a worker ("processing") or fails before reaching RouteAction ("error").
+    """
+    _write(_apply_run_status, run_id, status, event, details, datetime.now().isoformat())
+
+def _apply_event(conn, run_id, event, details, now):
+    append_event(conn, run_id, event, details, now)
+
+def record_event(run_id: str, event: str, details: dict):
+    """
+    Appends an event to the run's log without touching workflow_run, e.g. the timing
+    of an LLM call ("llm_call").
+    """
+    _write(_apply_event, run_id, event, details, datetime.now().isoformat())
+
+CACHED_COLUMNS = (
+    "detected_format", "intent", "llm_classification", "email_agent_output",
+    "pdf_agent_output", "json_agent_output", "routed_to_agent", "action_taken",
+    "action_payload", "action_status", "current_status",
+)
+
+@retry_on_locked
+def copy_cached_run(run_id: str, original_run_id: str) -> bool:
+    """
+    Called on a result-cache hit. Fills the (already inserted) run with the stage
+    outputs of original_run_id and points cached_from_run_id back to it.
+    Returns False if the original run no longer exists.
+    """
+    flush_writes()
     with get_conn() as conn:
-        row = conn.execute("SELECT history FROM workflow_run WHERE run_id = ?", (run_id,)).fetchone()
-        history = append_history(row["history"],
-                                 "pdf_processed",
-                                 {
-                                     "pdf_agent_output": pdf_output,
-                                     "action_taken": action_taken,
-                                     "action_payload": action_payload
-                                 })
-
-        conn.execute("""
+        original = conn.execute(
+            f"SELECT {', '.join(CACHED_COLUMNS)} FROM workflow_run WHERE run_id = ?", (original_run_id,)
+        ).fetchone()
+        if original is None:
+            return False
+
+        before = Rollups.rollup_key(conn, run_id)
+        assignments = ", ".join(f"{column} = ?" for column in CACHED_COLUMNS)
+        conn.execute(f"""
             UPDATE workflow_run
-            SET pdf_agent_output = ?, action_taken = ?, action_payload = ?,
-                current_status = ?, last_updated = ?, history = ?
+            SET {assignments}, cached_from_run_id = ?, last_updated = ?
             WHERE run_id = ?
-        """, (pdf_json, action_taken, payload_json,
-              "processed", datetime.now().isoformat(), history, run_id))
+        """, (*[original[column] for column in CACHED_COLUMNS], original_run_id,
+              datetime.now().isoformat(), run_id))
+        append_event(conn, run_id, "cache_hit", {"cached_from_run_id": original_run_id})
+        Rollups.move(conn, run_id, before)
         conn.commit()
+    return True
 
-def update_json_agent(run_id: str, json_output: dict, action_taken: str, action_payload: dict):
-    json_str = json.dumps(json_output)
-    payload_str = json.dumps(action_payload)
+def _read_events(conn, run_id: str) -> list:
+    rows = conn.execute(
+        "SELECT seq, timestamp, event, details FROM workflow_event WHERE run_id = ? ORDER BY seq", (run_id,)
+    ).fetchall()
+    return [
+        {"seq": row["seq"], "timestamp": row["timestamp"], "event": row["event"],
+         "details": json.loads(row["details"]) if row["details"] else None}
+        for row in rows
+    ]
 
+@retry_on_locked
+def get_history(run_id: str):
+    """
+    Returns the run's events in order as {"log": [...]} (the shape of the former
+    history column), or None if the run does not exist.
+    """
+    flush_writes()
     with get_conn() as conn:
-        row = conn.execute("SELECT history FROM workflow_run WHERE run_id = ?", (run_id,)).fetchone()
-        history = append_history(row["history"],
-                                 "json_processed",
-                                 {
-                                     "json_agent_output": json_output,
-                                     "action_taken": action_taken,
-                                     "action_payload": action_payload
-                                 })
-
-        conn.execute("""
-            UPDATE workflow_run
-            SET json_agent_output = ?, action_taken = ?, action_payload = ?,
-                current_status = ?, last_updated = ?, history = ?
-            WHERE run_id = ?
-        """, (json_str, action_taken, payload_str,
-              "processed", datetime.now().isoformat(), history, run_id))
-        conn.commit()
+        exists = conn.execute("SELECT 1 FROM workflow_run WHERE run_id = ?", (run_id,)).fetchone()
+        if exists is None:
+            return None
+        return {"log": _read_events(conn, run_id)}
 
-def update_email_agent(run_id: str, email_output: dict, action_taken: str, action_payload: dict):
-    email_str = json.dumps(email_output)
-    payload_str = json.dumps(action_payload)
+JSON_COLUMNS = ("email_agent_output", "pdf_agent_output", "json_agent_output", "action_payload")
 
+@retry_on_locked
+def get_run(run_id: str):
+    """
+    Returns the workflow_run row as a dict (JSON columns decoded, events under
+    "history"), or None if the run does not exist.
+    """
+    flush_writes()
     with get_conn() as conn:
-        row = conn.execute("SELECT history FROM workflow_run WHERE run_id = ?", (run_id,)).fetchone()
-        history = append_history(row["history"],
-                                 "email_processed",
-                                 {
-                                     "email_agent_output": email_output,
-                                     "action_taken": action_taken,
-                                     "action_payload": action_payload
-                                 })
-
-        conn.execute("""
-            UPDATE workflow_run
-            SET email_agent_output = ?, action_taken = ?, action_payload = ?,
-                current_status = ?, last_updated = ?, history = ?
-            WHERE run_id = ?
-        """, (email_str, action_taken, payload_str,
-              "processed", datetime.now().isoformat(), history, run_id))
+        row = conn.execute("SELECT * FROM workflow_run WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        events = _read_events(conn, run_id)
+    run = dict(row)
+    for column in JSON_COLUMNS:
+        if run.get(column):
+            try:
+                run[column] = json.loads(run[column])
+            except json.JSONDecodeError:
+                pass
+    run["history"] = {"log": events}
+    return run
+
+# --- Analytics rollups (memory/Rollups.py) ---
+@retry_on_locked
+def rebuild_rollups() -> int:
+    """Recomputes run_rollup from workflow_run. Returns the number of rollup rows."""
+    flush_writes()
+    with get_conn() as conn:
+        rows = Rollups.rebuild(conn)
         conn.commit()
+    return rows
 
-def update_action_status(run_id: str, action_status: str):
+@retry_on_locked
+def get_stats(since: str = None, until: str = None, granularity: str = "hour") -> list:
+    """
+    Per-hour (or per-day) run counts, error rate and trigger_alert share with breakdowns
+    by intent, format, action and status, served from run_rollup. since/until are ISO
+    timestamps (UTC, like received_at); the default window is the last 24 hours.
+    Raises ValueError on bad input.
+    """
+    if granularity not in Rollups.GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(Rollups.GRANULARITIES)}")
+    default_since, default_until = Rollups.default_window()
+    since = _to_db_timestamp(since) if since else default_since
+    until = _to_db_timestamp(until) if until else default_until
+    flush_writes()
     with get_conn() as conn:
-        row = conn.execute("SELECT action_taken, action_payload, history FROM workflow_run WHERE run_id = ?", (run_id,)).fetchone()
-        event_details = {
-            "action_taken": row["action_taken"],
-            "action_payload": json.loads(row["action_payload"]) if row["action_payload"] else None,
-            "action_status": action_status
-        }
-        history = append_history(row["history"], "action_routed", event_details)
-
-        new_status = "complete" if action_status == "success" else "error"
-        conn.execute("""
-            UPDATE workflow_run
-            SET action_status = ?, current_status = ?, last_updated = ?, history = ?
-            WHERE run_id = ?
-        """, (action_status, new_status, datetime.now().isoformat(), history, run_id))
-        conn.commit()
\ No newline at end of file
+        return Rollups.query(conn, since, until, granularity)
+
+# --- Run listing ---
+LIST_FILTERS = ("intent", "detected_format", "action_status", "current_status")
+LIST_FIELDS = (
+    "run_id", "source", "file_path", "original_ext", "received_at", "detected_format", "intent",
+    "llm_classification", "email_agent_output", "pdf_agent_output", "json_agent_output",
+    "routed_to_agent", "action_taken", "action_payload", "action_status", "current_status",
+    "last_updated", "cached_from_run_id",
+)
+DEFAULT_LIST_FIELDS = ("run_id", "received_at", "detected_format", "intent", "action_taken", "action_status", "current_status")
+MAX_LIST_LIMIT = 500
+
+def _to_db_timestamp(value: str) -> str:
+    """
+    Normalizes an ISO timestamp to the 'YYYY-MM-DD HH:MM:SS' UTC form received_at is
+    stored in (CURRENT_TIMESTAMP). Values with an offset are converted to UTC; naive
+    values are taken as UTC.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    return parsed.strftime("%Y-%m-%d %H:%M:%S")
+
+def encode_cursor(received_at: str, run_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([received_at, run_id]).encode()).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        received_at, run_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return received_at, run_id
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+
+def _list_runs_query(filters: dict, received_from: str, received_to: str, cursor: str, limit: int, fields) -> tuple:
+    unknown = set(fields) - set(LIST_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    # received_at/run_id are always selected; they make up the cursor
+    columns = list(dict.fromkeys(["run_id", "received_at", *fields]))
+
+    clauses, params = [], []
+    for column in LIST_FILTERS:
+        if filters.get(column) is not None:
+            clauses.append(f"{column} = ?")
+            params.append(filters[column])
+    if received_from:
+        clauses.append("received_at >= ?")
+        params.append(_to_db_timestamp(received_from))
+    if received_to:
+        clauses.append("received_at < ?")
+        params.append(_to_db_timestamp(received_to))
+    if cursor:
+        clauses.append("(received_at, run_id) < (?, ?)")
+        params.extend(decode_cursor(cursor))
+
+    sql = f"SELECT {', '.join(columns)} FROM workflow_run"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    sql += " ORDER BY received_at DESC, run_id DESC LIMIT ?"
+    # One extra row tells whether there is a next page
+    params.append(limit + 1)
+    return sql, params
+
+@retry_on_locked
+def list_runs(filters: dict = None, received_from: str = None, received_to: str = None,
+              cursor: str = None, limit: int = 50, fields=DEFAULT_LIST_FIELDS) -> dict:
+    """
+    Lists runs newest first with keyset pagination.
+
+    filters: equality filters on LIST_FILTERS columns; received_from/received_to: ISO
+    timestamps (from inclusive, to exclusive); cursor: next_cursor of the previous page;
+    fields: columns to return (subset of LIST_FIELDS).
+    Returns {"runs": [...], "next_cursor": str or None}. Raises ValueError on bad input.
+    """
+    limit = max(1, min(int(limit), MAX_LIST_LIMIT))
+    sql, params = _list_runs_query(filters or {}, received_from, received_to, cursor, limit, fields)
+    flush_writes()
+    with get_conn() as conn:
+        rows = conn.execute(sql, params).fetchall()
+
+    runs = []
+    for row in rows[:limit]:
+        run = dict(row)
+        for column in JSON_COLUMNS:
+            if run.get(column):
+                try:
+                    run[column] = json.loads(run[column])
+                except json.JSONDecodeError:
+                    pass
+        runs.append(run)
+    next_cursor = encode_cursor(runs[-1]["received_at"], runs[-1]["run_id"]) if len(rows) > limit else None
+    return {"runs": runs, "next_cursor": next_cursor}
+
+def explain_list_runs(**kwargs) -> list:
+    """EXPLAIN QUERY PLAN details of the list_runs query for the given arguments."""
+    sql, params = _list_runs_query(
+        kwargs.get("filters") or {}, kwargs.get("received_from"), kwargs.get("received_to"),
+        kwargs.get("cursor"), kwargs.get("limit", 50), kwargs.get("fields", DEFAULT_LIST_FIELDS),
+    )
+    with get_conn() as conn:
+        return [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+# For testing purposes: check that every list_runs filter is served by an index
+if __name__ == "__main__":
+    import tempfile
+    DB_PATH = os.path.join(tempfile.mkdtemp(), "plan_check.db")
+    init_db()
+    with get_conn() as conn:
+        conn.executemany(
+            "INSERT INTO workflow_run (run_id, source, file_path, original_ext, received_at, detected_format, intent, action_status, current_status) "
+            "VALUES (?, 'upload', 'f', 'pdf', ?, ?, ?, ?, ?)",
+            [(f"run-{i}", f"2025-01-{1 + i % 28:02d} {i % 24:02d}:00:00", ("pdf", "email", "json")[i % 3],
+              ("invoice", "complaint", "rfq", "fraud risk", "regulation")[i % 5],
+              ("success", "failed")[i % 2], ("complete", "error")[i % 2]) for i in range(2000)],
+        )
+        conn.execute("ANALYZE")
+        conn.commit()
+
+    cursor = encode_cursor("2025-01-15 00:00:00", "run-1000")
+    cases = {
+        "no filter": {},
+        "time range": {"received_from": "2025-01-05", "received_to": "2025-01-10"},
+        "intent + cursor": {"filters": {"intent": "invoice"}, "cursor": cursor},
+        "detected_format": {"filters": {"detected_format": "pdf"}},
+        "action_status": {"filters": {"action_status": "failed"}, "received_from": "2025-01-05"},
+        "current_status": {"filters": {"current_status": "error"}},
+    }
+    for name, kwargs in cases.items():
+        plan = explain_list_runs(**kwargs)
+        uses_index = any("USING INDEX" in detail or "USING COVERING INDEX" in detail for detail in plan)
+        sorts = any("TEMP B-TREE" in detail for detail in plan)
+        print(f"{'OK  ' if uses_index and not sorts else 'FAIL'} {name}: {plan}")
+        assert uses_index and not sorts, f"list_runs query for '{name}' does not use an index: {plan}"
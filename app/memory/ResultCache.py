@@ -0,0 +1,148 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from memory.MemoryStore import get_conn, retry_on_locked
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+
+def make_cache_key(file_hash: str) -> str:
+    """
+    Cache key = sha256 of the uploaded bytes + everything that changes the LLM output for them.
+    """
+    return f"{file_hash}:{config.LLM_MODEL}:{config.PROMPT_VERSION}"
+
+
+class ResultCache:
+    """
+    Content-addressed cache of pipeline results (extraction, classification, agent output).
+
+    Two tiers: an in-memory LRU in front of a `result_cache` SQLite table. Entries
+    expire after `ttl_seconds`; the LRU is bounded by `memory_entries` and the table
+    by `db_entries` (least recently used rows are evicted first).
+    """
+
+    def __init__(self, memory_entries: int, db_entries: int, ttl_seconds: int):
+        self.memory_entries = memory_entries
+        self.db_entries = db_entries
+        self.ttl_seconds = ttl_seconds
+        self._lru = OrderedDict()   # key -> (stored_at, entry)
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+    @retry_on_locked
+    def init_table(self):
+        with get_conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS result_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    original_run_id TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_result_cache_last_access ON result_cache(last_access)")
+            conn.commit()
+
+    def _count(self, counter: str, n: int = 1):
+        with self._lock:
+            self.counters[counter] += n
+
+    def _remember(self, key: str, stored_at: float, entry: dict):
+        with self._lock:
+            self._lru[key] = (stored_at, entry)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.memory_entries:
+                self._lru.popitem(last=False)
+
+    @retry_on_locked
+    def get(self, key: str):
+        """
+        Returns the cached entry ({"original_run_id": ..., "result": {...}}) or None.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._lru.get(key)
+            if cached is not None:
+                if now - cached[0] <= self.ttl_seconds:
+                    self._lru.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return cached[1]
+                del self._lru[key]
+
+        with get_conn() as conn:
+            row = conn.execute(
+                "SELECT original_run_id, payload, created_at FROM result_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row["created_at"] > self.ttl_seconds:
+                conn.execute("DELETE FROM result_cache WHERE cache_key = ?", (key,))
+                conn.commit()
+                self._count("expired")
+                row = None
+            if row is None:
+                self._count("misses")
+                return None
+            conn.execute("UPDATE result_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+            conn.commit()
+
+        entry = {"original_run_id": row["original_run_id"], "result": json.loads(row["payload"])}
+        self._remember(key, row["created_at"], entry)
+        self._count("db_hits")
+        return entry
+
+    @retry_on_locked
+    def put(self, key: str, original_run_id: str, result: dict):
+        now = time.time()
+        entry = {"original_run_id": original_run_id, "result": result}
+        with get_conn() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO result_cache (cache_key, original_run_id, payload, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key, original_run_id, json.dumps(result), now, now))
+            # Size-bounded eviction: drop expired rows, then least recently used beyond db_entries
+            expired = conn.execute("DELETE FROM result_cache WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+            evicted = conn.execute("""
+                DELETE FROM result_cache WHERE cache_key IN (
+                    SELECT cache_key FROM result_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.db_entries,)).rowcount
+            conn.commit()
+        self._remember(key, now, entry)
+        self._count("stores")
+        self._count("expired", expired)
+        self._count("evictions", evicted)
+
+    @retry_on_locked
+    def invalidate(self, key: str):
+        with self._lock:
+            self._lru.pop(key, None)
+        with get_conn() as conn:
+            conn.execute("DELETE FROM result_cache WHERE cache_key = ?", (key,))
+            conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self.counters)
+            counters["memory_entries"] = len(self._lru)
+        lookups = counters["memory_hits"] + counters["db_hits"] + counters["misses"]
+        counters["hit_rate"] = round((counters["memory_hits"] + counters["db_hits"]) / lookups, 4) if lookups else 0.0
+        return counters
+
+
+result_cache = ResultCache(
+    memory_entries=config.RESULT_CACHE_MEMORY_ENTRIES,
+    db_entries=config.RESULT_CACHE_DB_ENTRIES,
+    ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+)
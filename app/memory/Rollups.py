@@ -0,0 +1,139 @@
+import logging
+import functools
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+# Hourly counts of runs per (intent, detected_format, action_taken, current_status),
+# bucketed by received_at. Every run is counted exactly once, under its current
+# values: when a MemoryStore update changes any of them, the run moves from its old
+# combination to the new one (-1/+1) in the same transaction as the update.
+# Dashboards read this table instead of aggregating workflow_run.
+
+DIMENSIONS = ("intent", "detected_format", "action_taken", "current_status")
+GRANULARITIES = {"hour": 13, "day": 10}   # prefix length of the hourly bucket
+
+_KEY_SQL = f"""
+    SELECT substr(received_at, 1, 13) || ':00' AS bucket,
+           {', '.join(f"COALESCE({d}, '') AS {d}" for d in DIMENSIONS)}
+    FROM workflow_run WHERE run_id = ?
+"""
+
+
+def init_table(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS run_rollup (
+            bucket TEXT NOT NULL,
+            {' '.join(f"{d} TEXT NOT NULL," for d in DIMENSIONS)}
+            runs INTEGER NOT NULL,
+            PRIMARY KEY (bucket, {', '.join(DIMENSIONS)})
+        )
+    """)
+
+
+def rollup_key(conn, run_id: str):
+    """(bucket, intent, detected_format, action_taken, current_status) of a run, or None."""
+    row = conn.execute(_KEY_SQL, (run_id,)).fetchone()
+    return None if row is None else tuple(row)
+
+
+def bump(conn, key: tuple, delta: int):
+    conn.execute(f"""
+        INSERT INTO run_rollup (bucket, {', '.join(DIMENSIONS)}, runs) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(bucket, {', '.join(DIMENSIONS)}) DO UPDATE SET runs = runs + excluded.runs
+    """, (*key, delta))
+
+
+def move(conn, run_id: str, before):
+    """Moves the run from its `before` combination to its current one."""
+    after = rollup_key(conn, run_id)
+    if before == after:
+        return
+    if before is not None:
+        bump(conn, before, -1)
+    if after is not None:
+        bump(conn, after, 1)
+
+
+def tracked(apply_fn):
+    """
+    Decorator for MemoryStore _apply_*(conn, run_id, ...) functions: keeps run_rollup
+    in step with the columns the update changes.
+    """
+    @functools.wraps(apply_fn)
+    def wrapper(conn, run_id, *args):
+        before = rollup_key(conn, run_id)
+        apply_fn(conn, run_id, *args)
+        move(conn, run_id, before)
+    return wrapper
+
+
+def rebuild(conn) -> int:
+    """Recomputes run_rollup from workflow_run (backfill / repair). Returns the number of rows."""
+    conn.execute("DELETE FROM run_rollup")
+    conn.execute(f"""
+        INSERT INTO run_rollup (bucket, {', '.join(DIMENSIONS)}, runs)
+        SELECT substr(received_at, 1, 13) || ':00',
+               {', '.join(f"COALESCE({d}, '')" for d in DIMENSIONS)},
+               COUNT(*)
+        FROM workflow_run
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+    return conn.execute("SELECT COUNT(*) FROM run_rollup").fetchone()[0]
+
+
+def query(conn, since: str, until: str, granularity: str = "hour") -> list:
+    """
+    Time-bucketed aggregates of the hourly buckets from `since` (inclusive) to `until`
+    (exclusive); both are 'YYYY-MM-DD HH:MM:SS' and truncated to the hour. Cost depends
+    on the number of buckets and combinations in the range, not on the number of runs.
+    """
+    prefix = GRANULARITIES[granularity]
+    rows = conn.execute(f"""
+        SELECT substr(bucket, 1, {prefix}) AS period, {', '.join(DIMENSIONS)}, SUM(runs) AS runs
+        FROM run_rollup
+        WHERE bucket >= substr(?, 1, 13) || ':00' AND bucket < substr(?, 1, 13) || ':00'
+        GROUP BY period, {', '.join(DIMENSIONS)}
+        HAVING SUM(runs) > 0
+        ORDER BY period
+    """, (since, until)).fetchall()
+
+    periods = {}
+    for row in rows:
+        stats = periods.setdefault(row["period"], {
+            "period": row["period"], "runs": 0, "errors": 0, "trigger_alert": 0,
+            **{f"by_{d}": {} for d in DIMENSIONS},
+        })
+        stats["runs"] += row["runs"]
+        if row["current_status"] == "error":
+            stats["errors"] += row["runs"]
+        if row["action_taken"] == "trigger_alert":
+            stats["trigger_alert"] += row["runs"]
+        for d in DIMENSIONS:
+            value = row[d] or "unknown"
+            stats[f"by_{d}"][value] = stats[f"by_{d}"].get(value, 0) + row["runs"]
+
+    for stats in periods.values():
+        stats["error_rate"] = round(stats["errors"] / stats["runs"], 4)
+        stats["trigger_alert_share"] = round(stats["trigger_alert"] / stats["runs"], 4)
+    return list(periods.values())
+
+
+def default_window(hours: int = 24):
+    """(since, until) covering the last `hours` hours, in received_at format (UTC)."""
+    now = datetime.utcnow()
+    return (now - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S"), (now + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Rebuild command: python -m memory.Rollups
+if __name__ == "__main__":
+    from memory.MemoryStore import init_db, rebuild_rollups
+    init_db()
+    logger.info(f"Rebuilt run_rollup: {rebuild_rollups()} rows.")
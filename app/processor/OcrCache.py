@@ -0,0 +1,170 @@
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+# OCR results are cached on local disk in their own SQLite file. It is shared by the
+# API process and the page-extraction pool processes, so hit/miss counters live in
+# the database as well rather than in process memory.
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def _connect():
+    conn = sqlite3.connect(config.OCR_CACHE_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _ensure_tables():
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        conn = _connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ocr_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    ocr_ms REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_access ON ocr_cache(last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS ocr_cache_stats (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+            conn.commit()
+        finally:
+            conn.close()
+        _initialized = True
+
+
+def _bump(conn, **increments):
+    for name, value in increments.items():
+        conn.execute("""
+            INSERT INTO ocr_cache_stats (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        """, (name, value))
+
+
+def image_key(img, settings: str) -> str:
+    """
+    Exact hash of the rendered page/region image (mode, size and pixels) plus the OCR settings.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{img.mode}:{img.size}:{settings}".encode())
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def get(key: str):
+    """Returns the cached OCR text, or None on a miss."""
+    _ensure_tables()
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT text, ocr_ms FROM ocr_cache WHERE cache_key = ?", (key,)).fetchone()
+        if row is None:
+            _bump(conn, misses=1)
+        else:
+            conn.execute("UPDATE ocr_cache SET last_access = ? WHERE cache_key = ?", (time.time(), key))
+            _bump(conn, hits=1, saved_ms=row["ocr_ms"])
+        conn.commit()
+    finally:
+        conn.close()
+    return None if row is None else row["text"]
+
+
+def put(key: str, text: str, ocr_ms: float):
+    """Stores an OCR result and evicts least recently used entries beyond OCR_CACHE_MAX_BYTES."""
+    _ensure_tables()
+    size = len(text.encode("utf-8")) + len(key)
+    conn = _connect()
+    try:
+        previous = conn.execute("SELECT size_bytes FROM ocr_cache WHERE cache_key = ?", (key,)).fetchone()
+        conn.execute("""
+            INSERT OR REPLACE INTO ocr_cache (cache_key, text, size_bytes, ocr_ms, last_access)
+            VALUES (?, ?, ?, ?, ?)
+        """, (key, text, size, ocr_ms, time.time()))
+        _bump(conn, total_bytes=size - (previous["size_bytes"] if previous else 0))
+
+        total = conn.execute("SELECT value FROM ocr_cache_stats WHERE name = 'total_bytes'").fetchone()["value"]
+        while total > config.OCR_CACHE_MAX_BYTES:
+            oldest = conn.execute(
+                "SELECT cache_key, size_bytes FROM ocr_cache ORDER BY last_access LIMIT 100"
+            ).fetchall()
+            if not oldest:
+                break
+            freed = 0
+            for row in oldest:
+                conn.execute("DELETE FROM ocr_cache WHERE cache_key = ?", (row["cache_key"],))
+                freed += row["size_bytes"]
+                if total - freed <= config.OCR_CACHE_MAX_BYTES:
+                    break
+            _bump(conn, total_bytes=-freed, evictions=1)
+            total -= freed
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def cached_ocr(img, ocr_fn, settings: str) -> str:
+    """
+    Returns ocr_fn(img), served from the cache when the same image was OCR'd before
+    with the same settings.
+    """
+    if not config.OCR_CACHE_ENABLED:
+        return ocr_fn(img)
+    key = image_key(img, settings)
+    try:
+        text = get(key)
+    except sqlite3.Error:
+        logger.error("OCR cache lookup failed, running OCR.", exc_info=True)
+        return ocr_fn(img)
+    if text is not None:
+        logger.debug("OCR cache hit.")
+        return text
+
+    started = time.perf_counter()
+    text = ocr_fn(img)
+    try:
+        put(key, text, (time.perf_counter() - started) * 1000)
+    except sqlite3.Error:
+        logger.error("OCR cache store failed.", exc_info=True)
+    return text
+
+
+def stats() -> dict:
+    """Hit/miss counters, hit rate, OCR time saved by hits and the current cache size."""
+    _ensure_tables()
+    conn = _connect()
+    try:
+        values = {row["name"]: row["value"] for row in conn.execute("SELECT name, value FROM ocr_cache_stats")}
+        entries = conn.execute("SELECT COUNT(*) AS n FROM ocr_cache").fetchone()["n"]
+    finally:
+        conn.close()
+    hits, misses = int(values.get("hits", 0)), int(values.get("misses", 0))
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        "saved_ms": round(values.get("saved_ms", 0.0), 1),
+        "evictions": int(values.get("evictions", 0)),
+        "entries": entries,
+        "total_bytes": int(values.get("total_bytes", 0)),
+    }
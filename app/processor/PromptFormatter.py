@@ -0,0 +1,97 @@
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+# Compact prompt form of extracted documents. Page lists are rendered as plain text
+# with tables as pipe-separated rows, empty fields are dropped and whitespace is
+# collapsed; JSON payloads are serialized without indentation or padding.
+
+HORIZONTAL_SPACE_RE = re.compile(r"[ \t\f\v ]+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token) used for prompt budgeting.
+    """
+    return len(text) // 4 + 1
+
+
+def collapse_whitespace(text) -> str:
+    """Collapses runs of spaces/tabs, strips every line and keeps at most one blank line in a row."""
+    lines = [HORIZONTAL_SPACE_RE.sub(" ", line).strip() for line in str(text or "").splitlines()]
+    return BLANK_LINES_RE.sub("\n\n", "\n".join(lines)).strip()
+
+
+def format_table(table: list) -> str:
+    """Renders a pdfplumber table as pipe-separated rows; empty rows are dropped."""
+    rows = []
+    for row in table or []:
+        cells = [" ".join(str(cell).split()) if cell is not None else "" for cell in row]
+        if any(cells):
+            rows.append(" | ".join(cells))
+    return "\n".join(rows)
+
+
+def format_pages(pages: list) -> str:
+    """
+    Renders the page list produced by extract_text_and_tables. Pages without any
+    content are skipped; the OCR text and tables of a page only appear when present.
+    """
+    parts = []
+    for page in pages:
+        sections = []
+        text = collapse_whitespace(page.get("text"))
+        if text:
+            sections.append(text)
+        ocr_text = collapse_whitespace(page.get("ocr_text"))
+        if ocr_text:
+            sections.append(f"[OCR]\n{ocr_text}")
+        for number, table in enumerate(page.get("tables") or [], 1):
+            rendered = format_table(table)
+            if rendered:
+                sections.append(f"[Table {number}]\n{rendered}")
+        if sections:
+            parts.append(f"[Page {page.get('page_number', len(parts) + 1)}]\n" + "\n".join(sections))
+    return "\n\n".join(parts)
+
+
+def _is_page_list(data) -> bool:
+    return isinstance(data, list) and bool(data) and all(isinstance(p, dict) and "page_number" in p for p in data)
+
+
+def to_prompt_text(data) -> str:
+    """
+    Compact prompt form of extracted content: page lists via format_pages, dicts and
+    other lists as compact JSON (nulls are kept, the JSON agent validates them), and
+    plain text with collapsed whitespace.
+    """
+    if _is_page_list(data):
+        return format_pages(data)
+    if isinstance(data, (dict, list)):
+        return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=str)
+    return collapse_whitespace(data)
+
+
+def prompt_input(data, run_ctx=None, purpose: str = "prompt") -> str:
+    """
+    to_prompt_text plus token accounting: the estimated tokens of the compact form and
+    of the previous repr-based form are logged and, when a RunContext is given,
+    recorded as the "<purpose>_input" stage.
+    """
+    text = to_prompt_text(data)
+    tokens = estimate_tokens(text)
+    raw_tokens = estimate_tokens(data if isinstance(data, str) else str(data))
+    logger.debug(f"{purpose} input: {tokens} tokens (was {raw_tokens} as repr).")
+    if run_ctx is not None:
+        run_ctx.mark_stage(f"{purpose}_input", tokens=tokens, raw_tokens=raw_tokens)
+    return text
@@ -0,0 +1,144 @@
+import io
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+
+import config
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+CHUNK_SIZE = 256 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised while spooling when an upload exceeds the configured size limit."""
+
+
+class SpooledUpload:
+    """
+    An uploaded document, written once and read by the extractors without a second copy.
+
+    Bytes are kept in memory up to `memory_threshold`; beyond that they roll over to a
+    unique file in `spool_dir` (so concurrent uploads with the same client filename
+    never collide). The sha256 and size are computed during the same write pass.
+    """
+
+    def __init__(self, filename: str, max_bytes: int = None, memory_threshold: int = None, spool_dir: str = None):
+        self.filename = os.path.basename(filename or "upload")
+        self.extension = self.filename.split('.')[-1].lower()
+        self.max_bytes = max_bytes if max_bytes is not None else config.UPLOAD_MAX_BYTES
+        self.memory_threshold = memory_threshold if memory_threshold is not None else config.UPLOAD_MEMORY_THRESHOLD
+        self.spool_dir = spool_dir or config.UPLOAD_SPOOL_DIR
+        self.size = 0
+        self.path = None          # set once the upload rolls over to disk
+        self._digest = hashlib.sha256()
+        self._buffer = io.BytesIO()
+        self._file = None
+
+    @property
+    def sha256(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def in_memory(self) -> bool:
+        return self.path is None
+
+    @property
+    def display_path(self) -> str:
+        """Value stored in workflow_run.file_path."""
+        return self.path or self.filename
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.close()
+            raise UploadTooLargeError(f"Upload {self.filename} exceeds the limit of {self.max_bytes} bytes.")
+        self._digest.update(chunk)
+        if self._file is None and self.size > self.memory_threshold:
+            self._roll_over()
+        (self._file or self._buffer).write(chunk)
+
+    def _roll_over(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="upload_", suffix=f"_{self.filename}", dir=self.spool_dir)
+        self._file = os.fdopen(fd, "wb")
+        self._file.write(self._buffer.getvalue())
+        self._buffer = None
+        logger.debug(f"Upload {self.filename} rolled over to {self.path}.")
+
+    def finish(self):
+        """Ends the write pass; the upload is read-only afterwards."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return self
+
+    def open(self):
+        """Returns a fresh binary file object positioned at the start of the upload."""
+        if self.path is not None:
+            return open(self.path, "rb")
+        return io.BytesIO(self._buffer.getbuffer())
+
+    def getvalue(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+    def source(self):
+        """What to hand to a worker process: the on-disk path, or the bytes themselves."""
+        return self.path if self.path is not None else self.getvalue()
+
+    def close(self):
+        """Releases the buffer and removes the spooled file, if any."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self._buffer = io.BytesIO()
+
+    def __repr__(self):
+        return f"SpooledUpload({self.filename!r}, size={self.size}, path={self.path!r})"
+
+
+async def spool_upload(upload) -> SpooledUpload:
+    """
+    Streams a FastAPI UploadFile into a SpooledUpload in CHUNK_SIZE pieces, hashing as it
+    goes. Raises UploadTooLargeError as soon as the limit is crossed (or up front when
+    the declared size is already too large).
+    """
+    spooled = SpooledUpload(upload.filename)
+    declared = getattr(upload, "size", None)
+    if declared is not None and declared > spooled.max_bytes:
+        raise UploadTooLargeError(f"Upload {spooled.filename} exceeds the limit of {spooled.max_bytes} bytes.")
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if spooled.path is None and spooled.size + len(chunk) <= spooled.memory_threshold:
+                spooled.write(chunk)
+            else:
+                # Disk writes (and the rollover itself) stay off the event loop
+                await asyncio.to_thread(spooled.write, chunk)
+        return await asyncio.to_thread(spooled.finish)
+    except BaseException:
+        spooled.close()
+        raise
+
+
+def spool_file(file_path: str) -> SpooledUpload:
+    """Spools a local file (CLI / testing entry points)."""
+    spooled = SpooledUpload(file_path)
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            spooled.write(chunk)
+    return spooled.finish()
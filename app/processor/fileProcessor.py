@@ -1,15 +1,20 @@
+import io
 import os
 import json
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import pdfplumber
 import pytesseract
 from PIL import Image
 import logging
 from memory.MemoryStore import insert_run
-import uuid
-
-run_id = str(uuid.uuid4())   # ensure you import uuid
+from core.RunContext import RunContext
+from processor import OcrCache
+from processor.UploadSpool import SpooledUpload, spool_file
 import config
-config.CURRENT_RUN_ID = run_id
 
 
 # Configure logger for this module
@@ -23,116 +28,302 @@ if not logger.handlers:
     logger.addHandler(ch)
 
 # --- PDF text extraction and OCR ---
-def extract_text_and_tables(pdf_path):
-    logger.info(f"Starting extraction from PDF: {pdf_path}")
-    all_data = []
+def _native_dpi(image, width_pt, height_pt):
+    """
+    DPI at which the embedded image is stored, derived from its pixel size and the
+    size it is drawn at on the page (72 pt per inch).
+    """
+    src_w, src_h = image.get("srcsize") or (0, 0)
+    dpis = [px / (pt / 72.0) for px, pt in ((src_w, width_pt), (src_h, height_pt)) if px and pt > 0]
+    return max(dpis) if dpis else config.OCR_MAX_DPI
+
+# Everything that changes OCR output for a given image; part of the OCR cache key
+OCR_SETTINGS = f"tesseract|lang={config.OCR_LANG}"
+
+def _tesseract(img):
+    return pytesseract.image_to_string(img, lang=config.OCR_LANG)
+
+def ocr_page(page, i, ocr_deadline=None):
+    """
+    Adaptive OCR for a page without extractable text or tables.
+    - Pages with no image and no vector graphics are blank and skipped.
+    - Only the bounding boxes of embedded images are rasterized, each at its native
+      resolution clamped to [OCR_MIN_DPI, OCR_MAX_DPI].
+    - Pages with vector graphics but no images fall back to full-page OCR.
+    - Once ocr_deadline (time.time() value) has passed, OCR is skipped.
+    """
+    if ocr_deadline is not None and time.time() > ocr_deadline:
+        logger.warning(f"OCR time budget exhausted, skipping OCR on page {i+1}.")
+        return ""
+
+    page_x0, page_top, page_x1, page_bottom = page.bbox
+    page_area = (page_x1 - page_x0) * (page_bottom - page_top)
+    regions = []
+    for image in page.images:
+        # Clip to the page; images can extend past the crop box
+        x0, top = max(image["x0"], page_x0), max(image["top"], page_top)
+        x1, bottom = min(image["x1"], page_x1), min(image["bottom"], page_bottom)
+        width, height = x1 - x0, bottom - top
+        if width <= 0 or height <= 0 or width * height < config.OCR_MIN_IMAGE_FRACTION * page_area:
+            continue
+        dpi = min(max(_native_dpi(image, width, height), config.OCR_MIN_DPI), config.OCR_MAX_DPI)
+        regions.append(((x0, top, x1, bottom), int(dpi)))
+
+    if not regions:
+        if not page.curves and not page.rects and not page.lines:
+            logger.info(f"Page {i+1} is blank, skipping OCR.")
+            return ""
+        logger.info(f"Page {i+1} has no embedded images, applying full-page OCR.")
+        regions = [(page.bbox, config.OCR_MAX_DPI)]
+
+    texts = []
+    # Reading order: top to bottom, then left to right
+    for bbox, dpi in sorted(regions, key=lambda region: (region[0][1], region[0][0])):
+        logger.debug(f"OCR on page {i+1}, region {tuple(round(v) for v in bbox)} at {dpi} dpi.")
+        img = page.crop(bbox).to_image(resolution=dpi).original
+        text = OcrCache.cached_ocr(img, _tesseract, OCR_SETTINGS).strip()
+        if text:
+            texts.append(text)
+    return "\n".join(texts)
+
+def extract_page(page, i, ocr_deadline=None):
+    """
+    Extracts text, tables and (for pages with neither) OCR text from one pdfplumber page.
+    """
+    logger.debug(f"Processing page {i+1}.")
+    page_data = {
+        "page_number": i + 1,
+        "text": page.extract_text() or "",
+        "tables": [],
+        "ocr_text": ""
+    }
+
+    # Extract tables and store as list of rows
+    tables = page.extract_tables()
+    logger.debug(f"Found {len(tables)} table(s) on page {i+1}.")
+    for table in tables:
+        cleaned_table = [row for row in table if any(cell is not None for cell in row)]
+        if cleaned_table:
+            page_data["tables"].append(cleaned_table)
+
+    # If no text and tables found, apply OCR
+    if not page_data["text"].strip() and not page_data["tables"]:
+        logger.info(f"No text or tables detected on page {i+1}, applying OCR.")
+        page_data["ocr_text"] = ocr_page(page, i, ocr_deadline)
+    return page_data
+
+def open_pdf(pdf_source):
+    """
+    Opens a PDF from a path, raw bytes or a binary file object.
+    """
+    if isinstance(pdf_source, (bytes, bytearray)):
+        pdf_source = io.BytesIO(pdf_source)
+    return pdfplumber.open(pdf_source)
+
+def extract_page_range(pdf_source, start, end, ocr_deadline=None):
+    """
+    Extracts pages [start, end) of a PDF. Runs inside the page-extraction process pool,
+    so it opens the document itself and only returns plain dicts.
+    pdf_source is a path or the document bytes (both can be sent to a worker process).
+    """
+    with open_pdf(pdf_source) as pdf:
+        return [extract_page(pdf.pages[i], i, ocr_deadline) for i in range(start, end)]
+
+# Process pool shared by all requests; created on first use, shut down with the app
+_page_pool = None
+_page_pool_lock = threading.Lock()
+
+def get_page_pool():
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            logger.info(f"Starting PDF page-extraction pool with {config.PDF_POOL_WORKERS} processes.")
+            # The app runs event-loop, writer and worker threads; forking it could copy a
+            # lock held by one of them into the child, so workers start from a clean process
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _page_pool = ProcessPoolExecutor(
+                max_workers=config.PDF_POOL_WORKERS,
+                mp_context=multiprocessing.get_context(method),
+            )
+        return _page_pool
+
+def shutdown_page_pool():
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is not None:
+            _page_pool.shutdown(wait=True, cancel_futures=True)
+            _page_pool = None
+
+def split_page_ranges(page_count, parts):
+    """Splits range(page_count) into at most `parts` contiguous, near-equal ranges."""
+    parts = max(1, min(parts, page_count))
+    size, extra = divmod(page_count, parts)
+    ranges, start = [], 0
+    for part in range(parts):
+        end = start + size + (1 if part < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def extract_text_and_tables(pdf_source):
+    """
+    Generator yielding one page dict at a time, in page order, as soon as it is extracted,
+    so callers can start working on the first pages while the rest are still extracting.
+    pdf_source: a path, the document bytes, or a binary file object.
+    """
+    pdf_name = pdf_source if isinstance(pdf_source, str) else "<in-memory upload>"
+    logger.info(f"Starting extraction from PDF: {pdf_name}")
+    # Per-document OCR budget; an absolute deadline so it also holds across pool processes
+    ocr_deadline = time.time() + config.OCR_TIME_BUDGET_SECONDS if config.OCR_TIME_BUDGET_SECONDS > 0 else None
+    page_count = 0
     try:
-        with pdfplumber.open(pdf_path) as pdf:
-            logger.debug(f"PDF opened successfully with {len(pdf.pages)} pages.")
-            for i, page in enumerate(pdf.pages):
-                logger.debug(f"Processing page {i+1}.")
-                page_data = {
-                    "page_number": i + 1,
-                    "text": page.extract_text() or "",
-                    "tables": [],
-                    "ocr_text": ""
-                }
-
-                # Extract tables and store as list of rows
-                tables = page.extract_tables()
-                logger.debug(f"Found {len(tables)} table(s) on page {i+1}.")
-                for table in tables:
-                    cleaned_table = [row for row in table if any(cell is not None for cell in row)]
-                    if cleaned_table:
-                        page_data["tables"].append(cleaned_table)
-
-                # If no text and tables found, apply OCR
-                if not page_data["text"].strip() and not page_data["tables"]:
-                    logger.info(f"No text or tables detected on page {i+1}, applying OCR.")
-                    img = page.to_image(resolution=300).original
-                    ocr_text = pytesseract.image_to_string(img)
-                    page_data["ocr_text"] = ocr_text.strip()
-                    
-                all_data.append(page_data)
-            logger.info("Completed extraction from PDF in Json format.")
-            logger.info(">>>"*30)
-            logger.debug(f"Extracted data: {json.dumps(all_data, indent=2)}")
-            logger.info("<<<"*30)
+        with open_pdf(pdf_source) as pdf:
+            page_count = len(pdf.pages)
+            logger.debug(f"PDF opened successfully with {page_count} pages.")
+            parallel = config.PDF_POOL_WORKERS > 0 and page_count >= config.PDF_PARALLEL_MIN_PAGES
+            if not parallel:
+                for i, page in enumerate(pdf.pages):
+                    page_data = extract_page(page, i, ocr_deadline)
+                    logger.debug(f"Extracted page {i+1}: {json.dumps(page_data)}")
+                    yield page_data
+
+        if parallel:
+            # Spread page ranges over the shared process pool; ranges are yielded in page order
+            ranges = split_page_ranges(page_count, config.PDF_PAGES_PARALLELISM)
+            logger.info(f"Extracting {page_count} pages in {len(ranges)} parallel range(s).")
+            if hasattr(pdf_source, "read"):
+                # File objects cannot be sent to worker processes
+                pdf_source.seek(0)
+                pdf_source = pdf_source.read()
+            pool = get_page_pool()
+            futures = [pool.submit(extract_page_range, pdf_source, start, end, ocr_deadline) for start, end in ranges]
+            try:
+                for future in futures:
+                    for page_data in future.result():
+                        logger.debug(f"Extracted page {page_data['page_number']}: {json.dumps(page_data)}")
+                        yield page_data
+            finally:
+                # Closed early by the caller: ranges not started yet are not extracted
+                for future in futures:
+                    future.cancel()
+
+        logger.info(f"Completed extraction of {page_count} page(s) from PDF in Json format.")
     except Exception as e:
-        logger.error(f"Error during PDF extraction for {pdf_path}", exc_info=True)
+        logger.error(f"Error during PDF extraction for {pdf_name}", exc_info=True)
         raise e
-    return all_data
-
-# --- Convert JSON data into human-readable text ---
-def json_to_llm_text(data: dict, indent=0) -> str:
-    logger.debug("Converting JSON data into human-readable text for LLM input.")
-    output_lines = []
-    indent_str = '  ' * indent
-
-    if isinstance(data, dict):
-        for key, value in data.items():
-            if isinstance(value, (dict, list)):
-                output_lines.append(f"{indent_str}{key.capitalize()}:")
-                output_lines.append(json_to_llm_text(value, indent + 1))
-            else:
-                output_lines.append(f"{indent_str}{key.capitalize()}: {value}")
-    elif isinstance(data, list):
-        for idx, item in enumerate(data):
-            output_lines.append(f"{indent_str}- Item {idx + 1}:")
-            output_lines.append(json_to_llm_text(item, indent + 1))
-    else:
-        output_lines.append(f"{indent_str}{data}")
 
-    result = "\n".join(output_lines)
-    logger.debug("Conversion completed.")
-    return result
+async def iter_pages_async(pdf_source):
+    """
+    Async iterator over extract_text_and_tables: extraction runs in a worker thread and
+    each page is handed to the event loop as soon as it is ready. If the consumer stops
+    early (cancelled, raised, or closed the iterator), extraction stops after the page
+    in progress instead of running through the rest of the document.
+    """
+    loop = asyncio.get_running_loop()
+    pages = asyncio.Queue()
+    done = object()
+    stopped = threading.Event()
 
-# --- File type detection and processing ---
-def process_file(file_path):
-    logger.info(f"Processing file: {file_path}")
-    file_extension = file_path.split('.')[-1].lower()
+    def produce():
+        pages_iter = extract_text_and_tables(pdf_source)
+        try:
+            for page_data in pages_iter:
+                if stopped.is_set():
+                    logger.info("PDF extraction stopped early; the consumer is gone.")
+                    return
+                loop.call_soon_threadsafe(pages.put_nowait, page_data)
+            loop.call_soon_threadsafe(pages.put_nowait, done)
+        except Exception as e:
+            if not stopped.is_set():
+                loop.call_soon_threadsafe(pages.put_nowait, e)
+        finally:
+            pages_iter.close()
+
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await pages.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+        await producer
+    finally:
+        stopped.set()
+
+def page_text_length(page_data) -> int:
+    """Amount of text a page contributes (text, OCR text and table cells)."""
+    table_chars = sum(len(str(cell)) for table in page_data["tables"] for row in table for cell in row if cell)
+    return len(page_data["text"]) + len(page_data["ocr_text"]) + table_chars
 
-    insert_run(config.CURRENT_RUN_ID, "upload", file_path, file_extension)
+# --- File type detection and processing ---
+def register_run(upload: SpooledUpload, run_ctx: RunContext, status: str = "received"):
+    """
+    Creates the workflow_run row for this run. Called once per run, before extraction
+    (or at submission time for queued runs).
+    """
+    file_path = upload.display_path
+    file_extension = upload.extension
+    run_ctx.file_path = file_path
+    run_ctx.original_ext = file_extension
+    insert_run(run_ctx.run_id, run_ctx.source, file_path, file_extension, status)
+    run_ctx.mark_stage(status, file_path=file_path, original_ext=file_extension, size=upload.size, sha256=upload.sha256)
     logger.info("#### Memory Update")
-    logger.info(f"insert_run called with run_id: {run_id}, source: 'upload', file_path: {file_path}, original_ext: {file_extension}")
+    logger.info(f"insert_run called with run_id: {run_ctx.run_id}, source: '{run_ctx.source}', file_path: {file_path}, original_ext: {file_extension}, status: {status}")
+
+def process_file(upload: SpooledUpload, run_ctx: RunContext):
+    """
+    Extracts the content of a spooled upload: str for .txt, parsed JSON for .json and
+    the page list for .pdf. The spooled buffer/file is read directly; nothing is copied
+    to another location first.
+    """
+    logger.info(f"Processing file: {upload.filename} (run_id: {run_ctx.run_id})")
+    file_extension = upload.extension
 
     if file_extension == "txt":
         try:
             logger.info("Detected text file.")
-            with open(file_path, 'r', encoding='utf-8') as file:
-                text = file.read()
+            with upload.open() as file:
+                text = io.TextIOWrapper(file, encoding='utf-8').read()
             logger.info("Text file processed successfully.")
             return text
         except Exception as e:
-            logger.error(f"Error processing text file: {file_path}", exc_info=True)
+            logger.error(f"Error processing text file: {upload.filename}", exc_info=True)
             raise e
 
     elif file_extension == "json":
         try:
             logger.info("Detected JSON file.")
-            with open(file_path, 'r', encoding='utf-8') as file:
+            with upload.open() as file:
                 data = json.load(file)
             logger.info("JSON file processed successfully.")
             return data
         except Exception as e:
-            logger.error(f"Error processing JSON file: {file_path}", exc_info=True)
+            logger.error(f"Error processing JSON file: {upload.filename}", exc_info=True)
             raise e
 
     elif file_extension == "pdf":
         try:
             logger.info("Detected PDF file.")
-            extracted_data = extract_text_and_tables(file_path)
-            # converted_text = json_to_llm_text(extracted_data)
+            extracted_data = list(extract_text_and_tables(upload.path or upload.open()))
             logger.info("PDF file processed successfully.")
             return extracted_data
         except Exception as e:
-            logger.error(f"Error processing PDF file: {file_path}", exc_info=True)
+            logger.error(f"Error processing PDF file: {upload.filename}", exc_info=True)
             raise e
 
     else:
         logger.error(f"Unsupported file format: {file_extension}")
         raise ValueError("Unsupported file format. Please provide a .txt, .json, or .pdf file.")
 
+async def process_file_async(upload: SpooledUpload, run_ctx: RunContext):
+    """
+    Awaitable wrapper around process_file.
+    PDF parsing/OCR is blocking, so it runs in a worker thread instead of on the event loop.
+    """
+    return await asyncio.to_thread(process_file, upload, run_ctx)
+
 # --- Main entry point for testing ---
 if __name__ == "__main__":
     file_path = r"E:\langflow_directory\gitRepos\FlowbitAI\app\sampleFiles\pdfs\statement.pdf"  # Change to your test file path
@@ -142,7 +333,10 @@ if __name__ == "__main__":
         logger.error(f"File not found: {file_path}")
         exit(1)
     try:
-        processed_data = process_file(file_path)
+        run_ctx = RunContext()
+        upload = spool_file(file_path)
+        register_run(upload, run_ctx)
+        processed_data = process_file(upload, run_ctx)
         logger.info("Processed Data:")
         logger.info(processed_data)
     except Exception as e:
@@ -1,24 +1,82 @@
-from agents.EmailAgent import processEmail
-from agents.JsonAgent import processJson
-from agents.PdfAgent import processPdf
+import asyncio
+import logging
+from agents.EmailAgent import processEmail, processEmailBatch
+from agents.JsonAgent import processJson, processJsonBatch
+from agents.PdfAgent import processPdf, processPdfBatch
+from core.RunContext import RunContext
 
-def route_to_agent(file_path: str, classification: dict, extracted_text: str):
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+if not logger.handlers:
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.DEBUG)
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+
+async def route_to_agent(file_path: str, classification: dict, extracted_text: str, run_ctx: RunContext):
     """Routes the file to the appropriate agent based on its format and intent.
     Args:
         file_path (str): The path to the file being processed.
         classification (dict): A dictionary containing the classification results with keys 'format' and 'intent'.
         extracted_text (str): The text extracted from the file.
+        run_ctx (RunContext): The per-request run context passed on to the agent.
     Returns:
         dict: The result from the appropriate agent, or a message indicating an unknown format.
     """
     file_format = classification["format"].lower()
 
     if file_format == "email":
-        return processEmail( extracted_text)
+        return await processEmail(extracted_text, run_ctx)
     elif file_format == "json":
-        return processJson( extracted_text)
+        return await processJson(extracted_text, run_ctx)
     elif file_format == "pdf":
-        return processPdf(extracted_text)
+        return await processPdf(extracted_text, run_ctx)
     else:
-        print("❌ Unknown format. No agent triggered.")
+        logger.warning(f"[{run_ctx.run_id}] Unknown format {classification.get('format')!r}. No agent triggered.")
         return {"status": "skipped", "reason": "Unknown format"}
+
+BATCH_AGENTS = {
+    "email": processEmailBatch,
+    "json": processJsonBatch,
+    "pdf": processPdfBatch,
+}
+
+async def route_batch_to_agents(classifications: list, extracted_texts: list, run_ctxs: list) -> list:
+    """Groups documents by detected format and runs each agent chain once as a batch.
+    Args:
+        classifications (list): Classification dicts, one per document.
+        extracted_texts (list): Extracted text/data, one per document.
+        run_ctxs (list): RunContext of each document.
+    Returns:
+        list: Agent results in input order; a failed document holds its Exception.
+    """
+    results = [None] * len(classifications)
+    groups = {}
+    for idx, classification in enumerate(classifications):
+        try:
+            file_format = (classification.get("format") or "").lower()
+        except Exception as e:
+            # Malformed classification: fail this document only
+            results[idx] = e
+            continue
+        if file_format in BATCH_AGENTS:
+            groups.setdefault(file_format, []).append(idx)
+        else:
+            logger.warning(f"[{run_ctxs[idx].run_id}] Unknown format {classification.get('format')!r}. No agent triggered.")
+            results[idx] = {"status": "skipped", "reason": "Unknown format"}
+
+    group_results = await asyncio.gather(*(
+        BATCH_AGENTS[file_format](
+            [extracted_texts[i] for i in indexes],
+            [run_ctxs[i] for i in indexes],
+        )
+        for file_format, indexes in groups.items()
+    ), return_exceptions=True)
+    for indexes, agent_results in zip(groups.values(), group_results):
+        if isinstance(agent_results, Exception):
+            # The whole batch call failed: every document of that format holds the error
+            agent_results = [agent_results] * len(indexes)
+        for idx, agent_result in zip(indexes, agent_results):
+            results[idx] = agent_result
+    return results
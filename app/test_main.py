@@ -1,13 +1,16 @@
 import os
+import asyncio
 import logging
 import logging.config
 
 
-from processor.fileProcessor import process_file
+from processor.fileProcessor import process_file_async, register_run
+from processor.UploadSpool import spool_file
 from agents.ClassifierAgent import classifyInput
 from router.AgentRouter import route_to_agent
 from core.ActionRouter import RouteAction
 from memory.MemoryStore import init_db
+from core.RunContext import RunContext
 
 lineLen = 60
 
@@ -45,7 +48,7 @@ LOGGING_CONFIG = {
 logging.config.dictConfig(LOGGING_CONFIG)
 logger = logging.getLogger(__name__)
 
-def main():
+async def main():
 
     logger.info("\n"*5)
     logger.info("=" * 30 + " NEW SECTION " + "=" * 30)
@@ -61,8 +64,12 @@ def main():
         print("File does not exist. Please check the path.")
         return
 
+    run_ctx = RunContext(source="cli")
+    upload = spool_file(file_path)
+
     try:
-            extractedText = process_file(file_path)
+            register_run(upload, run_ctx)
+            extractedText = await process_file_async(upload, run_ctx)
 
             print("\n📄 Extracted Text:")
             print(extractedText)
@@ -72,14 +79,14 @@ def main():
 
 
 
-            classification = classifyInput(extractedText)
+            classification = await classifyInput(extractedText, run_ctx)
 
             print("\n📂 File Classification:")
             print(classification)
             logger.info("_"*30)
 
 
-            agent_result = route_to_agent(file_path, classification, extractedText)
+            agent_result = await route_to_agent(file_path, classification, extractedText, run_ctx)
 
             print("\n🧠 Agent Output:")
             print(agent_result)
@@ -87,7 +94,7 @@ def main():
 
 
 
-            action_response = RouteAction(agent_result)
+            action_response = await RouteAction(agent_result, run_ctx)
 
             print("\n✅ Action Router Response:")
             print(action_response)
@@ -97,6 +104,9 @@ def main():
             
     except ValueError as e:
         print(f"❌ Error: {e}")
+    finally:
+        # Removes the spooled temp file of a large upload
+        upload.close()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())